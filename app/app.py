@@ -1,6 +1,7 @@
 from flask import Flask
 from blueprints.graph import graph_bp
 from lib.constants import logger
+from modules.request_tracing import init_request_tracing
 
 
 def create_app():
@@ -15,6 +16,9 @@ def create_app():
     logger.info("Registering blueprints...")
     app.register_blueprint(graph_bp)
     logger.info("Blueprints registered successfully")
+
+    # Per-request query spans and the /metrics endpoint
+    init_request_tracing(app)
     
     return app
 
@@ -0,0 +1,225 @@
+import asyncio
+import json
+from urllib.parse import parse_qsl
+
+# Serving with asgi.py needs uvicorn (the server) and asgiref (to serve the Flask app for every other route)
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    WsgiToAsgi = None
+
+from app import create_app
+from blueprints.graph import aggregate_graph_data
+from lib.constants import logger, AGGREGATION_NODE_BUDGET, QUERY_CONCURRENCY, GRAPH_BACKEND
+from lib.neo4j_connection import create_async_driver, create_driver
+from modules.async_graph import AsyncQueries, collect_graph_nodes_async, get_graph_data_async
+from modules.date_window import parse_date_window
+from modules.graph_layout import apply_layout
+from modules.neo4j_get_initial_nodes import get_initial_nodes_async
+from modules.request_tracing import RequestTrace, TracingDriver, SEARCH_TYPES
+from modules.work_budget import query_timeout_for, work_budget_for
+
+GRAPH_DATA_ENDPOINT = '/api/graph-data'
+
+
+def _int_arg(args, name, default):
+    try:
+        return int(args.get(name, default))
+    except (ValueError, TypeError):
+        return default
+
+
+def _serves_natively(scope, args):
+    """
+    Whether a request is a graph search served on the async driver: JSON graph data with lazy details,
+    as the frontend requests it. Everything else (streaming, compact, fake data, the overlap
+    projection, cluster drill-downs, paged searches, the in-memory graph backend and the other routes)
+    is served by the Flask app.
+    """
+    return (GRAPH_BACKEND == 'neo4j' and scope['path'] == GRAPH_DATA_ENDPOINT and scope['method'] == 'GET'
+            and args.get('fake_data', 'false').lower() != 'true'
+            and args.get('responseFormat', 'json').lower() == 'json'
+            and args.get('lazyDetails', 'false').lower() == 'true'
+            and args.get('useOverlapProjection', 'false').lower() != 'true'
+            and 'cluster' not in args
+            and not args.get('limit'))
+
+
+async def _wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+class PersonaTraceASGI:
+    """
+    ASGI application serving graph searches with the neo4j async driver.
+
+    A search waiting on Neo4j doesn't hold a thread, so the number of concurrent searches is
+    bounded by the database rather than by the server's threads, and the independent lookups
+    of a search run concurrently (see modules/async_graph.py). Other requests are passed on to
+    the Flask app, which runs them on a thread pool.
+    """
+
+    def __init__(self, flask_app):
+        self.wsgi = WsgiToAsgi(flask_app)
+        # Shared by all requests, opened on first use
+        self.driver = None
+        # Sync driver used by aggregation, which runs on a worker thread
+        self.sync_driver = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] == 'http':
+            # First value of each parameter, as Flask's request.args.get
+            args = {}
+            for name, value in parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True):
+                args.setdefault(name, value)
+            if _serves_natively(scope, args):
+                await self._graph_data(args, receive, send)
+                return
+        await self.wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.driver is not None:
+                    await self.driver.close()
+                if self.sync_driver is not None:
+                    self.sync_driver.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _async_driver(self):
+        if self.driver is None:
+            self.driver = create_async_driver()
+        return self.driver
+
+    def _sync_driver(self):
+        if self.sync_driver is None:
+            self.sync_driver = create_driver()
+        return self.sync_driver
+
+    async def _graph_data(self, args, receive, send):
+        logger.info("API request received for graph data (async)...")
+        search_type = args.get('searchType', '')
+        trace = RequestTrace(GRAPH_DATA_ENDPOINT, search_type if search_type in SEARCH_TYPES or not search_type else 'other',
+                             query_timeout_for(GRAPH_DATA_ENDPOINT), work_budget_for(GRAPH_DATA_ENDPOINT))
+
+        search = asyncio.ensure_future(self._search(args, trace))
+        disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+        await asyncio.wait({search, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+        if not search.done():
+            # Cancelling the search closes its sessions, so Neo4j terminates the running queries
+            logger.info("Client disconnected, cancelling the graph search")
+            if trace.budget is not None:
+                trace.budget.stop('client_disconnected')
+            search.cancel()
+            try:
+                await search
+            except asyncio.CancelledError:
+                pass
+            trace.finish('499')
+            return
+        disconnected.cancel()
+
+        status, data = search.result()
+        body = json.dumps(data, separators=(',', ':'), default=str).encode('utf-8')
+        seconds, db_seconds = trace.finish(str(status))
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+                # Total time of the (overlapping) queries and of the whole request
+                (b'server-timing', (f'db;dur={db_seconds * 1000:.1f};desc="{len(trace.spans)} concurrent queries", '
+                                    f'total;dur={seconds * 1000:.1f}').encode()),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _search(self, args, trace):
+        """Run the graph search of api_graph_data, returning (status, response data)."""
+        try:
+            search_type = args.get('searchType')
+            show_nodes_only_search = args.get('showNodesOnlySearch', 'false').lower() == 'true'
+            show_nodes_only_overlaps = args.get('showNodesOnlyOverlaps', 'false').lower() == 'true'
+            num_hops_node_search = _int_arg(args, 'numHopsNodeSearch', 1)
+            num_hops_show_all_overlaps = _int_arg(args, 'numHopsShowAllOverlaps', 1)
+            server_layout = args.get('layout', '').lower() == 'server'
+            aggregate = args.get('aggregate', 'auto').lower() != 'off'
+            cluster_by = args.get('clusterBy', 'label').lower()
+            try:
+                date_window = parse_date_window(args.get('dateFrom', ''), args.get('dateTo', ''), args.get('lastDays', ''))
+            except ValueError as e:
+                return 400, {
+                    'error': f"Invalid date window: {e}",
+                    'type': 'Invalid parameters'
+                }
+
+            queries = AsyncQueries(self._async_driver(), trace, QUERY_CONCURRENCY)
+            initial_nodes = await get_initial_nodes_async(
+                queries,
+                search_type=search_type,
+                search_value=args.get('searchValue'),
+                search_operator=args.get('searchOperator', 'equals'),
+                node_type=args.get('nodeType'),
+                num_connections_show_all_overlaps=_int_arg(args, 'numConnectionsShowAllOverlaps', 1),
+                case_sensitive_search=args.get('caseSensitiveSearch', 'false').lower() == 'true',
+                search_source_select=args.get('searchSourceSelect', ''),
+                overlap_source_select1=args.get('overlapSourceSelect1', ''),
+                overlap_source_select2=args.get('overlapSourceSelect2', ''),
+                date_window=date_window
+            )
+            logger.info(f"Found {len(initial_nodes)} initial nodes")
+            if not initial_nodes:
+                return 200, {
+                    'error': 'No initial nodes found',
+                    'traceback': '',
+                    'type': 'No initial nodes found'
+                }
+
+            num_hops = queries.budget.clip_hops(num_hops_node_search if search_type in ('nodeValue', 'persona') else num_hops_show_all_overlaps)
+            all_nodes = await collect_graph_nodes_async(queries, initial_nodes, num_hops, show_nodes_only_search, show_nodes_only_overlaps, date_window)
+
+            if aggregate and len(all_nodes) > AGGREGATION_NODE_BUDGET:
+                logger.info(f"{len(all_nodes)} nodes exceed the aggregation node budget of {AGGREGATION_NODE_BUDGET}, aggregating by {cluster_by}")
+                data = await asyncio.to_thread(aggregate_graph_data, TracingDriver(self._sync_driver(), trace), all_nodes, cluster_by, True)
+                data['metadata'].update(queries.budget.metadata())
+            else:
+                data = await get_graph_data_async(queries, initial_nodes, all_nodes, show_nodes_only_search, show_nodes_only_overlaps)
+
+            if server_layout:
+                await asyncio.to_thread(apply_layout, data)
+            logger.info("Successfully returned graph data via API (async)")
+            return 200, data
+
+        except Exception as e:
+            import traceback
+            logger.error("API error:")
+            logger.error(f"Error: {str(e)}\nTraceback: {traceback.format_exc()}")
+            return 500, {
+                'error': "An error occurred while fetching graph data",
+                'traceback': "",
+                'type': type(e).__name__
+            }
+
+
+application = PersonaTraceASGI(create_app()) if WsgiToAsgi is not None else None
+
+if __name__ == '__main__':
+    if uvicorn is None or application is None:
+        raise SystemExit("Serving with asgi.py needs uvicorn and asgiref, the asgi extra: uv run --extra asgi asgi.py (or pip install -r requirements-asgi.txt)")
+    logger.info("Starting PersonaTrace in ASGI mode...")
+    uvicorn.run(application, host='0.0.0.0', port=5500, ssl_certfile='test_certs/ssl_cert.pem', ssl_keyfile='test_certs/ssl_key.pem')
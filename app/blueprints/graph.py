@@ -1,27 +1,56 @@
-from flask import Blueprint, render_template, current_app, jsonify, request
+from flask import Blueprint, render_template, current_app, jsonify, request, Response, stream_with_context
 from neo4j import GraphDatabase
-import random
 
 import logging
-from lib.constants import NODE_COLORS, RELATIONSHIP_COLORS_OPTIONS, logger, FIND_PATHS_MAX_DEPTH
+from lib.constants import logger, SOURCE_LOOKUP_BATCH_SIZE, FIND_PATHS_MAX_DEPTH, GRAPH_STREAM_CHUNK_SIZE, GRAPH_STREAM_RELATIONSHIP_CHUNK_SIZE, AGGREGATION_NODE_BUDGET, BULK_MATCH_CHUNK_SIZE, NON_IDENTIFIER_LABELS
 from lib.neo4j_connection import get_neo4j_connection
 from modules.neo4j_get_initial_nodes import get_initial_nodes
 from modules.fake_data import make_fake_graph_data
+from modules.graph_wire_format import encode_compact_graph, compress_payload
+from modules.graph_layout import apply_layout
+from modules.graph_aggregation import iter_relationship_endpoints, assign_clusters, summarize_clusters, OTHER_CLUSTER_KEY
+from modules.overlap_projection import collect_nodes_via_overlap_projection
+from modules.source_overlap import get_source_overlap_matrix
+from modules.bulk_match import iter_bulk_values, iter_bulk_matches
+from modules.date_window import parse_date_window
+from modules.request_tracing import render_metrics, log_sampled, current_work_budget
+from modules.work_budget import WorkBudget
+from modules.slow_queries import read_slow_queries, slow_query_log
+from modules.parallel_queries import batches, run_on_sessions, submit_on_session
+from modules.search_pages import parse_search_page, ORDERINGS
+from modules.graph_backend import graph_backend, UnsupportedFeatureError
+from modules.graph_format import (get_node_color, get_relationship_color, flatten_properties, build_observation_tooltip, node_to_dict,
+                                  format_graph_node, format_graph_relationship, graph_data_metadata, RELATIONSHIP_COLOR_ASSIGNMENTS)
+from itertools import islice
+from personatrace_common.graph_schema import OBSERVATION_LABEL
 import json
+import shutil
+import tempfile
 
 # Blueprint for the graph page
 graph_bp = Blueprint('graph', __name__)
 
-# Global dictionaries to maintain consistent color assignments across requests
-NODE_COLOR_ASSIGNMENTS = {}
-RELATIONSHIP_COLOR_ASSIGNMENTS = {}
-
-
 @graph_bp.route('/')
 def index():
     logger.info("Rendering graph visualization page...")
     fake_data = request.args.get('fake_data', 'false').lower() == 'true'
-    return render_template('graph/index.html', fake_data=fake_data)
+    stream_graph_data = request.args.get('stream', 'false').lower() == 'true'
+    compact_graph_data = request.args.get('compact', 'false').lower() == 'true'
+    server_layout = request.args.get('layout', '').lower() == 'server'
+    overlap_projection = request.args.get('overlapProjection', 'false').lower() == 'true'
+    try:
+        min_shared_identifiers = int(request.args.get('minSharedIdentifiers', '1'))
+    except ValueError:
+        min_shared_identifiers = 1
+    try:
+        page_size = max(int(request.args.get('pageSize', '0')), 0)
+    except ValueError:
+        page_size = 0
+    order_by = request.args.get('orderBy', 'observations').lower()
+    if order_by not in ORDERINGS:
+        order_by = 'observations'
+    return render_template('graph/index.html', fake_data=fake_data, stream_graph_data=stream_graph_data, compact_graph_data=compact_graph_data, server_layout=server_layout,
+                           overlap_projection=overlap_projection, min_shared_identifiers=min_shared_identifiers, page_size=page_size, order_by=order_by)
 
 
 @graph_bp.route('/api/graph-data')
@@ -51,6 +80,36 @@ def api_graph_data():
         show_nodes_only_overlaps = request.args.get('showNodesOnlyOverlaps', 'false').lower() == 'true'
         # Fake data parameter
         fake_data = request.args.get('fake_data', 'false').lower() == 'true'
+        # Response format - 'json' (default), 'ndjson' to stream nodes and relationships as they are produced
+        # or 'compact' for the columnar wire format
+        response_format = request.args.get('responseFormat', 'json').lower()
+        # Compress compact responses if the client accepts it
+        compress = request.args.get('compress', 'true').lower() == 'true'
+        # Leave tooltips and node properties out of the response, they are fetched from /api/node-details on hover
+        lazy_details = request.args.get('lazyDetails', 'false').lower() == 'true'
+        # Precompute node coordinates on the server ('server') so the client can render without physics
+        server_layout = request.args.get('layout', '').lower() == 'server'
+        # Aggregate results above AGGREGATION_NODE_BUDGET nodes into clusters ('auto', default) or never ('off'),
+        # clustering by 'label' (label, plus source for observations) or connected 'component'
+        aggregate = request.args.get('aggregate', 'auto').lower() != 'off'
+        cluster_by = request.args.get('clusterBy', 'label').lower()
+        # Drill down into one cluster of an aggregated result, given its cluster key
+        cluster_key = request.args.get('cluster')
+        # Expand hops over the shares_identifiers overlap projection (built by the dataloader) instead
+        # of the two-hop observation -> identifier -> observation pattern, optionally only following
+        # observation pairs that share at least minSharedIdentifiers identifiers
+        use_overlap_projection = request.args.get('useOverlapProjection', 'false').lower() == 'true'
+        min_shared_identifiers = request.args.get('minSharedIdentifiers', '1')
+        # Only use observations dated within dateFrom..dateTo (YYYY-MM-DD, both inclusive) or the
+        # last lastDays days, for the search as well as the hop expansion
+        date_from = request.args.get('dateFrom', '')
+        date_to = request.args.get('dateTo', '')
+        last_days = request.args.get('lastDays', '')
+        # Only return one page of limit initial nodes, ranked by orderBy ('observations', 'sources' or
+        # 'recency'), after the cursor of the previous page
+        page_limit = request.args.get('limit', '')
+        page_order_by = request.args.get('orderBy', 'observations')
+        page_cursor = request.args.get('cursor', '')
         print(f"Fake data: {fake_data}")
         # Convert num_hops to integer with default value of 2
         try:
@@ -65,6 +124,24 @@ def api_graph_data():
             num_hops_show_all_overlaps = int(num_hops_show_all_overlaps)
         except (ValueError, TypeError):
             num_hops_show_all_overlaps = 1
+        try:
+            min_shared_identifiers = int(min_shared_identifiers)
+        except (ValueError, TypeError):
+            min_shared_identifiers = 1
+        try:
+            date_window = parse_date_window(date_from, date_to, last_days)
+        except ValueError as e:
+            return jsonify({
+                'error': f"Invalid date window: {e}",
+                'type': 'Invalid parameters'
+            }), 400
+        try:
+            page = parse_search_page(page_limit, page_order_by, page_cursor)
+        except ValueError as e:
+            return jsonify({
+                'error': f"Invalid page: {e}",
+                'type': 'Invalid parameters'
+            }), 400
 
 
         #########################################################################################
@@ -78,29 +155,51 @@ def api_graph_data():
                 search_value=search_value,
                 search_operator=search_operator,
                 node_type=node_type,
-                num_hops=num_hops_node_search if search_type == 'nodeValue' else num_hops_show_all_overlaps,
+                num_hops=num_hops_node_search if search_type in ('nodeValue', 'persona') else num_hops_show_all_overlaps,
                 num_connections_show_all_overlaps=num_connections_show_all_overlaps,
                 show_nodes_only_search=show_nodes_only_search,
                 show_nodes_only_overlaps=show_nodes_only_overlaps
             )
             
-            # Return fake data
-            return jsonify({
+            metadata = {
+                'nodeCount': len(fake_data['relationships']),
+                'relationshipCount': len(fake_data['relationships']),
+                'relationshipColors': fake_data['metadata']['relationshipColors']
+            }
+
+            # Stream fake data
+            if response_format == 'ndjson':
+                records = [('node', node) for node in fake_data['nodes']]
+                records += [('relationship', relationship) for relationship in fake_data['relationships']]
+                records.append(('metadata', metadata))
+                return _ndjson_response(iter_graph_data_frames(records))
+
+            fake_data = {
                 'nodes': fake_data['nodes'],
                 'relationships': fake_data['relationships'],
-                'metadata': {
-                    'nodeCount': len(fake_data['relationships']),
-                    'relationshipCount': len(fake_data['relationships']),
-                    'relationshipColors': fake_data['metadata']['relationshipColors']
-                }
-            })
+                'metadata': metadata
+            }
+            if server_layout:
+                apply_layout(fake_data)
+            if response_format == 'compact':
+                return _compact_response(fake_data, compress)
+
+            # Return fake data
+            return jsonify(fake_data)
 
 
         #########################################################################################
         # Real Data
         #########################################################################################
+        if use_overlap_projection:
+            unsupported = _unsupported_response('overlap_projection')
+            if unsupported:
+                return unsupported
+
         # Establish Neo4j connection
         driver = get_neo4j_connection()
+        # Rows, hops and time the search may spend before it returns a partial result
+        budget = current_work_budget()
 
         # Fetch initial nodes from Neo4j based on the search parameters
         logger.info(f"Fetching initial nodes from Neo4j... (show_overlaps={show_overlaps}, search_value={search_value}, search_operator={search_operator}, node_type={node_type})")
@@ -114,38 +213,115 @@ def api_graph_data():
             case_sensitive_search=case_sensitive_search,
             search_source_select=search_source_select,
             overlap_source_select1=overlap_source_select1,
-            overlap_source_select2=overlap_source_select2
+            overlap_source_select2=overlap_source_select2,
+            date_window=date_window,
+            page=page
         )
-        logger.info(f"Initial nodes {len(initial_nodes)}: {initial_nodes}")
+        logger.info(f"Found {len(initial_nodes)} initial nodes")
+        log_sampled(lambda: f"Initial nodes: {initial_nodes}")
 
         if not initial_nodes:
+            driver.close()
+            if response_format == 'ndjson':
+                return _ndjson_response([{
+                    'type': 'error',
+                    'error': 'No initial nodes found',
+                    'errorType': 'No initial nodes found'
+                }])
             return jsonify({
                 'error': 'No initial nodes found',
                 'traceback': '',
                 'type': 'No initial nodes found'
             }), 200
 
+        # Collect the nodes first so oversized results are aggregated before any node is formatted.
+        # A streamed response reads the hops as they are expanded instead, only holding up to the
+        # aggregation node budget of them (none if it doesn't aggregate) before the first frame
+        num_hops = budget.clip_hops(num_hops_node_search if search_type in ('nodeValue', 'persona') else num_hops_show_all_overlaps)
+        if use_overlap_projection and not (show_nodes_only_search or show_nodes_only_overlaps):
+            all_nodes = collect_nodes_via_overlap_projection(driver, initial_nodes, num_hops, min_shared_identifiers, date_window, budget)
+        elif response_format == 'ndjson' and not cluster_key:
+            all_nodes = _iter_graph_nodes(driver, initial_nodes, num_hops, show_nodes_only_search, show_nodes_only_overlaps, date_window, budget)
+        else:
+            all_nodes = _collect_graph_nodes(driver, initial_nodes, num_hops, show_nodes_only_search, show_nodes_only_overlaps, date_window, budget)
+
+        aggregated_data = None
+        drill_down = None
+        over_budget = False
+        if cluster_key:
+            all_nodes, drill_down = select_cluster_nodes(driver, all_nodes, cluster_key, cluster_by)
+        elif aggregate:
+            all_nodes, over_budget = _read_ahead(all_nodes, AGGREGATION_NODE_BUDGET)
+        if over_budget:
+            logger.info(f"{len(all_nodes)} nodes exceed the aggregation node budget of {AGGREGATION_NODE_BUDGET}, aggregating by {cluster_by}")
+            aggregated_data = aggregate_graph_data(driver, all_nodes, cluster_by, lazy_details)
+            aggregated_data['metadata'].update(budget.metadata())
+            if page:
+                aggregated_data['metadata'].update(page.metadata())
+
+        # Stream the graph data frame by frame instead of building the full response in memory
+        if response_format == 'ndjson':
+            logger.info(f"Streaming graph data given the initial nodes")
+            if aggregated_data:
+                records = [('node', node) for node in aggregated_data['nodes']]
+                records += [('relationship', relationship) for relationship in aggregated_data['relationships']]
+                records.append(('metadata', aggregated_data['metadata']))
+            else:
+                records = iter_graph_data(
+                    driver=driver,
+                    initial_nodes=initial_nodes,
+                    num_hops=num_hops,
+                    show_nodes_only_search=show_nodes_only_search,
+                    show_nodes_only_overlaps=show_nodes_only_overlaps,
+                    lazy_details=lazy_details,
+                    all_nodes=all_nodes,
+                    drill_down=drill_down,
+                    budget=budget,
+                    page=page
+                )
+            return _ndjson_response(_stream_graph_data_frames(driver, records, budget))
+
 
         # Fetch the rest of the graph data given the initial nodes, e.g. connected nodes and relationships
-        logger.info(f"Fetching graph data given the initial nodes")
-        data = get_graph_data(
-            driver=driver,
-            initial_nodes=initial_nodes,
-            num_hops=num_hops_node_search if search_type == 'nodeValue' else num_hops_show_all_overlaps,
-            show_nodes_only_search=show_nodes_only_search,
-            show_nodes_only_overlaps=show_nodes_only_overlaps
-        )
+        if aggregated_data:
+            data = aggregated_data
+        else:
+            logger.info(f"Fetching graph data given the initial nodes")
+            data = get_graph_data(
+                driver=driver,
+                initial_nodes=initial_nodes,
+                num_hops=num_hops,
+                show_nodes_only_search=show_nodes_only_search,
+                show_nodes_only_overlaps=show_nodes_only_overlaps,
+                lazy_details=lazy_details,
+                all_nodes=all_nodes,
+                drill_down=drill_down,
+                budget=budget,
+                page=page
+            )
 
         logger.info(f"Final node count: {len(data['nodes'])}")
         logger.info(f"Final relationship count: {len(data['relationships'])}")
 
         # Close Neo4j connection
         driver.close()
+
+        # Add x/y coordinates to the nodes (not available when streaming, the layout needs the whole graph)
+        if server_layout:
+            apply_layout(data)
     
         # Return the graph data
         logger.info("Successfully returned graph data via API")
+        if response_format == 'compact':
+            return _compact_response(data, compress)
         return jsonify(data)
     
+    except UnsupportedFeatureError as e:
+        # Close Neo4j connection
+        if 'driver' in locals():
+            driver.close()
+        return _unsupported_response(e.feature)
+
     except Exception as e:
         # Close Neo4j connection
         if 'driver' in locals():
@@ -164,6 +340,70 @@ def api_graph_data():
         }), 500
 
 
+def _unsupported_response(feature):
+    """
+    400 response rejecting a feature the graph backend can't serve (see modules/graph_backend.py),
+    None if it can. Also the response to an UnsupportedFeatureError raised by a lookup.
+    """
+    reason = graph_backend.unsupported_reason(feature)
+    if reason is None:
+        return None
+    return jsonify({
+        'error': reason,
+        'type': 'Unsupported by the graph backend'
+    }), 400
+
+
+def _ndjson_response(frames):
+    """Serialize frames as newline-delimited JSON in a streamed (chunked) response."""
+    def generate():
+        for frame in frames:
+            yield json.dumps(frame, separators=(',', ':'), default=str) + '\n'
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def _compact_response(data, compress):
+    """Encode graph data in the compact columnar format, compressed if the client accepts it."""
+    body = json.dumps(encode_compact_graph(data), separators=(',', ':'), default=str).encode('utf-8')
+    encoding = None
+    if compress:
+        body, encoding = compress_payload(body, request.headers.get('Accept-Encoding', ''))
+
+    response = Response(body, mimetype='application/json')
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def _stream_graph_data_frames(driver, records, budget=None):
+    """
+    Yield graph data frames, reporting errors in-band and closing the driver once the stream ends.
+
+    When the client disconnects the server closes the stream, which stops the traversal and
+    closes the driver, so Neo4j terminates the running query along with its connection.
+    """
+    try:
+        yield from iter_graph_data_frames(records)
+        logger.info("Successfully streamed graph data via API")
+    except GeneratorExit:
+        logger.info("Client disconnected, cancelling the graph data stream")
+        if budget is not None:
+            budget.stop('client_disconnected')
+        raise
+    except Exception as e:
+        import traceback
+        logger.error("API error:")
+        logger.error(f"Error: {str(e)}\nTraceback: {traceback.format_exc()}")
+        yield {
+            'type': 'error',
+            'error': "An error occurred while fetching graph data",
+            'errorType': type(e).__name__
+        }
+    finally:
+        driver.close()
+
+
 @graph_bp.route('/api/node-types')
 def api_node_types():
     logger.info("API request received for node types...")
@@ -173,13 +413,7 @@ def api_node_types():
         
         with driver.session() as session:
             # Get all available labels from the database
-            label_query = """
-            CALL db.labels() YIELD label
-            RETURN label
-            ORDER BY label
-            """
-            result = session.run(label_query)
-            labels = [record["label"] for record in result if record["label"] not in ["observation_of_identity", "source", "online_identifiers", "location_identifiers", "identity_documents"]]
+            labels = [label for label in graph_backend.labels(session) if label not in NON_IDENTIFIER_LABELS and label not in ["online_identifiers", "location_identifiers", "identity_documents"]]
             
             logger.info(f"Found {len(labels)} node types: {labels}")
             
@@ -217,13 +451,7 @@ def api_source_types():
         
         with driver.session() as session:
             # Get all available source types from the database
-            label_query = """
-            MATCH (n:source)
-            RETURN DISTINCT n.value as source_type
-            ORDER BY source_type
-            """
-            result = session.run(label_query)
-            labels = [record["source_type"] for record in result if record["source_type"] is not None]
+            labels = graph_backend.source_values(session)
 
             logger.info(f"Found {len(labels)} source types: {labels}")
 
@@ -252,515 +480,687 @@ def api_source_types():
         }), 500
 
 
-def get_node_color(node_type):
-    """Dynamically assign colors to node types, keeping source and observation fixed"""
-    global NODE_COLOR_ASSIGNMENTS
-    
-    # Fixed colors for source and observation
-    if node_type == 'source':
-        return NODE_COLORS['source']
-    elif node_type == 'observation_of_identity':
-        return NODE_COLORS['observation_of_identity']
-    
-    # For other node types, assign colors dynamically
-    if node_type not in NODE_COLOR_ASSIGNMENTS:
-        # Get a random color from the options
-        color_options = NODE_COLORS['node_color_options']
-        assigned_color = random.choice(color_options)
-        NODE_COLOR_ASSIGNMENTS[node_type] = assigned_color
-    
-    return NODE_COLOR_ASSIGNMENTS[node_type]
+@graph_bp.route('/metrics')
+def metrics():
+    """Request and query latency metrics of this process in the Prometheus text format."""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
 
-def get_relationship_color(relationship_type):
-    """Dynamically assign colors to relationship types"""
-    global RELATIONSHIP_COLOR_ASSIGNMENTS
-    
-    if relationship_type not in RELATIONSHIP_COLOR_ASSIGNMENTS:
-        # Get a random color from the options
-        assigned_color = random.choice(RELATIONSHIP_COLORS_OPTIONS)
-        RELATIONSHIP_COLOR_ASSIGNMENTS[relationship_type] = assigned_color
-    
-    return RELATIONSHIP_COLOR_ASSIGNMENTS[relationship_type]
 
+@graph_bp.route('/api/slow-queries')
+def api_slow_queries():
+    """The worst recorded slow queries, grouped by query text, with the plan of their slowest run."""
+    logger.info("API request received for slow queries...")
+    try:
+        limit = request.args.get('limit', '20')
+        try:
+            limit = int(limit)
+        except (ValueError, TypeError):
+            limit = 20
+        offenders = read_slow_queries(slow_query_log.path, limit)
+        return jsonify({
+            'threshold': slow_query_log.threshold,
+            'queries': offenders,
+            'count': len(offenders)
+        })
+
+    except Exception as e:
+        # Log the error and return a 500 error
+        import traceback
+        error_trace = traceback.format_exc()
+        error_msg = f"Error: {str(e)}\nTraceback: {error_trace}"
+        logger.error("API error:")
+        logger.error(error_msg)
+        return jsonify({
+            'error': "An error occurred while reading the slow queries",
+            'traceback': "",
+            'type': type(e).__name__
+        }), 500
+
+
+@graph_bp.route('/api/source-overlap-matrix')
+def api_source_overlap_matrix():
+    """Serve the precomputed source x source shared identifier counts, or the ranked overlaps of ?source=."""
+    logger.info("API request received for the source overlap matrix...")
+    try:
+        source = request.args.get('source') or None
+        unsupported = _unsupported_response('source_overlap_matrix')
+        if unsupported:
+            return unsupported
+
+        # Establish Neo4j connection
+        driver = get_neo4j_connection()
+        data = get_source_overlap_matrix(driver, source)
+        driver.close()
+
+        logger.info(f"Returning the source overlap matrix of {len(data['sources'])} sources")
+        return jsonify(data)
+
+    except UnsupportedFeatureError as e:
+        # Close Neo4j connection
+        if 'driver' in locals():
+            driver.close()
+        return _unsupported_response(e.feature)
+
+    except Exception as e:
+        # Close Neo4j connection
+        if 'driver' in locals():
+            driver.close()
+
+        # Log the error and return a 500 error
+        import traceback
+        error_trace = traceback.format_exc()
+        error_msg = f"Error: {str(e)}\nTraceback: {error_trace}"
+        logger.error("API error:")
+        logger.error(error_msg)
+        return jsonify({
+            'error': "An error occurred while fetching the source overlap matrix",
+            'traceback': "",
+            'type': type(e).__name__
+        }), 500
+
+
+@graph_bp.route('/api/bulk-match', methods=['POST'])
+def api_bulk_match():
+    """
+    Match an uploaded list of values (one per line, as a 'file' upload or the raw request body)
+    against the graph's identifiers, streaming back the matches as NDJSON.
+    """
+    logger.info("API request received for bulk matching...")
+    try:
+        labels = [label.strip() for label in request.args.get('labels', '').split(',') if label.strip()]
+        try:
+            chunk_size = max(1, int(request.args.get('chunkSize', BULK_MATCH_CHUNK_SIZE)))
+        except (ValueError, TypeError):
+            chunk_size = BULK_MATCH_CHUNK_SIZE
+
+        # An uploaded file is closed with the request before the response has been streamed, so it
+        # is copied to a temporary file owned by the stream
+        values_file = None
+        upload = request.files.get('file')
+        if upload:
+            values_file = tempfile.TemporaryFile()
+            shutil.copyfileobj(upload.stream, values_file)
+            values_file.seek(0)
+        values = iter_bulk_values(values_file if values_file else request.stream)
+
+        # Establish Neo4j connection
+        driver = get_neo4j_connection()
+        return _ndjson_response(_stream_bulk_match_frames(driver, iter_bulk_matches(driver, values, labels, chunk_size), values_file))
+
+    except Exception as e:
+        # Close Neo4j connection and the uploaded values
+        if 'driver' in locals():
+            driver.close()
+        if 'values_file' in locals() and values_file:
+            values_file.close()
+
+        # Log the error and return a 500 error
+        import traceback
+        error_trace = traceback.format_exc()
+        error_msg = f"Error: {str(e)}\nTraceback: {error_trace}"
+        logger.error("API error:")
+        logger.error(error_msg)
+        return jsonify({
+            'error': "An error occurred while bulk matching",
+            'traceback': "",
+            'type': type(e).__name__
+        }), 500
+
+
+def _stream_bulk_match_frames(driver, frames, values_file=None):
+    """Yield bulk match frames, reporting errors in-band and closing the driver (and uploaded values) once the stream ends."""
+    try:
+        yield from frames
+    except Exception as e:
+        import traceback
+        logger.error("API error:")
+        logger.error(f"Error: {str(e)}\nTraceback: {traceback.format_exc()}")
+        yield {
+            'type': 'error',
+            'error': "An error occurred while bulk matching",
+            'errorType': type(e).__name__
+        }
+    finally:
+        driver.close()
+        if values_file:
+            values_file.close()
+
+
+@graph_bp.route('/api/node-details')
+def api_node_details():
+    logger.info("API request received for node details...")
+    try:
+        # Comma separated elementIds of the nodes to fetch details for
+        node_ids = [node_id.strip() for node_id in request.args.get('ids', '').split(',') if node_id.strip()]
+        if not node_ids:
+            return jsonify({
+                'error': 'ids is required',
+                'type': 'Missing parameters'
+            }), 400
+
+        # Establish Neo4j connection
+        driver = get_neo4j_connection()
+
+        with driver.session() as session:
+            details = {}
+            for node in graph_backend.nodes_by_id(session, node_ids):
+                v = dict(node)
+                v['id'] = node.id
+                v['elementId'] = node.element_id
+                v['labels'] = list(node.labels)
+
+                details[str(node.element_id)] = {
+                    'properties': v,
+                    'flat_properties': flatten_properties(v),
+                    'tooltip': build_observation_tooltip(v) if 'observation_of_identity' in v['labels'] else ''
+                }
+
+            logger.info(f"Found details for {len(details)} of {len(node_ids)} nodes")
+
+            # Close Neo4j connection
+            driver.close()
+
+            return jsonify({
+                'nodes': details
+            })
+
+    except Exception as e:
+        # Close Neo4j connection
+        if 'driver' in locals():
+            driver.close()
+
+        # Log the error and return a 500 error
+        import traceback
+        error_trace = traceback.format_exc()
+        error_msg = f"Error: {str(e)}\nTraceback: {error_trace}"
+        logger.error("API error:")
+        logger.error(error_msg)
+        return jsonify({
+            'error': "An error occurred while fetching node details",
+            'traceback': "",
+            'type': type(e).__name__
+        }), 500
+
+
+def _sources_by_observation(session, obs_ids):
+    """Raw node dicts of the sources of observations by observation ID, observations without one left out."""
+    return {obs_id: node_to_dict(source) for obs_id, source in graph_backend.sources_by_observation(session, obs_ids).items()}
+
+
+def _sources_of(driver, observation_ids, budget):
+    """
+    Raw source node dicts by observation ID, looked up SOURCE_LOOKUP_BATCH_SIZE observations per
+    query with the batches run concurrently (see run_on_sessions). Batches not started before the
+    work budget is exhausted are skipped.
+    """
+    def lookup(session, obs_ids):
+        return {} if budget.exhausted() else _sources_by_observation(session, obs_ids)
+
+    sources = {}
+    for batch_sources in run_on_sessions(driver, lookup, batches(dict.fromkeys(observation_ids), SOURCE_LOOKUP_BATCH_SIZE)):
+        sources.update(batch_sources)
+    return sources
 
 
+def _expand_overlaps(driver, session, observation_ids, date_window, budget):
+    """
+    One hop of _iter_graph_nodes: the identifiers the observations share with 2+ observations,
+    the observations of each of them and their sources.
 
-def flatten_properties(props, prefix=''):
-    flat = {}
-    for k, v in props.items():
-        key = f'{prefix}{k}' if prefix else str(k)
+    The observations of each identifier, then the source of each observation, are looked up
+    concurrently on their own sessions, and the nodes are merged in the order of the overlap
+    query's records, so the result doesn't depend on which lookup finishes first.
+
+    Returns:
+        tuple: (raw node dicts, IDs of the observations reached)
+    """
+    # Find overlapping nodes connected to the observations (2+ observations only)
+    overlapping = []
+    for record in graph_backend.overlapping_identifier_records(session, observation_ids, date_window):
+        if budget.exhausted():
+            break
+        overlapping.append((record["identifier"], record["overlap_count"]))
+
+    def observations_of(session, identifier):
+        # Identifiers not reached before the budget ran out are left out
+        return None if budget.exhausted() else graph_backend.observations_of_identifier(session, str(identifier.element_id), date_window)
+
+    observations_by_identifier = run_on_sessions(driver, observations_of, [identifier for identifier, _ in overlapping])
+    sources = _sources_of(driver, [str(obs.element_id) for observations in observations_by_identifier if observations for obs in observations], budget)
+
+    nodes = []
+    reached_observation_ids = set()
+    for (identifier, overlap_count), observations in zip(overlapping, observations_by_identifier):
+        if observations is None:
+            continue
+        logger.debug(f"Overlapping node: {identifier.get('value', 'Unknown')} with {overlap_count} observations")
+        nodes.append(node_to_dict(identifier, {'overlap_count': overlap_count}))
+        for obs in observations:
+            obs_id = str(obs.element_id)
+            reached_observation_ids.add(obs_id)
+            nodes.append(node_to_dict(obs))
+            if sources.get(obs_id):
+                nodes.append(sources[obs_id])
+    return nodes, reached_observation_ids
+
+
+def _iter_graph_nodes(driver, initial_nodes, num_hops, show_nodes_only_search, show_nodes_only_overlaps, date_window=None, budget=None):
+    """
+    Yield the raw (unformatted) node dicts within num_hops of the initial nodes, only following observations within date_window if given.
+
+    The nodes of each hop are yielded as soon as the hop is expanded, so a streamed response sends
+    them before the next hop is looked up. A node reached again by a later hop is yielded again,
+    see _iter_unique_nodes.
+
+    Independent lookups of each hop (the observations of each overlapping identifier, the source
+    of each observation) run concurrently, at most --query_concurrency at a time, and are merged
+    in a deterministic order. The expansion stops early, keeping the nodes reached so far, once
+    the work budget is exhausted.
+    """
+    budget = budget or WorkBudget()
+    # First, collect the initial node IDs
+    initial_node_ids = []
+    for v in initial_nodes:
+        # Get the node elementId
         if isinstance(v, dict):
-            flat.update(flatten_properties(v, key + '.'))
-        elif isinstance(v, list):
-            if v and all(isinstance(i, dict) for i in v):
-                for idx, item in enumerate(v):
-                    flat.update(flatten_properties(item, f'{key}[{idx}].'))
-            else:
-                flat[key] = ', '.join(str(i) for i in v)
+            v_id = str(v['elementId'])
         else:
-            flat[key] = v
-    return flat
+            v_id = str(v)
+        initial_node_ids.append(v_id)
 
+    log_sampled(lambda: f"Initial node IDs: {initial_node_ids}")
 
-def get_graph_data(driver, initial_nodes, num_hops, show_nodes_only_search, show_nodes_only_overlaps):
-    try:
-        logger.info(f"Getting graph data with arguments: driver={driver}, initial_nodes={initial_nodes}, num_hops={num_hops}, show_nodes_only_search={show_nodes_only_search}, show_nodes_only_overlaps={show_nodes_only_overlaps}")
-        
-        nodes = []
-        seen_ids = set()
+    # If show_nodes_only_search is True, only process the initial nodes
+    if show_nodes_only_overlaps:
+        logger.info("Show nodes only overlaps is enabled - only processing overlapping nodes")
+        # We'll process nodes normally but filter to only overlapping ones later
+        yield from initial_nodes
+        return
+    if show_nodes_only_search:
+        logger.info("Show nodes only search is enabled - only processing initial nodes")
+        yield from initial_nodes
+        return
+    # Implement hop-based traversal for overlapping nodes
+    if num_hops == 0:
+        logger.info("Num hops is 0 - returning only initial nodes")
+        yield from initial_nodes
+        return
+
+    logger.info(f"Getting overlapping nodes within {num_hops} hops of {len(initial_node_ids)} initial nodes")
 
-        # First, collect the initial node IDs
-        initial_node_ids = []
+    with driver.session() as session:
+        current_observation_ids = set()
+
+        # Check if initial nodes are observations or other node types
+        initial_observations = []
+        initial_other_nodes = []
         for v in initial_nodes:
-            # Get the node elementId
-            if isinstance(v, dict):
-                v_id = str(v['elementId'])
+            v_dict = v if isinstance(v, dict) else node_to_dict(v)
+            if 'observation_of_identity' in v_dict['labels']:
+                initial_observations.append(v_dict)
             else:
-                v_id = str(v)
-            initial_node_ids.append(v_id)
-            
-        logger.info(f"Initial node IDs: {initial_node_ids}")
+                initial_other_nodes.append(v_dict)
+
+        # If we have non-observation initial nodes, find their observations
+        direct_observations = []
+        if initial_other_nodes:
+            initial_other_ids = [str(v['elementId']) for v in initial_other_nodes]
+            for record in graph_backend.direct_observation_records(session, initial_other_ids, date_window):
+                if budget.exhausted():
+                    break
+                direct_observations.append(node_to_dict(record["obs"]))
+
+        # Each observation is followed by its source. Initial observations are always kept,
+        # their sources only while the budget lasts
+        sources = _sources_of(driver, [str(obs['elementId']) for obs in direct_observations + initial_observations], budget)
+        for obs in direct_observations + initial_observations:
+            obs_id = str(obs['elementId'])
+            current_observation_ids.add(obs_id)
+            yield obs
+            if sources.get(obs_id):
+                yield sources[obs_id]
+
+        # Then all the initial nodes
+        yield from initial_other_nodes
+
+        # Find overlapping nodes connected to the observations
+        if current_observation_ids:
+            logger.info(f"Looking for overlapping nodes from {len(current_observation_ids)} observations")
+            log_sampled(lambda: f"Observations: {list(current_observation_ids)}")
+            overlapping_nodes, reached_observation_ids = _expand_overlaps(driver, session, current_observation_ids, date_window, budget)
+            yield from overlapping_nodes
+            current_observation_ids |= reached_observation_ids
+
+        # For each hop level beyond 0, find overlapping nodes and their observations
+        for hop in range(1, num_hops + 1):
+            if not current_observation_ids or budget.exhausted():
+                break
+
+            logger.info(f"Processing hop {hop} with {len(current_observation_ids)} observations")
+            new_nodes, current_observation_ids = _expand_overlaps(driver, session, current_observation_ids, date_window, budget)
+            yield from new_nodes
+
+            logger.info(f"Hop {hop}: Found {len([n for n in new_nodes if 'overlap_count' in n])} overlapping nodes and {len(current_observation_ids)} observations")
+
+
+def _collect_graph_nodes(driver, initial_nodes, num_hops, show_nodes_only_search, show_nodes_only_overlaps, date_window=None, budget=None):
+    """The unique raw node dicts of _iter_graph_nodes, as a list."""
+    all_nodes = _unique_nodes(_iter_graph_nodes(driver, initial_nodes, num_hops, show_nodes_only_search, show_nodes_only_overlaps, date_window, budget))
+    logger.info(f"Found {len(all_nodes)} total unique nodes")
+    return all_nodes
+
+
+def _look_up_node_details(driver, nodes):
+    """
+    The source values of observations and observation counts of identifiers that format_graph_node
+    would otherwise query one node at a time, looked up concurrently, by node ID.
+    """
+    def look_up(session, v):
+        raw_label = v['labels'][0] if v['labels'] else 'default'
+        if raw_label.startswith('observation_of_'):
+            return graph_backend.source_value_of(session, str(v['elementId']))
+        return graph_backend.observation_count_of(session, str(v['elementId']))
+
+    missing = []
+    for v in nodes:
+        raw_label = v['labels'][0] if v['labels'] else 'default'
+        if raw_label.startswith('observation_of_'):
+            if 'source' not in v:
+                missing.append(v)
+        elif raw_label not in NON_IDENTIFIER_LABELS and 'overlap_count' not in v and 'observation_count' not in v:
+            missing.append(v)
+    return dict(zip((str(v['elementId']) for v in missing), run_on_sessions(driver, look_up, missing)))
+
+
+def _relationship_records(session, node_ids):
+    """All (from, r, to) records of the relationships between the nodes, derived ones excepted."""
+    return list(graph_backend.relationship_records(session, node_ids))
+
+
+def iter_graph_data(driver, initial_nodes, num_hops, show_nodes_only_search, show_nodes_only_overlaps, lazy_details=False, all_nodes=None, drill_down=None, budget=None, prefetch_relationships=False, page=None):
+    """
+    Yield the graph data as ('node', node), ('relationship', relationship) and finally
+    ('metadata', metadata) records, formatting each one as it comes off the Neo4j cursor.
+
+    The nodes are read off the traversal (see _iter_graph_nodes) as each hop is expanded and
+    formatted GRAPH_STREAM_CHUNK_SIZE at a time, and the relationships are read off one query per
+    GRAPH_STREAM_RELATIONSHIP_CHUNK_SIZE observations once the nodes are out, so callers that stream
+    the records out (see the NDJSON response format) never build the full payload: only a chunk of
+    nodes and the IDs of the nodes sent so far are held in memory.
+    all_nodes (a list or an iterator) skips the traversal when the caller already has the nodes,
+    and drill_down (see select_cluster_nodes) is added to the metadata when they are the members
+    of one cluster. The metadata flags the result as partial if the work budget ran out while
+    collecting it, and has the page of the initial nodes (see modules/search_pages.SearchPage)
+    when they are paged.
+
+    The sources and observation counts of each chunk of nodes are looked up concurrently before
+    they are formatted. With prefetch_relationships the nodes are read in full first and the
+    relationships of all of them are read on another session meanwhile.
+    """
+    budget = budget or WorkBudget()
+    try:
+        logger.info(f"Getting graph data of {len(initial_nodes)} initial nodes with num_hops={num_hops}, show_nodes_only_search={show_nodes_only_search}, show_nodes_only_overlaps={show_nodes_only_overlaps}")
+        log_sampled(lambda: f"Initial nodes: {initial_nodes}")
+
+        if all_nodes is None:
+            all_nodes = _iter_graph_nodes(driver, initial_nodes, num_hops, show_nodes_only_search, show_nodes_only_overlaps, budget=budget)
+        initial_node_ids = {str(v['elementId']) if isinstance(v, dict) else str(v) for v in initial_nodes}
+
+        # Only get relationships if not in show_nodes_only_search mode
+        fetch_relationships = not show_nodes_only_search and not show_nodes_only_overlaps
+
+        relationship_future = None
+        if prefetch_relationships:
+            all_nodes = _unique_nodes(all_nodes)
+            if fetch_relationships:
+                logger.info("Getting relationships between vertices...")
+                relationship_future = submit_on_session(driver, _relationship_records, [str(v['elementId']) for v in all_nodes])
+
+        node_ids = set()
+        observation_ids = []
+        node_count = 0
+        relationship_count = 0
 
-        # If show_nodes_only_search is True, only process the initial nodes
         if show_nodes_only_overlaps:
-            logger.info("Show nodes only overlaps is enabled - only processing overlapping nodes")
-            # We'll process nodes normally but filter to only overlapping ones later
-            all_nodes = initial_nodes
-        elif show_nodes_only_search:
-            logger.info("Show nodes only search is enabled - only processing initial nodes")
-            all_nodes = initial_nodes
-        else:
-            # Implement hop-based traversal for overlapping nodes
-            if num_hops == 0:
-                logger.info("Num hops is 0 - returning only initial nodes")
-                all_nodes = initial_nodes
-            else:
-                logger.info(f"Getting overlapping nodes within {num_hops} hops of {len(initial_node_ids)} initial nodes")
-                
-                with driver.session() as session:
-                    all_nodes = []
-                    current_observation_ids = set()
-                    
-                    # Start with initial nodes and find their direct observations
-                    if num_hops >= 0:
-                        # Check if initial nodes are observations or other node types
-                        initial_observations = []
-                        initial_other_nodes = []
-                        
-                        for v in initial_nodes:
-                            if isinstance(v, dict):
-                                v_dict = v
-                            else:
-                                v_dict = dict(v)
-                                v_dict['id'] = v.id
-                                v_dict['elementId'] = v.element_id
-                                v_dict['labels'] = list(v.labels)
-                            
-                            if 'observation_of_identity' in v_dict['labels']:
-                                initial_observations.append(v_dict)
-                            else:
-                                initial_other_nodes.append(v_dict)
-                        
-                        # If we have non-observation initial nodes, find their observations
-                        if initial_other_nodes:
-                            initial_other_ids = [str(v['elementId']) for v in initial_other_nodes]
-                            direct_obs_query = """
-                            MATCH (identifier)-[r]-(obs:observation_of_identity)
-                            WHERE elementId(identifier) IN $initial_ids
-                            RETURN DISTINCT obs
-                            """
-                            direct_obs_result = session.run(direct_obs_query, initial_ids=initial_other_ids)
-                            
-                            for record in direct_obs_result:
-                                obs = record["obs"]
-                                obs_id = str(obs.element_id)
-                                current_observation_ids.add(obs_id)
-                                
-                                # Add observation to all_nodes
-                                obs_dict = dict(obs)
-                                obs_dict['id'] = obs.id
-                                obs_dict['elementId'] = obs.element_id
-                                obs_dict['labels'] = list(obs.labels)
-                                all_nodes.append(obs_dict)
-                                
-                                # Also add the source node for this observation
-                                source_query = """
-                                MATCH (s:source)-[:has_observation]->(obs:observation_of_identity)
-                                WHERE elementId(obs) = $obs_id
-                                RETURN s
-                                """
-                                source_result = session.run(source_query, obs_id=obs_id)
-                                source_record = source_result.single()
-                                if source_record:
-                                    source = source_record["s"]
-                                    source_dict = dict(source)
-                                    source_dict['id'] = source.id
-                                    source_dict['elementId'] = source.element_id
-                                    source_dict['labels'] = list(source.labels)
-                                    all_nodes.append(source_dict)
-                        
-                        # Add initial observations directly to current_observation_ids
-                        for obs in initial_observations:
-                            obs_id = str(obs['elementId'])
-                            current_observation_ids.add(obs_id)
-                            all_nodes.append(obs)
-                            
-                            # Also add the source node for this observation
-                            source_query = """
-                            MATCH (s:source)-[:has_observation]->(obs:observation_of_identity)
-                            WHERE elementId(obs) = $obs_id
-                            RETURN s
-                            """
-                            source_result = session.run(source_query, obs_id=obs_id)
-                            source_record = source_result.single()
-                            if source_record:
-                                source = source_record["s"]
-                                source_dict = dict(source)
-                                source_dict['id'] = source.id
-                                source_dict['elementId'] = source.element_id
-                                source_dict['labels'] = list(source.labels)
-                                all_nodes.append(source_dict)
-                        
-                        # Add all initial nodes to all_nodes
-                        all_nodes.extend(initial_other_nodes)
-                        
-                        # Find overlapping nodes connected to the observations
-                        if current_observation_ids:
-                            logger.info(f"Looking for overlapping nodes from {len(current_observation_ids)} observations: {list(current_observation_ids)}")
-                            
-                            all_connected_nodes_query = """
-                            MATCH (obs:observation_of_identity)-[r]->(identifier)
-                            WHERE elementId(obs) IN $observation_ids
-                            WITH identifier
-                            MATCH (other_obs:observation_of_identity)-[other_r]->(identifier)
-                            WITH identifier, count(DISTINCT other_obs) as overlap_count
-                            WHERE overlap_count >= 2
-                            RETURN identifier, overlap_count
-                            """
-                            
-                            all_connected_result = session.run(all_connected_nodes_query, observation_ids=list(current_observation_ids))
-                            
-                            logger.info(f"Found {len(list(all_connected_result))} overlapping nodes")
-                            
-                            for record in all_connected_result:
-                                identifier = record["identifier"]
-                                overlap_count = record["overlap_count"]
-                                identifier_id = str(identifier.element_id)
-                                
-                                logger.info(f"Overlapping node: {identifier.get('value', 'Unknown')} with {overlap_count} observations")
-                                
-                                # Add overlapping nodes only (2+ observations)
-                                identifier_dict = dict(identifier)
-                                identifier_dict['id'] = identifier.id
-                                identifier_dict['elementId'] = identifier.element_id
-                                identifier_dict['labels'] = list(identifier.labels)
-                                identifier_dict['overlap_count'] = overlap_count
-                                all_nodes.append(identifier_dict)
-                                
-                                # Find all observations connected to this overlapping node
-                                obs_query = """
-                                MATCH (obs:observation_of_identity)-[r]->(identifier)
-                                WHERE elementId(identifier) = $identifier_id
-                                RETURN DISTINCT obs
-                                """
-                                
-                                obs_result = session.run(obs_query, identifier_id=identifier_id)
-                                
-                                for obs_record in obs_result:
-                                    obs = obs_record["obs"]
-                                    obs_id = str(obs.element_id)
-                                    current_observation_ids.add(obs_id)
-                                    
-                                    # Add observation to all_nodes
-                                    obs_dict = dict(obs)
-                                    obs_dict['id'] = obs.id
-                                    obs_dict['elementId'] = obs.element_id
-                                    obs_dict['labels'] = list(obs.labels)
-                                    all_nodes.append(obs_dict)
-                                    
-                                    # Also add the source node for this observation
-                                    source_query = """
-                                    MATCH (s:source)-[:has_observation]->(obs:observation_of_identity)
-                                    WHERE elementId(obs) = $obs_id
-                                    RETURN s
-                                    """
-                                    source_result = session.run(source_query, obs_id=obs_id)
-                                    source_record = source_result.single()
-                                    if source_record:
-                                        source = source_record["s"]
-                                        source_dict = dict(source)
-                                        source_dict['id'] = source.id
-                                        source_dict['elementId'] = source.element_id
-                                        source_dict['labels'] = list(source.labels)
-                                        all_nodes.append(source_dict)
-                    
-                    # For each hop level beyond 0, find overlapping nodes and their observations
-                    for hop in range(1, num_hops + 1):
-                        if not current_observation_ids:
-                            break
-                        
-                        logger.info(f"Processing hop {hop} with {len(current_observation_ids)} observations")
-                        
-                        # Find overlapping nodes connected to current observations (2+ observations only)
-                        overlapping_nodes_query = """
-                        MATCH (obs:observation_of_identity)-[r]->(identifier)
-                        WHERE elementId(obs) IN $observation_ids
-                        WITH identifier
-                        MATCH (other_obs:observation_of_identity)-[other_r]->(identifier)
-                        WITH identifier, count(DISTINCT other_obs) as overlap_count
-                        WHERE overlap_count >= 2
-                        RETURN identifier, overlap_count
-                        """
-                        
-                        overlapping_result = session.run(overlapping_nodes_query, observation_ids=list(current_observation_ids))
-                        
-                        new_observation_ids = set()
-                        new_nodes = []
-                        
-                        for record in overlapping_result:
-                            identifier = record["identifier"]
-                            overlap_count = record["overlap_count"]
-                            identifier_id = str(identifier.element_id)
-                            
-                            # Add overlapping nodes only (2+ observations)
-                            identifier_dict = dict(identifier)
-                            identifier_dict['id'] = identifier.id
-                            identifier_dict['elementId'] = identifier.element_id
-                            identifier_dict['labels'] = list(identifier.labels)
-                            identifier_dict['overlap_count'] = overlap_count
-                            new_nodes.append(identifier_dict)
-                            
-                            # Find all observations connected to this overlapping node
-                            obs_query = """
-                            MATCH (obs:observation_of_identity)-[r]->(identifier)
-                            WHERE elementId(identifier) = $identifier_id
-                            RETURN DISTINCT obs
-                            """
-                            
-                            obs_result = session.run(obs_query, identifier_id=identifier_id)
-                            
-                            for obs_record in obs_result:
-                                obs = obs_record["obs"]
-                                obs_id = str(obs.element_id)
-                                new_observation_ids.add(obs_id)
-                                
-                                # Add observation to new_nodes
-                                obs_dict = dict(obs)
-                                obs_dict['id'] = obs.id
-                                obs_dict['elementId'] = obs.element_id
-                                obs_dict['labels'] = list(obs.labels)
-                                new_nodes.append(obs_dict)
-                                
-                                # Also add the source node for this observation
-                                source_query = """
-                                MATCH (s:source)-[:has_observation]->(obs:observation_of_identity)
-                                WHERE elementId(obs) = $obs_id
-                                RETURN s
-                                """
-                                source_result = session.run(source_query, obs_id=obs_id)
-                                source_record = source_result.single()
-                                if source_record:
-                                    source = source_record["s"]
-                                    source_dict = dict(source)
-                                    source_dict['id'] = source.id
-                                    source_dict['elementId'] = source.element_id
-                                    source_dict['labels'] = list(source.labels)
-                                    new_nodes.append(source_dict)
-                        
-                        # Update current observation IDs for next iteration
-                        current_observation_ids = new_observation_ids
-                        
-                        # Add new nodes to all_nodes
-                        all_nodes.extend(new_nodes)
-                        
-                        logger.info(f"Hop {hop}: Found {len([n for n in new_nodes if 'overlap_count' in n])} overlapping nodes and {len(new_observation_ids)} observations")
-                    
-                    # Remove duplicates based on elementId
-                    unique_nodes = {}
-                    for node in all_nodes:
-                        node_id = str(node['elementId'])
-                        if node_id not in unique_nodes:
-                            unique_nodes[node_id] = node
-                    
-                    all_nodes = list(unique_nodes.values())
-                
-                logger.info(f"Found {len(all_nodes)} total unique nodes")
-        
-        # Process all nodes - we need a session for this regardless of show_nodes_only_search
-        with driver.session() as session:
-            for v in all_nodes:
-                v_id = str(v['elementId'])
-                if v_id in seen_ids:
+            logger.info("Filtering to only overlapping nodes...")
+
+        unique_nodes = _iter_unique_nodes(all_nodes)
+        while True:
+            chunk = list(islice(unique_nodes, GRAPH_STREAM_CHUNK_SIZE))
+            if not chunk:
+                break
+            looked_up = _look_up_node_details(driver, chunk)
+            for v in chunk:
+                node_ids.add(str(v['elementId']))
+                if OBSERVATION_LABEL in v['labels']:
+                    observation_ids.append(str(v['elementId']))
+                node = format_graph_node(v, initial_node_ids, lazy_details, looked_up)
+
+                # Filter to only overlapping nodes if show_nodes_only_overlaps is True
+                if show_nodes_only_overlaps and not (node.get('is_shared', False) or node.get('num_observations', 0) > 1):
                     continue
-                seen_ids.add(v_id)
 
-                # This is the value to display in the node
-                raw_label = v['labels'][0] if v['labels'] else 'default'
-                tooltip = ''
-                
-                if raw_label.startswith('observation_of_'):
-                    # Get the source for this observation
-                    # First check if source is already included in the node data
-                    if 'source' in v:
-                        source_value = v['source']
-                    else:
-                        # Fall back to querying the database
-                        source_query = """
-                        MATCH (s:source)-[:has_observation]->(obs:observation_of_identity)
-                        WHERE elementId(obs) = $obs_id
-                        RETURN s.value as source_value
-                        """
-                        source_result = session.run(source_query, obs_id=v_id)
-                        source_record = source_result.single()
-                        source_value = source_record["source_value"] if source_record else "Unknown"
-                    
-                    value = f"{source_value}: {v.get('value', v_id)}"
-                    # Count observations for this node
-                    num_observations = 1  # Default for observation nodes
-                    flat = flatten_properties(v)
-                    tooltip = '\n'.join(f"{k}: {v}" if not k.endswith('_identifiers') else f"{k}:\n{v}" for k, v in sorted(flat.items()))
-                else:
-                    value = v.get('value', v_id)
-                    # Use overlap_count if available, otherwise use observation_count if available, otherwise calculate
-                    if 'overlap_count' in v:
-                        num_observations = v['overlap_count']
-                    elif 'observation_count' in v:
-                        num_observations = v['observation_count']
-                    else:
-                        # Count observations connected to this identifier using Cypher
-                        # Only count for node types that are not source or observation_of_identity
-                        if raw_label not in ['source', 'observation_of_identity']:
-                            count_query = """
-                            MATCH (obs:observation_of_identity)-[r]->(identifier)
-                            WHERE elementId(identifier) = $node_id
-                            RETURN count(DISTINCT obs) as count
-                            """
-                            count_result = session.run(count_query, node_id=v_id)
-                            count_record = count_result.single()
-                            num_observations = count_record["count"] if count_record else 0
-                        else:
-                            num_observations = 0
-
-                name = v.get('name', value)
-                # Use dynamic color assignment
-                color = get_node_color(raw_label)
-
-                # Check if this is an initial search node (is in the initial_nodes list)
-                is_initial_search_node = any(str(init_node.get('elementId', init_node)) == v_id for init_node in initial_nodes)
-
-                # Apply bolded color and larger border width for initial search nodes
-                if is_initial_search_node:
-                    color = {
-                        'background': '#FFD700',  # Gold background
-                        'border': '#FF4500'       # OrangeRed border
-                    }
-                    border_width = 4  # Larger border width for initial search nodes
+                node_count += 1
+                yield 'node', node
+
+        logger.info(f"Processed {node_count} nodes")
+
+        # Get ALL relationships between any vertices in our final set
+        if fetch_relationships:
+            with driver.session() as session:
+                if relationship_future is not None:
+                    relationship_results = [relationship_future.result()]
                 else:
-                    border_width = 1  # Default border width
-
-                # Update the display label for vertices with multiple observations
-                if num_observations > 1:
-                    value = f"{value}\n({num_observations} obs)"
-
-                node = {
-                    'id': v_id,
-                    'label': value,
-                    'title': tooltip or name,
-                    'group': raw_label,
-                    'color': color,
-                    'num_observations': num_observations,
-                    'is_shared': num_observations > 1,
-                    'properties': {**v, 'num_observations': num_observations},
-                    'borderWidth': border_width
-                }
-                nodes.append(node)
-
-            logger.info(f"Processed {len(nodes)} nodes")
-            logger.info(f"Seen IDs: {seen_ids}")
-
-            # Filter to only overlapping nodes if show_nodes_only_overlaps is True
-            if show_nodes_only_overlaps:
-                logger.info("Filtering to only overlapping nodes...")
-                overlapping_nodes = [node for node in nodes if node.get('is_shared', False) or node.get('num_observations', 0) > 1]
-                nodes = overlapping_nodes
-                logger.info(f"Filtered to {len(nodes)} overlapping nodes")
-                # Update seen_ids to only include overlapping nodes
-                seen_ids = {node['id'] for node in nodes}
-
-            # Get ALL relationships between any vertices in our final set
-            # Only get relationships if not in show_nodes_only_search mode
-            if not show_nodes_only_search and not show_nodes_only_overlaps:
-                logger.info("Getting relationships between vertices...")
-                
-                # Get relationships using Cypher
-                relationship_query = """
-                MATCH (from)-[r]->(to)
-                WHERE elementId(from) IN $node_ids AND elementId(to) IN $node_ids
-                RETURN from, r, to
-                """
-                
-                relationship_result = session.run(relationship_query, node_ids=list(seen_ids))
-                
+                    # Every relationship has an observation at one end (see personatrace_common.graph_schema)
+                    # and observations have few, so the relationships are read off the observations a
+                    # chunk at a time and the ones to nodes outside the graph are dropped here, rather
+                    # than sending every query the IDs of all the nodes
+                    logger.info("Getting relationships between vertices...")
+                    relationship_results = ((record for record in graph_backend.observation_relationship_records(session, chunk_ids)
+                                             if str(record['from'].element_id) in node_ids and str(record['to'].element_id) in node_ids)
+                                            for chunk_ids in batches(observation_ids, GRAPH_STREAM_RELATIONSHIP_CHUNK_SIZE, 1))
+
                 seen_relationship_ids = set()
-                formatted_relationships = []
-                relationship_counter = 0
-
-                for record in relationship_result:
-                    from_node = record["from"]
-                    relationship = record["r"]
-                    to_node = record["to"]
-                    
-                    relationship_id = str(relationship.element_id)
-                    if relationship_id in seen_relationship_ids:
-                        continue
-                    seen_relationship_ids.add(relationship_id)
-
-                    from_v = str(from_node.element_id)
-                    to_v = str(to_node.element_id)
-                    label = relationship.type
-                    # Use dynamic color assignment for relationships
-                    style = get_relationship_color(label)
-
-                    formatted_relationships.append({
-                        'id': f'e{relationship_counter}',
-                        'from': from_v,
-                        'to': to_v,
-                        'label': label,
-                        'title': label,
-                        'color': style['color'],
-                        'width': style['width'],
-                        'dashes': style['dashes'],
-                        'arrows': {'to': {'enabled': True, 'type': 'arrow'}}
-                    })
-                    relationship_counter += 1
-            else:
-                # No relationships when show_nodes_only_search is True
-                formatted_relationships = []
 
-        logger.info(f"Final counts - Nodes: {len(nodes)}, Relationships: {len(formatted_relationships)}")
+                for relationship_result in relationship_results:
+                    for record in relationship_result:
+                        relationship_id = str(record["r"].element_id)
+                        if relationship_id in seen_relationship_ids:
+                            continue
+                        seen_relationship_ids.add(relationship_id)
 
-        # Build the final color mappings for the frontend
-        final_relationship_colors = {}
-        
-        # Add dynamically assigned colors
-        for relationship_type, color in RELATIONSHIP_COLOR_ASSIGNMENTS.items():
-            final_relationship_colors[relationship_type] = color
-
-        result = {
-            'nodes': nodes,
-            'relationships': formatted_relationships,
-            'metadata': {
-                'nodeCount': len(nodes),
-                'relationshipCount': len(formatted_relationships),
-                'relationshipColors': final_relationship_colors
-            }
-        }
+                        yield 'relationship', format_graph_relationship(record, relationship_count)
+                        relationship_count += 1
 
-        return result
+        logger.info(f"Final counts - Nodes: {node_count}, Relationships: {relationship_count}")
+        yield 'metadata', graph_data_metadata(node_count, relationship_count, lazy_details, drill_down, budget, page)
     except Exception as e:
         logger.error(f"Error getting graph data: {str(e)}")
         raise Exception(f"Node query failed: {str(e)}")
-    
+
+
+def get_graph_data(driver, initial_nodes, num_hops, show_nodes_only_search, show_nodes_only_overlaps, lazy_details=False, all_nodes=None, drill_down=None, budget=None, page=None):
+    nodes = []
+    formatted_relationships = []
+    metadata = {}
+    # The whole response is built anyway, so the relationships are read while the nodes are formatted
+    for record_type, item in iter_graph_data(driver, initial_nodes, num_hops, show_nodes_only_search, show_nodes_only_overlaps, lazy_details, all_nodes, drill_down, budget,
+                                             prefetch_relationships=True, page=page):
+        if record_type == 'node':
+            nodes.append(item)
+        elif record_type == 'relationship':
+            formatted_relationships.append(item)
+        else:
+            metadata = item
+
+    return {
+        'nodes': nodes,
+        'relationships': formatted_relationships,
+        'metadata': metadata
+    }
+
+
+def _iter_unique_nodes(all_nodes):
+    """Yield the raw node dicts of all_nodes as they are read, dropping duplicates (by elementId) but the first."""
+    seen_node_ids = set()
+    for node in all_nodes:
+        node_id = str(node['elementId'])
+        if node_id not in seen_node_ids:
+            seen_node_ids.add(node_id)
+            yield node
+
+
+def _unique_nodes(all_nodes):
+    """Drop duplicate raw node dicts (by elementId), keeping the first."""
+    return list(_iter_unique_nodes(all_nodes))
+
+
+def _read_ahead(all_nodes, max_nodes):
+    """
+    (unique raw node dicts, whether there are more than max_nodes of them). An iterator of nodes
+    (see _iter_graph_nodes) is read up to max_nodes + 1 unique nodes, and only read to the end if
+    it has more, otherwise the nodes read are all of them.
+    """
+    unique_nodes = _iter_unique_nodes(all_nodes)
+    nodes = list(islice(unique_nodes, max_nodes + 1))
+    if len(nodes) <= max_nodes:
+        return nodes, False
+    nodes.extend(unique_nodes)
+    return nodes, True
+
+
+def _cluster_label(key, cluster):
+    """Display label of a cluster node, e.g. 'email_address (1,234)' or 'breach observations (500)'."""
+    if key == OTHER_CLUSTER_KEY:
+        return f"Other ({cluster['size']:,} nodes)"
+    if key.startswith('component:'):
+        return f"Component ({cluster['size']:,} nodes)"
+    parts = key.split(':', 2)
+    if len(parts) == 3:
+        return f"{parts[2]} observations ({cluster['size']:,})"
+    return f"{parts[1]} ({cluster['size']:,})"
+
+
+def aggregate_graph_data(driver, all_nodes, cluster_by, lazy_details=False):
+    """
+    Build graph data with one node per cluster instead of one per node, so the response stays
+    bounded by AGGREGATION_NODE_BUDGET whatever the number of matches.
+
+    Cluster relationships carry the number of relationships between the members of the two
+    clusters as their value. Drill down into a cluster with the cluster request parameter.
+    """
+    nodes = _unique_nodes(all_nodes)
+    endpoints = list(iter_relationship_endpoints(driver, [str(node['elementId']) for node in nodes]))
+    membership = assign_clusters(nodes, endpoints, cluster_by, AGGREGATION_NODE_BUDGET)
+    clusters, cluster_edges = summarize_clusters(nodes, membership, endpoints)
+
+    color = get_node_color('cluster')
+    formatted_nodes = []
+    for key, cluster in sorted(clusters.items(), key=lambda item: (-item[1]['size'], item[0])):
+        label = _cluster_label(key, cluster)
+        title = '\n'.join([label] + [f'{node_label}: {count:,}' for node_label, count in cluster['labelCounts'].most_common()])
+        formatted_nodes.append({
+            'id': f'cluster:{key}',
+            'label': label,
+            'title': title,
+            'group': 'cluster',
+            'color': color,
+            'num_observations': 0,
+            'is_shared': False,
+            'borderWidth': 1,
+            'value': cluster['size'],
+            # Cluster properties are small and always sent, the frontend drills down with clusterKey
+            'properties': {
+                'clusterKey': key,
+                'clusterSize': cluster['size'],
+                'labelCounts': dict(cluster['labelCounts']),
+                'internalRelationships': cluster['internalRelationships']
+            }
+        })
+
+    style = get_relationship_color('cluster_link')
+    formatted_relationships = []
+    for i, ((from_key, to_key), weight) in enumerate(sorted(cluster_edges.items())):
+        formatted_relationships.append({
+            'id': f'e{i}',
+            'from': f'cluster:{from_key}',
+            'to': f'cluster:{to_key}',
+            'label': 'cluster_link',
+            'title': f'{weight:,} relationships',
+            'value': weight,
+            'color': style['color'],
+            'width': style['width'],
+            'dashes': style['dashes'],
+            'arrows': {'to': {'enabled': True, 'type': 'arrow'}}
+        })
+
+    logger.info(f"Aggregated {len(nodes)} nodes and {len(endpoints)} relationships into {len(formatted_nodes)} clusters and {len(formatted_relationships)} cluster relationships")
+
+    return {
+        'nodes': formatted_nodes,
+        'relationships': formatted_relationships,
+        'metadata': {
+            'nodeCount': len(formatted_nodes),
+            'relationshipCount': len(formatted_relationships),
+            'relationshipColors': dict(RELATIONSHIP_COLOR_ASSIGNMENTS),
+            'lazyDetails': lazy_details,
+            'aggregated': {
+                'clusterBy': cluster_by,
+                'nodeBudget': AGGREGATION_NODE_BUDGET,
+                'memberNodeCount': len(nodes),
+                'memberRelationshipCount': len(endpoints)
+            }
+        }
+    }
+
+
+def select_cluster_nodes(driver, all_nodes, cluster_key, cluster_by):
+    """
+    Return the raw nodes of one cluster of an aggregated result, capped at AGGREGATION_NODE_BUDGET,
+    and the drill-down metadata ({'key', 'clusterBy', 'size', 'truncated'}).
+    """
+    nodes = _unique_nodes(all_nodes)
+    endpoints = []
+    if cluster_by == 'component':
+        endpoints = list(iter_relationship_endpoints(driver, [str(node['elementId']) for node in nodes]))
+    membership = assign_clusters(nodes, endpoints, cluster_by, AGGREGATION_NODE_BUDGET)
+
+    members = [node for node in nodes if membership[str(node['elementId'])] == cluster_key]
+    logger.info(f"Drilling down into cluster {cluster_key} with {len(members)} nodes")
+
+    return members[:AGGREGATION_NODE_BUDGET], {
+        'key': cluster_key,
+        'clusterBy': cluster_by,
+        'size': len(members),
+        'truncated': len(members) > AGGREGATION_NODE_BUDGET
+    }
+
+
+def iter_graph_data_frames(records, chunk_size=GRAPH_STREAM_CHUNK_SIZE):
+    """
+    Group graph data records into NDJSON frames of up to chunk_size nodes or relationships,
+    e.g. {"type": "nodes", "items": [...]}, {"type": "relationships", "items": [...]} and a
+    final {"type": "metadata", "metadata": {...}}.
+    """
+    chunk_type = None
+    chunk = []
+    for record_type, item in records:
+        if record_type == 'metadata':
+            if chunk:
+                yield {'type': chunk_type, 'items': chunk}
+                chunk_type, chunk = None, []
+            yield {'type': 'metadata', 'metadata': item}
+            continue
+
+        frame_type = 'nodes' if record_type == 'node' else 'relationships'
+        if chunk and (frame_type != chunk_type or len(chunk) >= chunk_size):
+            yield {'type': chunk_type, 'items': chunk}
+            chunk = []
+        chunk_type = frame_type
+        chunk.append(item)
+
+    if chunk:
+        yield {'type': chunk_type, 'items': chunk}
 
 
 @graph_bp.route('/api/find-paths')
@@ -771,6 +1171,13 @@ def api_find_paths():
         from_node_id = request.args.get('fromNodeId')
         to_node_id = request.args.get('toNodeId')
         max_depth = request.args.get('maxDepth',FIND_PATHS_MAX_DEPTH)
+        # Traverse observation -> observation over the shares_identifiers overlap projection
+        use_overlap_projection = request.args.get('useOverlapProjection', 'false').lower() == 'true'
+        min_shared_identifiers = request.args.get('minSharedIdentifiers', '1')
+        # Only go through observations dated within the window (see api_graph_data)
+        date_from = request.args.get('dateFrom', '')
+        date_to = request.args.get('dateTo', '')
+        last_days = request.args.get('lastDays', '')
         
         if not from_node_id or not to_node_id:
             return jsonify({
@@ -779,51 +1186,39 @@ def api_find_paths():
             }), 400
         
         try:
-            max_depth = int(max_depth)
+            max_depth = min(max(int(max_depth), 1), FIND_PATHS_MAX_DEPTH)
         except (ValueError, TypeError):
             max_depth = FIND_PATHS_MAX_DEPTH
+        try:
+            min_shared_identifiers = int(min_shared_identifiers)
+        except (ValueError, TypeError):
+            min_shared_identifiers = 1
+        try:
+            date_window = parse_date_window(date_from, date_to, last_days)
+        except ValueError as e:
+            return jsonify({
+                'error': f"Invalid date window: {e}",
+                'type': 'Invalid parameters'
+            }), 400
+        if use_overlap_projection:
+            unsupported = _unsupported_response('overlap_projection')
+            if unsupported:
+                return unsupported
         
         logger.info(f"Finding paths from {from_node_id} to {to_node_id} with max depth {max_depth}")
         
         # Establish Neo4j connection
         driver = get_neo4j_connection()
+        # Rows and time the search may spend before it returns the paths found so far
+        budget = current_work_budget()
         
         with driver.session() as session:
-            # First, find the shortest path length
-            shortest_length_query = """
-            MATCH (start), (end)
-            WHERE elementId(start) = $from_node_id AND elementId(end) = $to_node_id
-            MATCH p = shortestPath((start)-[*1..{max_depth}]-(end))
-            RETURN length(p) as pathLength
-            LIMIT 1
-            """
-            
-            shortest_result = session.run(shortest_length_query.format(max_depth=max_depth), 
-                                        from_node_id=from_node_id, to_node_id=to_node_id)
-            shortest_record = shortest_result.single()
-            
-            if not shortest_record:
-                # No path found
-                return jsonify({
-                    'paths': [],
-                    'count': 0
-                })
-            
-            shortest_length = shortest_record["pathLength"]
-            logger.info(f"Shortest path length: {shortest_length}")
-            
-            # Now find all paths of the shortest length
-            all_paths_query = f"""
-            MATCH (start), (end)
-            WHERE elementId(start) = $from_node_id AND elementId(end) = $to_node_id
-            MATCH p = (start)-[*{shortest_length}]-(end)
-            RETURN nodes(p) AS pathNodes, relationships(p) AS pathRelationsihps
-            """
-            
-            result = session.run(all_paths_query, from_node_id=from_node_id, to_node_id=to_node_id)
+            result = graph_backend.shortest_path_records(session, from_node_id, to_node_id, max_depth, date_window, use_overlap_projection, min_shared_identifiers)
             
             paths = []
             for record in result:
+                if budget.exhausted():
+                    break
                 path_nodes = record["pathNodes"]
                 path_relationships = record["pathRelationsihps"]
                 
@@ -852,9 +1247,16 @@ def api_find_paths():
             
             return jsonify({
                 'paths': paths,
-                'count': len(paths)
+                'count': len(paths),
+                **budget.metadata()
             })
             
+    except UnsupportedFeatureError as e:
+        # Close Neo4j connection
+        if 'driver' in locals():
+            driver.close()
+        return _unsupported_response(e.feature)
+
     except Exception as e:
         # Close Neo4j connection
         if 'driver' in locals():
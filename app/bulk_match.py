@@ -0,0 +1,49 @@
+#! /usr/bin/env python3
+'''
+Match a list of values (emails, phone numbers, IP addresses...) against the graph from the
+command line, the same way as /api/bulk-match but without going through the app.
+
+    uv run bulk_match.py emails.txt --labels email_address --output matches.ndjson
+    cat ips.txt | uv run bulk_match.py - --neo4j_endpoint bolt://localhost:7687
+
+Matches are written as NDJSON, one line per matched identifier, followed by a summary line with
+the throughput in values per second.
+'''
+import argparse
+import json
+import sys
+
+parser = argparse.ArgumentParser(description='Match a list of values against the PersonaTrace graph')
+parser.add_argument('file', type=str, help='File with one value per line, - for stdin')
+parser.add_argument('--labels', type=str, help='Comma separated identifier labels to match, e.g. email_address (default: all)', default='')
+parser.add_argument('--chunk_size', type=int, help='Number of values looked up per query')
+parser.add_argument('--output', type=str, help='File to write the NDJSON matches to (default: stdout)')
+args, remaining_args = parser.parse_known_args()
+# The Neo4j connection arguments are parsed by lib.constants
+sys.argv = [sys.argv[0]] + remaining_args
+
+from lib.constants import logger, BULK_MATCH_CHUNK_SIZE
+from lib.neo4j_connection import get_neo4j_connection
+from modules.bulk_match import iter_bulk_values, iter_bulk_matches
+
+
+def main():
+    labels = [label.strip() for label in args.labels.split(',') if label.strip()]
+    driver = get_neo4j_connection()
+    input_file = sys.stdin if args.file == '-' else open(args.file, 'r')
+    output_file = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for frame in iter_bulk_matches(driver, iter_bulk_values(input_file), labels, args.chunk_size or BULK_MATCH_CHUNK_SIZE):
+            output_file.write(json.dumps(frame, separators=(',', ':'), default=str) + '\n')
+            if frame['type'] == 'summary':
+                logger.info(f"Matched {frame['values']} values ({frame['matches']} matches) at {frame['valuesPerSecond']} values/s")
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+        driver.close()
+
+
+if __name__ == '__main__':
+    main()
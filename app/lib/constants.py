@@ -7,6 +7,23 @@ parser.add_argument('--neo4j_endpoint', type=str, help='Neo4j endpoint', default
 parser.add_argument('--neo4j_username', type=str, help='Neo4j username', default='neo4j')
 parser.add_argument('--neo4j_password', type=str, help='Neo4j password', default='personatrace')
 parser.add_argument('--debug', action='store_true', help='Debug mode')
+parser.add_argument('--aggregation_node_budget', type=int, help='Node count above which graph data is aggregated into clusters', default=5000)
+parser.add_argument('--debug_dump_sample_rate', type=float, help='Fraction of requests whose large debug dumps (e.g. every initial node) are logged in --debug mode', default=0.01)
+parser.add_argument('--slow_query_threshold', type=float, help='Queries taking longer than this many seconds are recorded to the slow query log (0 to disable)', default=1.0)
+parser.add_argument('--slow_query_plan', type=str, choices=['profile', 'explain', 'none'], help='Plan captured for slow read queries, write queries are only ever EXPLAINed', default='profile')
+parser.add_argument('--slow_query_log', type=str, help='Slow query log file if not logs/slow_queries.log')
+parser.add_argument('--query_timeout', type=float, help='Transaction timeout in seconds of the queries run by a request (0 for none)', default=60)
+parser.add_argument('--endpoint_query_timeouts', type=str, help='Comma separated endpoint=seconds transaction timeouts overriding --query_timeout', default='/api/find-paths=30,/api/bulk-match=300')
+parser.add_argument('--max_request_rows', type=int, help='Rows a graph or path search may read before it stops expanding and returns a partial result (0 for no limit)', default=1000000)
+parser.add_argument('--max_request_seconds', type=float, help='Seconds a graph or path search may run before it stops expanding and returns a partial result (0 for no limit)', default=120)
+parser.add_argument('--query_concurrency', type=int, help='Independent queries of one graph search run concurrently, each on its own session (1 to run them in sequence)', default=8)
+parser.add_argument('--load_bookmarks', type=str, help='Bookmarks of the last committed load written by the data loader, read sessions wait for a server that has caught up with them, if not ../dataloader/data/load_bookmarks.json')
+parser.add_argument('--query_cache_size', type=int, help="Size of Neo4j's query plan cache (server.db.query_cache_size), to estimate its hit rate in /metrics", default=1000)
+parser.add_argument('--graph_backend', type=str, choices=['neo4j', 'memory'], help='Graph the searches run on: Neo4j, or an in-memory graph of --memory_graph_data for demos and tests without a database', default='neo4j')
+parser.add_argument('--memory_graph_data', type=str, help='Observations file (NDJSON, optionally .gz) or folder loaded by --graph_backend memory, if not ../dataloader/data/example_data')
+parser.add_argument('--normalize_identifiers', action='store_true', help='The graph was loaded with the dataloader\'s --normalize_identifiers: normalize searched and bulk matched values the same way')
+parser.add_argument('--default_phone_country_code', type=str, help='The --default_phone_country_code the graph was loaded with', default='')
+parser.add_argument('--max_hops', type=int, help='Hops a graph search may expand, deeper searches are cut to this many and flagged partial', default=5)
 args = parser.parse_args()
 
 # Neo4j connection constants
@@ -39,6 +56,82 @@ console = Console()
 # Max depth for finding paths if it's not given in the request
 FIND_PATHS_MAX_DEPTH = 10
 
+# Number of nodes or relationships sent per frame when streaming graph data as NDJSON
+GRAPH_STREAM_CHUNK_SIZE = 500
+# Number of observations whose relationships are read per query when streaming graph data
+GRAPH_STREAM_RELATIONSHIP_CHUNK_SIZE = 5000
+
+# Server-side layout (layout=server): force-directed iterations, distance between nodes in canvas
+# units, node count above which repulsion is approximated on a grid of LAYOUT_GRID_SIZE^2 cells,
+# and number of layouts kept in the per-result cache
+LAYOUT_ITERATIONS = 50
+LAYOUT_NODE_SPACING = 120
+LAYOUT_EXACT_REPULSION_MAX_NODES = 500
+LAYOUT_GRID_SIZE = 32
+LAYOUT_CACHE_SIZE = 32
+
+# Results with more nodes than this are returned as cluster nodes (see modules/graph_aggregation.py),
+# which also bounds the number of clusters and the size of a drilled-down cluster
+AGGREGATION_NODE_BUDGET = args.aggregation_node_budget
+
+# Fraction of the large debug dumps that are logged (see modules/request_tracing.log_sampled)
+DEBUG_DUMP_SAMPLE_RATE = args.debug_dump_sample_rate
+
+# Slow query log (see modules/slow_queries.py), rotated at SLOW_QUERY_LOG_MAX_BYTES keeping SLOW_QUERY_LOG_BACKUPS old files
+from pathlib import Path
+SLOW_QUERY_THRESHOLD = args.slow_query_threshold
+SLOW_QUERY_PLAN = args.slow_query_plan
+SLOW_QUERY_LOG_FILE = args.slow_query_log if args.slow_query_log else str(Path(__file__).parent.parent / 'logs' / 'slow_queries.log')
+SLOW_QUERY_LOG_MAX_BYTES = 10 * 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = 5
+
+# Transaction timeout per query (seconds, None for no timeout), per endpoint where configured
+# (see modules/work_budget.py)
+QUERY_TIMEOUT = args.query_timeout or None
+ENDPOINT_QUERY_TIMEOUTS = {endpoint.strip(): float(seconds) or None for endpoint, seconds in
+                           (item.rsplit('=', 1) for item in args.endpoint_query_timeouts.split(',') if item.strip())}
+
+# Work budget of the traversal endpoints: rows read, hops expanded and wall time before the search
+# stops expanding and flags its result as partial (None for no limit)
+WORK_BUDGET_ENDPOINTS = ['/api/graph-data', '/api/find-paths']
+MAX_REQUEST_ROWS = args.max_request_rows or None
+MAX_REQUEST_SECONDS = args.max_request_seconds or None
+MAX_HOPS = args.max_hops
+
+# Independent lookups of one graph search (e.g. the sources of different observations) run
+# concurrently, at most this many at a time per request: on worker threads with the sync driver
+# (modules/parallel_queries.py), as tasks on the async driver when serving with asgi.py
+QUERY_CONCURRENCY = max(args.query_concurrency, 1)
+
+# The app only reads, so its sessions are opened in read mode (routed to the readers of a cluster
+# with a neo4j:// endpoint) with the bookmarks of the data loader's last load (see modules/read_routing.py)
+LOAD_BOOKMARKS_FILE = args.load_bookmarks if args.load_bookmarks else str(Path(__file__).parent.parent.parent / 'dataloader' / 'data' / 'load_bookmarks.json')
+
+# Neo4j caches the plan of the last server.db.query_cache_size query texts, /metrics estimates its
+# hit rate by keeping as many of the query texts run by this process (see modules/request_tracing.py)
+QUERY_CACHE_SIZE = max(args.query_cache_size, 1)
+
+# Graph the searches run on: Neo4j, or the observations of MEMORY_GRAPH_DATA loaded in memory
+# (see modules/memory_graph.py)
+GRAPH_BACKEND = args.graph_backend
+MEMORY_GRAPH_DATA = args.memory_graph_data if args.memory_graph_data else str(Path(__file__).parent.parent.parent / 'dataloader' / 'data' / 'example_data')
+
+# Searched and bulk matched identifier values are normalized like the dataloader normalized the
+# loaded ones, so either spelling of a value finds its canonical node (see modules/identifier_normalization.py)
+NORMALIZE_IDENTIFIERS = args.normalize_identifiers
+DEFAULT_PHONE_COUNTRY_CODE = args.default_phone_country_code.strip().lstrip('+')
+
+# Most observations whose sources a graph search looks up in one query
+SOURCE_LOOKUP_BATCH_SIZE = 1000
+
+# Number of values looked up per query by /api/bulk-match and bulk_match.py
+BULK_MATCH_CHUNK_SIZE = 5000
+
+# Labels that are never identifiers, and the relationships derived from the loaded data by the
+# dataloader (the shares_identifiers overlap projection and the source_overlap matrix), excluded from
+# the displayed graph and from traversals that expect the original data. Shared with the dataloader
+from personatrace_common.graph_schema import NON_IDENTIFIER_LABELS, SHARES_IDENTIFIERS, SOURCE_OVERLAP, DERIVED_RELATIONSHIP_TYPES
+
 # Static color definitions for each node type
 NODE_COLORS = {
     #########################################################
@@ -1,19 +1,41 @@
-from neo4j import GraphDatabase
-from lib.constants import NEO4J_ENDPOINT, NEO4J_USERNAME, NEO4J_PASSWORD, logger
+from neo4j import AsyncGraphDatabase, GraphDatabase
+from lib.constants import NEO4J_ENDPOINT, NEO4J_USERNAME, NEO4J_PASSWORD, GRAPH_BACKEND, MEMORY_GRAPH_DATA, logger
+from modules.identifier_normalization import identifier_normalizer
+from modules.memory_graph import get_memory_graph
+from modules.request_tracing import trace_driver
+
+def create_driver():
+    """
+    A plain (untraced) Neo4j driver of the configured endpoint and credentials, for the app's own
+    long lived drivers. Sessions opened with modules/read_routing.read_session_kwargs() are routed
+    to the readers of a cluster with a neo4j:// endpoint.
+    """
+    return GraphDatabase.driver(NEO4J_ENDPOINT, auth=(NEO4J_USERNAME, NEO4J_PASSWORD))
+
+
+def create_async_driver():
+    """create_driver for the neo4j async driver (asgi.py)."""
+    return AsyncGraphDatabase.driver(NEO4J_ENDPOINT, auth=(NEO4J_USERNAME, NEO4J_PASSWORD))
+
 
 def get_neo4j_connection():
     """
     Get a Neo4j database connection using the configured credentials.
     
+    Within a request the driver traces its queries as spans of the request (see modules/request_tracing.py).
+    With --graph_backend memory the in-memory graph (see modules/memory_graph.py) stands in for the driver.
+
     Returns:
         GraphDatabase.driver: Neo4j driver instance
     """
+    if GRAPH_BACKEND == 'memory':
+        return get_memory_graph(MEMORY_GRAPH_DATA, identifier_normalizer)
     try:
-        driver = GraphDatabase.driver(NEO4J_ENDPOINT, auth=(NEO4J_USERNAME, NEO4J_PASSWORD))
+        driver = trace_driver(create_driver())
         # Test the connection
         with driver.session() as session:
             session.run("RETURN 1")
-        logger.info("Connected to Neo4j successfully!")
+        logger.debug("Connected to Neo4j successfully!")
         return driver
     except Exception as e:
         logger.error(f"Failed to connect to Neo4j: {str(e)}")
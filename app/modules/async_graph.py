@@ -0,0 +1,250 @@
+import asyncio
+import time
+
+from neo4j import Query
+from neo4j.exceptions import Neo4jError
+
+from lib.constants import logger, DERIVED_RELATIONSHIP_TYPES, SOURCE_LOOKUP_BATCH_SIZE
+from modules.date_window import date_condition, date_window_params
+from modules.parallel_queries import batches
+from modules.read_routing import read_session_kwargs
+from modules.request_tracing import server_address, query_plan_cache
+from modules.slow_queries import slow_query_log
+from modules.work_budget import WorkBudget, is_timeout_error
+from modules.graph_format import (format_graph_node, format_graph_relationship, node_to_dict, graph_data_metadata, SOURCES_QUERY,
+                                  SOURCE_VALUE_QUERY, OBSERVATION_COUNT_QUERY, RELATIONSHIP_QUERY)
+
+
+class AsyncQueries:
+    """
+    Runs the queries of one ASGI request on the shared async driver.
+
+    Each query gets its own session, so independent lookups can run concurrently (at most
+    concurrency at a time per request). Queries are recorded as spans of the request trace,
+    charged to its work budget and passed on to the slow query log, like the queries of the
+    traced sync driver (modules/request_tracing.py).
+    """
+
+    def __init__(self, driver, trace, concurrency):
+        self.driver = driver
+        self.trace = trace
+        self.budget = trace.budget or WorkBudget()
+        self.concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(self, caller, query, **parameters):
+        """
+        All records of query, caller naming its span (e.g. get_initial_nodes).
+
+        A query that runs out of its transaction timeout returns the records read so far and
+        flags the result as partial.
+        """
+        span = {'name': caller, 'query': ' '.join(query.split())[:200], 'db_seconds': 0.0, 'rows': 0,
+                'plan_cache': query_plan_cache.lookup(query)}
+        records = []
+        summary = None
+        timed_out = False
+        async with self._semaphore:
+            start = time.perf_counter()
+            try:
+                async with self.driver.session(**read_session_kwargs()) as session:
+                    timeout = self.trace.query_timeout
+                    result = await session.run(Query(query, timeout=timeout) if timeout else query, parameters)
+                    async for record in result:
+                        records.append(record)
+                    summary = await result.consume()
+            except Neo4jError as e:
+                if not is_timeout_error(e):
+                    raise
+                logger.warning(f"Query in {caller} ran out of its transaction timeout")
+                timed_out = True
+                self.budget.stop('query_timeout')
+            span['db_seconds'] = time.perf_counter() - start
+
+        span['rows'] = len(records)
+        span['result_available_after'] = getattr(summary, 'result_available_after', None)
+        span['result_consumed_after'] = getattr(summary, 'result_consumed_after', None)
+        span['server'] = server_address(summary)
+        self.budget.charge_rows(len(records))
+        self.trace.add_span(span)
+        slow_query_log.record(query, parameters, span['db_seconds'], span['rows'], caller, self.trace.endpoint,
+                              self.trace.query_timeout, timed_out)
+        return records
+
+    async def fetch_each(self, caller, query, parameter_sets):
+        """fetch query once per dict of parameter_sets, concurrently, returning the records in the same order."""
+        return await asyncio.gather(*(self.fetch(caller, query, **parameters) for parameters in parameter_sets))
+
+
+async def _sources_of(queries, observation_ids):
+    """
+    Source node dicts of the observations in the order of observation_ids, looked up
+    SOURCE_LOOKUP_BATCH_SIZE observations per query with the batches fetched concurrently.
+    """
+    results = await queries.fetch_each('_collect_graph_nodes', SOURCES_QUERY,
+                                       [{'obs_ids': batch} for batch in batches(dict.fromkeys(observation_ids), SOURCE_LOOKUP_BATCH_SIZE, queries.concurrency)])
+    sources = {record['obs_id']: record['s'] for records in results for record in records}
+    return [node_to_dict(sources[obs_id]) for obs_id in observation_ids if obs_id in sources]
+
+
+async def _expand_overlaps(queries, observation_ids, date_window):
+    """
+    One hop of _collect_graph_nodes: the identifiers the observations share with 2+ observations,
+    the observations of each of them and their sources, looking up each identifier concurrently.
+
+    Returns:
+        tuple: (raw node dicts, IDs of the observations reached)
+    """
+    overlapping_nodes_query = f"""
+    MATCH (obs:observation_of_identity)-[r]->(identifier)
+    WHERE elementId(obs) IN $observation_ids AND NOT identifier:observation_of_identity
+    WITH identifier
+    MATCH (other_obs:observation_of_identity)-[other_r]->(identifier){date_condition('other_obs', date_window, 'WHERE')}
+    WITH identifier, count(DISTINCT other_obs) as overlap_count
+    WHERE overlap_count >= 2
+    RETURN identifier, overlap_count
+    """
+    obs_query = f"""
+    MATCH (obs:observation_of_identity)-[r]->(identifier)
+    WHERE elementId(identifier) = $identifier_id{date_condition('obs', date_window)}
+    RETURN DISTINCT obs
+    """
+    records = await queries.fetch('_collect_graph_nodes', overlapping_nodes_query, observation_ids=list(observation_ids),
+                                  **date_window_params(date_window))
+    if queries.budget.exhausted():
+        return [], set()
+
+    obs_results = await queries.fetch_each('_collect_graph_nodes', obs_query, [
+        {'identifier_id': str(record['identifier'].element_id), **date_window_params(date_window)} for record in records
+    ])
+
+    nodes = []
+    # Insertion ordered, so the sources are looked up (and merged) in a deterministic order
+    reached = {}
+    for record, obs_records in zip(records, obs_results):
+        nodes.append(node_to_dict(record['identifier'], {'overlap_count': record['overlap_count']}))
+        for obs_record in obs_records:
+            obs = obs_record['obs']
+            nodes.append(node_to_dict(obs))
+            reached.setdefault(str(obs.element_id), None)
+
+    if not queries.budget.exhausted():
+        nodes.extend(await _sources_of(queries, list(reached)))
+    return nodes, set(reached)
+
+
+async def collect_graph_nodes_async(queries, initial_nodes, num_hops, show_nodes_only_search, show_nodes_only_overlaps, date_window=None):
+    """
+    _collect_graph_nodes for the ASGI mode: the same nodes, with the independent lookups of each
+    step (the observations of the initial identifiers and the sources of the initial observations,
+    the observations of each overlapping identifier, the source of each observation) run concurrently.
+
+    Nodes are merged in a deterministic order, keeping the first dict of each elementId.
+    """
+    if show_nodes_only_search or show_nodes_only_overlaps or num_hops == 0:
+        return initial_nodes
+
+    budget = queries.budget
+    initial_observations = [v for v in initial_nodes if 'observation_of_identity' in v['labels']]
+    initial_other_nodes = [v for v in initial_nodes if 'observation_of_identity' not in v['labels']]
+    logger.info(f"Getting overlapping nodes within {num_hops} hops of {len(initial_nodes)} initial nodes")
+
+    direct_obs_query = f"""
+    MATCH (identifier)-[r]-(obs:observation_of_identity)
+    WHERE elementId(identifier) IN $initial_ids{date_condition('obs', date_window)}
+    RETURN DISTINCT obs
+    """
+
+    async def direct_observations():
+        if not initial_other_nodes:
+            return []
+        records = await queries.fetch('_collect_graph_nodes', direct_obs_query, initial_ids=[str(v['elementId']) for v in initial_other_nodes],
+                                      **date_window_params(date_window))
+        observations = [node_to_dict(record['obs']) for record in records]
+        return observations + await _sources_of(queries, [str(obs['elementId']) for obs in observations])
+
+    direct_nodes, initial_sources = await asyncio.gather(
+        direct_observations(),
+        _sources_of(queries, [str(obs['elementId']) for obs in initial_observations])
+    )
+    all_nodes = direct_nodes + list(initial_observations) + initial_sources + list(initial_other_nodes)
+    current_observation_ids = {str(v['elementId']) for v in direct_nodes + initial_observations if 'observation_of_identity' in v['labels']}
+
+    # Overlapping nodes of the observations of the initial nodes, then one expansion per hop
+    if current_observation_ids and not budget.exhausted():
+        nodes, reached = await _expand_overlaps(queries, current_observation_ids, date_window)
+        all_nodes.extend(nodes)
+        current_observation_ids |= reached
+
+    for hop in range(1, num_hops + 1):
+        if not current_observation_ids or budget.exhausted():
+            break
+        nodes, current_observation_ids = await _expand_overlaps(queries, current_observation_ids, date_window)
+        all_nodes.extend(nodes)
+        logger.info(f"Hop {hop}: Found {len([n for n in nodes if 'overlap_count' in n])} overlapping nodes and {len(current_observation_ids)} observations")
+
+    unique_nodes = {}
+    for node in all_nodes:
+        unique_nodes.setdefault(str(node['elementId']), node)
+    logger.info(f"Found {len(unique_nodes)} total unique nodes")
+    return list(unique_nodes.values())
+
+
+async def get_graph_data_async(queries, initial_nodes, all_nodes, show_nodes_only_search, show_nodes_only_overlaps, drill_down=None):
+    """
+    get_graph_data with lazy details for the ASGI mode.
+
+    The sources of observations and the observation counts of identifiers that format_graph_node
+    would look up one by one are fetched concurrently, along with the relationships between the nodes.
+    """
+    unique_nodes = {}
+    for v in all_nodes:
+        unique_nodes.setdefault(str(v['elementId']), v)
+    initial_node_ids = {str(v['elementId']) for v in initial_nodes}
+
+    def raw_label(v):
+        return v['labels'][0] if v['labels'] else 'default'
+
+    missing_sources = [node_id for node_id, v in unique_nodes.items() if raw_label(v).startswith('observation_of_') and 'source' not in v]
+    missing_counts = [node_id for node_id, v in unique_nodes.items()
+                      if not raw_label(v).startswith('observation_of_') and raw_label(v) != 'source'
+                      and 'overlap_count' not in v and 'observation_count' not in v]
+
+    async def relationships():
+        if show_nodes_only_search or show_nodes_only_overlaps:
+            return []
+        return await queries.fetch('iter_graph_data', RELATIONSHIP_QUERY, node_ids=list(unique_nodes), derived_relationship_types=DERIVED_RELATIONSHIP_TYPES)
+
+    source_results, count_results, relationship_records = await asyncio.gather(
+        queries.fetch_each('format_graph_node', SOURCE_VALUE_QUERY, [{'obs_id': node_id} for node_id in missing_sources]),
+        queries.fetch_each('format_graph_node', OBSERVATION_COUNT_QUERY, [{'node_id': node_id} for node_id in missing_counts]),
+        relationships()
+    )
+    # Filled in, the nodes are formatted without any query (lazy details leave the filled in properties out)
+    for node_id, records in zip(missing_sources, source_results):
+        unique_nodes[node_id] = {**unique_nodes[node_id], 'source': records[0]['source_value'] if records else 'Unknown'}
+    for node_id, records in zip(missing_counts, count_results):
+        unique_nodes[node_id] = {**unique_nodes[node_id], 'observation_count': records[0]['count'] if records else 0}
+
+    nodes = []
+    for v in unique_nodes.values():
+        node = format_graph_node(v, initial_node_ids, lazy_details=True)
+        if show_nodes_only_overlaps and not (node.get('is_shared', False) or node.get('num_observations', 0) > 1):
+            continue
+        nodes.append(node)
+
+    formatted_relationships = []
+    seen_relationship_ids = set()
+    for record in relationship_records:
+        relationship_id = str(record['r'].element_id)
+        if relationship_id in seen_relationship_ids:
+            continue
+        seen_relationship_ids.add(relationship_id)
+        formatted_relationships.append(format_graph_relationship(record, len(formatted_relationships)))
+
+    logger.info(f"Final counts - Nodes: {len(nodes)}, Relationships: {len(formatted_relationships)}")
+    return {
+        'nodes': nodes,
+        'relationships': formatted_relationships,
+        'metadata': graph_data_metadata(len(nodes), len(formatted_relationships), True, drill_down, queries.budget)
+    }
@@ -0,0 +1,95 @@
+import time
+
+from lib.constants import logger, BULK_MATCH_CHUNK_SIZE, NON_IDENTIFIER_LABELS
+from modules.graph_backend import graph_backend
+from modules.identifier_normalization import candidate_values
+
+
+def iter_bulk_values(lines):
+    """
+    Yield the values of an uploaded list, one per line.
+
+    Lines may be bytes or str, surrounding whitespace is stripped and empty lines are skipped.
+    Values are matched exactly against the indexed identifier values, normalized per label if the
+    graph was loaded with --normalize_identifiers (see iter_bulk_matches).
+    """
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        value = line.strip()
+        if value:
+            yield value
+
+
+def _chunks(values, chunk_size):
+    chunk = []
+    for value in values:
+        chunk.append(value)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_bulk_matches(driver, values, labels=None, chunk_size=BULK_MATCH_CHUNK_SIZE):
+    """
+    Match a stream of values against the identifiers of the graph.
+
+    Values are read chunk_size at a time and looked up with one UNWIND query per chunk and label,
+    so every lookup is an index seek on the label's value index and the whole list shares one
+    session. The list is never held in memory beyond the current chunk. On a graph loaded with
+    --normalize_identifiers each value is looked up as its canonical form in each label (see
+    modules/identifier_normalization.py), so e.g. +1 (555) 010-0000 matches +15550100000.
+
+    Args:
+        driver: Driver of get_neo4j_connection (lib/neo4j_connection.py)
+        values: Iterable of values (see iter_bulk_values)
+        labels: Identifier labels to match, all identifier labels in the graph if not given
+        chunk_size: Number of values per query
+
+    Yields:
+        dict: One 'match' frame per matched identifier ({'type', 'input', 'value', 'label', 'elementId',
+        'observationCount', 'sources'}, input being the value as uploaded), then a final 'summary' frame with the number of values,
+        matches, the elapsed seconds and the values matched per second
+    """
+    start_time = time.time()
+    num_values = 0
+    num_matches = 0
+    with driver.session() as session:
+        # Requested labels are only used if they exist, they are interpolated into the query
+        identifier_labels = [label for label in graph_backend.labels(session) if label not in NON_IDENTIFIER_LABELS]
+        if labels:
+            unknown_labels = set(labels) - set(identifier_labels)
+            if unknown_labels:
+                logger.warning(f"Ignoring unknown identifier labels: {sorted(unknown_labels)}")
+            labels = [label for label in labels if label in identifier_labels]
+        else:
+            labels = identifier_labels
+        logger.info(f"Bulk matching values against {labels} in chunks of {chunk_size}")
+
+        for chunk in _chunks(values, chunk_size):
+            num_values += len(chunk)
+            for label in labels:
+                lookups = [{'input': value, 'value': candidate} for value in chunk for candidate in candidate_values(label, value)]
+                for record in graph_backend.bulk_match_records(session, label, lookups):
+                    num_matches += 1
+                    yield {
+                        'type': 'match',
+                        'input': record['input'],
+                        'value': record['value'],
+                        'label': label,
+                        'elementId': record['element_id'],
+                        'observationCount': record['observation_count'],
+                        'sources': record['sources']
+                    }
+
+    seconds = time.time() - start_time
+    logger.info(f"Bulk matched {num_values} values ({num_matches} matches) in {seconds:.2f}s")
+    yield {
+        'type': 'summary',
+        'values': num_values,
+        'matches': num_matches,
+        'seconds': round(seconds, 3),
+        'valuesPerSecond': round(num_values / seconds) if seconds > 0 else None
+    }
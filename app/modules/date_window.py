@@ -0,0 +1,72 @@
+from datetime import date, timedelta
+
+# Observation dates are ISO strings (YYYY-MM-DD, optionally followed by a time), so a window is
+# a string range on observation_date, which the dataloader indexes. The upper bound is the day
+# after dateTo, exclusive, so observations with a time on the last day are included.
+
+
+def parse_date_window(date_from=None, date_to=None, last_days=None, today=None):
+    """
+    Build the observation date window of a request.
+
+    Args:
+        date_from: First day of the window (YYYY-MM-DD)
+        date_to: Last day of the window (YYYY-MM-DD)
+        last_days: Window of the last N days up to today, used when date_from is not given
+        today: Date to count last_days back from, today if not given
+
+    Returns:
+        dict: {'date_from', 'date_until'} Cypher parameters (None for an open bound), or None
+        when the request has no window
+
+    Raises:
+        ValueError: If a date or last_days is invalid
+    """
+    if not date_from and last_days:
+        days = int(last_days)
+        if days < 0:
+            raise ValueError(f"lastDays must be positive, got {days}")
+        date_from = ((today or date.today()) - timedelta(days=days)).isoformat()
+    if not date_from and not date_to:
+        return None
+
+    window = {
+        'date_from': date.fromisoformat(date_from).isoformat() if date_from else None,
+        'date_until': (date.fromisoformat(date_to) + timedelta(days=1)).isoformat() if date_to else None,
+    }
+    if window['date_from'] and window['date_until'] and window['date_from'] >= window['date_until']:
+        raise ValueError(f"dateFrom {date_from} is after dateTo {date_to}")
+    return window
+
+
+def _range_conditions(variable, date_window):
+    conditions = []
+    if date_window and date_window.get('date_from'):
+        conditions.append(f"{variable}.observation_date >= $date_from")
+    if date_window and date_window.get('date_until'):
+        conditions.append(f"{variable}.observation_date < $date_until")
+    return ' AND '.join(conditions)
+
+
+def date_condition(variable, date_window, keyword='AND'):
+    """
+    Cypher condition restricting the observation bound to variable to the window.
+
+    Returns '' without a window, otherwise the condition prefixed with keyword (AND or WHERE),
+    written as plain range predicates so the planner can seek the observation_date index.
+    """
+    conditions = _range_conditions(variable, date_window)
+    return f" {keyword} {conditions}" if conditions else ''
+
+
+def path_date_condition(path, date_window):
+    """Cypher condition (prefixed with AND) keeping the observations along path within the window, '' without a window."""
+    conditions = _range_conditions('n', date_window)
+    if not conditions:
+        return ''
+    return f" AND all(n IN nodes({path}) WHERE NOT n:observation_of_identity OR ({conditions}))"
+
+
+def date_window_params(date_window):
+    """Query parameters of a window, to pass to session.run alongside the other parameters."""
+    return {key: value for key, value in (date_window or {}).items() if value is not None}
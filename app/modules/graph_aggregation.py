@@ -0,0 +1,101 @@
+from collections import Counter
+
+from lib.constants import logger
+from modules.graph_backend import graph_backend
+
+# Cluster key for the members of all clusters beyond the max cluster count
+OTHER_CLUSTER_KEY = 'other'
+
+
+def iter_relationship_endpoints(driver, node_ids):
+    """
+    Yield (from_id, to_id) for every relationship between the given nodes.
+
+    Only the elementIds are returned, so aggregating a large result never builds the full
+    relationship records.
+    """
+    with driver.session() as session:
+        yield from graph_backend.relationship_endpoints(session, node_ids)
+
+
+def _label_cluster_key(node):
+    """Observations are grouped by label and source, every other node by label."""
+    label = node['labels'][0] if node.get('labels') else 'default'
+    if label.startswith('observation_of_'):
+        return f"label:{label}:{node.get('source', 'Unknown')}"
+    return f'label:{label}'
+
+
+def _component_cluster_keys(node_ids, endpoints):
+    """Label each node with its connected component (union-find), keyed by the component's smallest node ID."""
+    parent = {node_id: node_id for node_id in node_ids}
+
+    def find(node_id):
+        while parent[node_id] != node_id:
+            parent[node_id] = parent[parent[node_id]]
+            node_id = parent[node_id]
+        return node_id
+
+    for from_id, to_id in endpoints:
+        from_root, to_root = find(from_id), find(to_id)
+        if from_root != to_root:
+            # The smaller ID becomes the root so the key doesn't depend on relationship order
+            if to_root < from_root:
+                from_root, to_root = to_root, from_root
+            parent[to_root] = from_root
+
+    return {node_id: f'component:{find(node_id)}' for node_id in node_ids}
+
+
+def assign_clusters(nodes, endpoints, group_by, max_clusters):
+    """
+    Assign every node to a cluster.
+
+    Args:
+        nodes: Raw node dicts (see _collect_graph_nodes)
+        endpoints: List of (from_id, to_id) relationships between the nodes, only used for 'component'
+        group_by: 'label' (label, plus source for observations) or 'component' (connected component)
+        max_clusters: Only the largest max_clusters - 1 clusters are kept, the rest are merged into OTHER_CLUSTER_KEY
+
+    Returns:
+        dict: Node ID -> cluster key
+    """
+    if group_by == 'component':
+        membership = _component_cluster_keys([str(node['elementId']) for node in nodes], endpoints)
+    else:
+        membership = {str(node['elementId']): _label_cluster_key(node) for node in nodes}
+
+    sizes = Counter(membership.values())
+    if len(sizes) > max_clusters:
+        # Sort by size, then key, so the kept clusters are the same on every request (drill-down relies on it)
+        kept = {key for key, _ in sorted(sizes.items(), key=lambda item: (-item[1], item[0]))[:max_clusters - 1]}
+        membership = {node_id: key if key in kept else OTHER_CLUSTER_KEY for node_id, key in membership.items()}
+
+    logger.info(f"Assigned {len(membership)} nodes to {len(set(membership.values()))} clusters by {group_by}")
+    return membership
+
+
+def summarize_clusters(nodes, membership, endpoints):
+    """
+    Count the members of each cluster and the relationships between clusters.
+
+    Returns:
+        tuple: (clusters, cluster_edges) where clusters maps cluster key -> {'size', 'labelCounts',
+        'internalRelationships'} and cluster_edges maps (from key, to key) -> relationship count
+    """
+    clusters = {}
+    for node in nodes:
+        key = membership[str(node['elementId'])]
+        cluster = clusters.setdefault(key, {'size': 0, 'labelCounts': Counter(), 'internalRelationships': 0})
+        cluster['size'] += 1
+        cluster['labelCounts'][node['labels'][0] if node.get('labels') else 'default'] += 1
+
+    cluster_edges = Counter()
+    for from_id, to_id in endpoints:
+        from_key, to_key = membership[from_id], membership[to_id]
+        if from_key == to_key:
+            clusters[from_key]['internalRelationships'] += 1
+        else:
+            cluster_edges[(from_key, to_key)] += 1
+
+    return clusters, cluster_edges
@@ -0,0 +1,351 @@
+from abc import ABC, abstractmethod
+
+from lib.constants import GRAPH_BACKEND, DERIVED_RELATIONSHIP_TYPES
+from modules.date_window import date_condition, path_date_condition, date_window_params
+from modules.graph_format import SOURCES_QUERY, SOURCE_VALUE_QUERY, OBSERVATION_COUNT_QUERY, RELATIONSHIP_QUERY
+from modules.overlap_projection import path_relationship_filter
+from modules.search_queries import (LABELS_QUERY, quote_name, build_search_query, build_persona_query, build_show_all_overlaps_query,
+                                    run_page)
+
+
+def _parse_sources(source_select):
+    """Sources of a comma separated source selection."""
+    return [s.strip() for s in source_select.split(',') if s.strip()] if source_select else []
+
+
+def _find_paths_query(max_depth, relationship_filter, node_filter):
+    """
+    Query for every shortest path of at most max_depth relationships between $from_node_id and
+    $to_node_id, only through relationships passing relationship_filter and nodes passing node_filter.
+    """
+    return f"""
+    MATCH (start), (end)
+    WHERE elementId(start) = $from_node_id AND elementId(end) = $to_node_id
+    MATCH p = allShortestPaths((start)-[*1..{max_depth}]-(end))
+    WHERE all(r IN relationships(p) WHERE {relationship_filter}){node_filter}
+    RETURN nodes(p) AS pathNodes, relationships(p) AS pathRelationsihps
+    """
+
+
+class UnsupportedFeatureError(Exception):
+    """
+    A lookup needs a feature the graph backend can't serve. The endpoints reject the features they
+    know of up front (see GraphBackend.unsupported_reason), this is the same rejection from deeper
+    down, answered the same way.
+    """
+
+    def __init__(self, feature):
+        super().__init__(graph_backend.unsupported_reason(feature))
+        self.feature = feature
+
+
+class GraphBackend(ABC):
+    """
+    The lookups the app runs on the graph (--graph_backend), each taking a session of the driver
+    get_neo4j_connection returns.
+
+    Lookups return what their Cypher query returns, records with the same keys and nodes and
+    relationships with the same attributes whatever the backend, so the callers (get_initial_nodes,
+    get_graph_data, /api/node-details, /api/find-paths, /api/bulk-match...) don't depend on it.
+    Features a backend can't serve are named by unsupported_reason, the endpoints reject them
+    before running anything and a lookup reaching one anyway raises UnsupportedFeatureError.
+    """
+    name = None
+    # Whether independent lookups gain from running concurrently on their own sessions (see
+    # modules/parallel_queries.py)
+    concurrent_sessions = True
+    # Features the backend can't serve, with the reason given to the client
+    unsupported_features = {}
+
+    def unsupported_reason(self, feature):
+        """Why feature (e.g. 'overlap_projection' or 'source_overlap_matrix') isn't available on this backend, None if it is."""
+        return self.unsupported_features.get(feature)
+
+    @abstractmethod
+    def labels(self, session):
+        """The labels of the nodes, sorted."""
+
+    @abstractmethod
+    def source_values(self, session):
+        """The values of the source nodes, sorted."""
+
+    @abstractmethod
+    def nodes_by_id(self, session, node_ids):
+        """The nodes of the elementIds that exist."""
+
+    @abstractmethod
+    def observations_of_identifier(self, session, identifier_id, date_window=None):
+        """The distinct observation nodes of an identifier, only those within date_window if given."""
+
+    @abstractmethod
+    def sources_by_observation(self, session, obs_ids):
+        """The source nodes of observations by observation ID, observations without one left out."""
+
+    @abstractmethod
+    def source_value_of(self, session, obs_id):
+        """The value of the source of an observation, or Unknown."""
+
+    @abstractmethod
+    def observation_count_of(self, session, node_id):
+        """The number of observations of an identifier."""
+
+    @abstractmethod
+    def direct_observation_records(self, session, initial_ids, date_window=None):
+        """{'obs'} records of the distinct observations related to any of the nodes, within date_window if given."""
+
+    @abstractmethod
+    def overlapping_identifier_records(self, session, observation_ids, date_window=None):
+        """{'identifier', 'overlap_count'} records of the identifiers of the observations with 2+ observations within date_window."""
+
+    @abstractmethod
+    def relationship_records(self, session, node_ids):
+        """{'from', 'r', 'to'} records of the relationships between the nodes, derived ones excepted."""
+
+    @abstractmethod
+    def observation_relationship_records(self, session, observation_ids):
+        """{'from', 'r', 'to'} records of every relationship of the observations, whatever the node at the other end, derived ones excepted."""
+
+    @abstractmethod
+    def relationship_endpoints(self, session, node_ids):
+        """(from elementId, to elementId) of the relationships between the nodes, derived ones excepted."""
+
+    @abstractmethod
+    def search_records(self, session, search_value, node_type, search_operator, case_sensitive, search_source_select, date_window=None, search_values=None, page=None):
+        """
+        {'v'} records of a node value search, or {'v', 'o', 's'} records when searching the
+        observations of search_source_select. With page (modules/search_pages.SearchPage) only
+        that page is returned and the page is updated with the cursor of the next one.
+        """
+
+    @abstractmethod
+    def persona_records(self, session, search_value, date_window=None, page=None):
+        """{'member'} records of the observations of the persona of an observation or persona_id."""
+
+    @abstractmethod
+    def shared_identifier_records(self, session, identity_labels, overlap_source_select1, overlap_source_select2, min_connections, date_window=None, page=None):
+        """{'identifier', 'observation_count'} records of the identifiers with at least min_connections observations, most observed first."""
+
+    @abstractmethod
+    def shortest_path_records(self, session, from_node_id, to_node_id, max_depth, date_window=None, use_overlap_projection=False, min_shared_identifiers=1):
+        """{'pathNodes', 'pathRelationsihps'} records of every shortest path of at most max_depth relationships between the nodes."""
+
+    @abstractmethod
+    def bulk_match_records(self, session, label, lookups):
+        """
+        {'input', 'value', 'element_id', 'observation_count', 'sources'} records of the identifiers
+        of label with the value of each {'input', 'value'} lookup.
+        """
+
+
+class Neo4jBackend(GraphBackend):
+    """Lookups as Cypher queries run on Neo4j sessions."""
+    name = 'neo4j'
+
+    def labels(self, session):
+        return [record["label"] for record in session.run(LABELS_QUERY)]
+
+    def source_values(self, session):
+        source_query = """
+        MATCH (n:source)
+        RETURN DISTINCT n.value as source_type
+        ORDER BY source_type
+        """
+        return [record["source_type"] for record in session.run(source_query) if record["source_type"] is not None]
+
+    def nodes_by_id(self, session, node_ids):
+        details_query = """
+        MATCH (n)
+        WHERE elementId(n) IN $node_ids
+        RETURN n
+        """
+        return [record["n"] for record in session.run(details_query, node_ids=node_ids)]
+
+    def observations_of_identifier(self, session, identifier_id, date_window=None):
+        obs_query = f"""
+        MATCH (obs:observation_of_identity)-[r]->(identifier)
+        WHERE elementId(identifier) = $identifier_id{date_condition('obs', date_window)}
+        RETURN DISTINCT obs
+        """
+        return [record["obs"] for record in session.run(obs_query, identifier_id=identifier_id, **date_window_params(date_window))]
+
+    def sources_by_observation(self, session, obs_ids):
+        return {record["obs_id"]: record["s"] for record in session.run(SOURCES_QUERY, obs_ids=obs_ids)}
+
+    def source_value_of(self, session, obs_id):
+        source_record = session.run(SOURCE_VALUE_QUERY, obs_id=obs_id).single()
+        return source_record["source_value"] if source_record else "Unknown"
+
+    def observation_count_of(self, session, node_id):
+        count_record = session.run(OBSERVATION_COUNT_QUERY, node_id=node_id).single()
+        return count_record["count"] if count_record else 0
+
+    def direct_observation_records(self, session, initial_ids, date_window=None):
+        direct_obs_query = f"""
+        MATCH (identifier)-[r]-(obs:observation_of_identity)
+        WHERE elementId(identifier) IN $initial_ids{date_condition('obs', date_window)}
+        RETURN DISTINCT obs
+        """
+        return session.run(direct_obs_query, initial_ids=list(initial_ids), **date_window_params(date_window))
+
+    def overlapping_identifier_records(self, session, observation_ids, date_window=None):
+        overlapping_nodes_query = f"""
+        MATCH (obs:observation_of_identity)-[r]->(identifier)
+        WHERE elementId(obs) IN $observation_ids AND NOT identifier:observation_of_identity
+        WITH identifier
+        MATCH (other_obs:observation_of_identity)-[other_r]->(identifier){date_condition('other_obs', date_window, 'WHERE')}
+        WITH identifier, count(DISTINCT other_obs) as overlap_count
+        WHERE overlap_count >= 2
+        RETURN identifier, overlap_count
+        """
+        return session.run(overlapping_nodes_query, observation_ids=list(observation_ids), **date_window_params(date_window))
+
+    def relationship_records(self, session, node_ids):
+        return session.run(RELATIONSHIP_QUERY, node_ids=node_ids, derived_relationship_types=DERIVED_RELATIONSHIP_TYPES)
+
+    def observation_relationship_records(self, session, observation_ids):
+        observation_relationships_query = """
+        MATCH (obs)-[r]-()
+        WHERE elementId(obs) IN $observation_ids AND NOT type(r) IN $derived_relationship_types
+        RETURN startNode(r) AS from, r, endNode(r) AS to
+        """
+        return session.run(observation_relationships_query, observation_ids=observation_ids, derived_relationship_types=DERIVED_RELATIONSHIP_TYPES)
+
+    def relationship_endpoints(self, session, node_ids):
+        # Only the elementIds are returned, so aggregating a large result never builds the full relationship records
+        endpoints_query = """
+        MATCH (from)-[r]->(to)
+        WHERE elementId(from) IN $node_ids AND elementId(to) IN $node_ids
+          AND NOT type(r) IN $derived_relationship_types
+        RETURN elementId(from) AS from_id, elementId(to) AS to_id
+        """
+        for record in session.run(endpoints_query, node_ids=node_ids, derived_relationship_types=DERIVED_RELATIONSHIP_TYPES):
+            yield record['from_id'], record['to_id']
+
+    def search_records(self, session, search_value, node_type, search_operator, case_sensitive, search_source_select, date_window=None, search_values=None, page=None):
+        query, parameters = build_search_query(search_value, node_type, search_operator, case_sensitive, search_source_select, date_window, search_values)
+        if page:
+            by_source = bool(search_source_select and search_source_select.strip())
+            return run_page(session, query, parameters, page, ('v', 'o', 's') if by_source else ('v',), ('v', 'o') if by_source else ('v',))
+        return session.run(query, **parameters)
+
+    def persona_records(self, session, search_value, date_window=None, page=None):
+        query = build_persona_query(date_window)
+        parameters = dict(search_value=search_value, **date_window_params(date_window))
+        if page:
+            return run_page(session, query, parameters, page, ('member',), ('member',), observations=True)
+        return session.run(query, **parameters)
+
+    def shared_identifier_records(self, session, identity_labels, overlap_source_select1, overlap_source_select2, min_connections, date_window=None, page=None):
+        query, parameters = build_show_all_overlaps_query(identity_labels, overlap_source_select1, overlap_source_select2, min_connections, date_window)
+        if page:
+            return run_page(session, query, parameters, page, ('identifier', 'observation_count'), ('identifier',), observation_count='observation_count')
+        return session.run(query, **parameters)
+
+    def shortest_path_records(self, session, from_node_id, to_node_id, max_depth, date_window=None, use_overlap_projection=False, min_shared_identifiers=1):
+        # All the shortest paths in one search, the depth is the only value in the query text
+        # (variable length bounds can't be parameters) so there is one plan per depth
+        query = _find_paths_query(max_depth, path_relationship_filter(use_overlap_projection), path_date_condition('p', date_window))
+        return session.run(query, from_node_id=from_node_id, to_node_id=to_node_id,
+                           derived_relationship_types=DERIVED_RELATIONSHIP_TYPES,
+                           min_shared_identifiers=min_shared_identifiers,
+                           **date_window_params(date_window))
+
+    def bulk_match_records(self, session, label, lookups):
+        # One index seek on the label's value index per lookup
+        match_query = f"""
+        UNWIND $lookups AS lookup
+        WITH lookup.input AS input, lookup.value AS value
+        MATCH (identifier:{quote_name(label)} {{value: value}})
+        RETURN input, identifier.value AS value, elementId(identifier) AS element_id,
+               COUNT {{ (identifier)<-[]-(:observation_of_identity) }} AS observation_count,
+               COLLECT {{
+                   MATCH (s:source)-[:has_observation]->(:observation_of_identity)-[]->(identifier)
+                   RETURN DISTINCT s.value
+               }} AS sources
+        """
+        return session.run(match_query, lookups=lookups)
+
+
+class MemoryBackend(GraphBackend):
+    """Lookups of the in-memory graph (modules/memory_graph.py), the session being the graph itself."""
+    name = 'memory'
+    # Lookups of the in-memory graph never wait, on threads they would only contend for the GIL
+    concurrent_sessions = False
+    unsupported_features = {
+        'overlap_projection': "The overlap projection is built in Neo4j by the data loader (--build_overlap_projection), it needs --graph_backend neo4j",
+        'source_overlap_matrix': "The source overlap matrix is built in Neo4j by the data loader (--build_source_overlap_matrix), it needs --graph_backend neo4j",
+        'cypher_queries': "The in-memory graph backend doesn't run Cypher queries, this feature needs --graph_backend neo4j",
+    }
+
+    def labels(self, session):
+        return session.labels()
+
+    def source_values(self, session):
+        return session.source_values()
+
+    def nodes_by_id(self, session, node_ids):
+        return session.nodes_by_id(node_ids)
+
+    def observations_of_identifier(self, session, identifier_id, date_window=None):
+        return session.observations_of_identifier(identifier_id, date_window)
+
+    def sources_by_observation(self, session, obs_ids):
+        sources = {obs_id: session.source_of(obs_id) for obs_id in obs_ids}
+        return {obs_id: source for obs_id, source in sources.items() if source is not None}
+
+    def source_value_of(self, session, obs_id):
+        source = session.source_of(obs_id)
+        return source.get('value') if source is not None else "Unknown"
+
+    def observation_count_of(self, session, node_id):
+        return len(session.observations_of_identifier(node_id))
+
+    def direct_observation_records(self, session, initial_ids, date_window=None):
+        return session.direct_observation_records(initial_ids, date_window)
+
+    def overlapping_identifier_records(self, session, observation_ids, date_window=None):
+        return session.overlapping_identifier_records(observation_ids, date_window)
+
+    def relationship_records(self, session, node_ids):
+        return session.relationship_records(node_ids)
+
+    def observation_relationship_records(self, session, observation_ids):
+        return session.observation_relationship_records(observation_ids)
+
+    def relationship_endpoints(self, session, node_ids):
+        for record in session.relationship_records(node_ids):
+            yield record['from'].element_id, record['to'].element_id
+
+    def search_records(self, session, search_value, node_type, search_operator, case_sensitive, search_source_select, date_window=None, search_values=None, page=None):
+        by_source = bool(search_source_select and search_source_select.strip())
+        records = session.search_records(search_value, node_type, search_operator, case_sensitive,
+                                         _parse_sources(search_source_select) if by_source else None, date_window, search_values)
+        if page:
+            return session.page_records(records, page, ('v', 'o') if by_source else ('v',))
+        return records
+
+    def persona_records(self, session, search_value, date_window=None, page=None):
+        records = session.persona_records(search_value, date_window)
+        if page:
+            return session.page_records(records, page, ('member',), observations=True)
+        return records
+
+    def shared_identifier_records(self, session, identity_labels, overlap_source_select1, overlap_source_select2, min_connections, date_window=None, page=None):
+        records = session.shared_identifier_records(identity_labels, _parse_sources(overlap_source_select1), _parse_sources(overlap_source_select2),
+                                                    min_connections, date_window,
+                                                    by_source=overlap_source_select1 is not None or overlap_source_select2 is not None)
+        if page:
+            return session.page_records(records, page, ('identifier',), observation_count='observation_count')
+        return records
+
+    def shortest_path_records(self, session, from_node_id, to_node_id, max_depth, date_window=None, use_overlap_projection=False, min_shared_identifiers=1):
+        if use_overlap_projection:
+            raise UnsupportedFeatureError('overlap_projection')
+        return session.shortest_path_records(from_node_id, to_node_id, max_depth, date_window)
+
+    def bulk_match_records(self, session, label, lookups):
+        return session.bulk_match_records(label, lookups)
+
+
+# The backend of the driver get_neo4j_connection returns
+graph_backend = MemoryBackend() if GRAPH_BACKEND == 'memory' else Neo4jBackend()
@@ -0,0 +1,225 @@
+import random
+
+from lib.constants import NODE_COLORS, RELATIONSHIP_COLORS_OPTIONS
+from modules.work_budget import WorkBudget
+
+# Formatting of raw node dicts and relationship records into the vis.js shapes returned to the
+# frontend, and the lookup queries of the graph search, shared by the Flask blueprint
+# (blueprints/graph.py) and the ASGI mode (modules/async_graph.py)
+
+# Global dictionaries to maintain consistent color assignments across requests
+NODE_COLOR_ASSIGNMENTS = {}
+RELATIONSHIP_COLOR_ASSIGNMENTS = {}
+
+
+def get_node_color(node_type):
+    """Dynamically assign colors to node types, keeping source and observation fixed"""
+    global NODE_COLOR_ASSIGNMENTS
+    
+    # Fixed colors for source and observation
+    if node_type == 'source':
+        return NODE_COLORS['source']
+    elif node_type == 'observation_of_identity':
+        return NODE_COLORS['observation_of_identity']
+    
+    # For other node types, assign colors dynamically
+    if node_type not in NODE_COLOR_ASSIGNMENTS:
+        # Get a random color from the options
+        color_options = NODE_COLORS['node_color_options']
+        assigned_color = random.choice(color_options)
+        NODE_COLOR_ASSIGNMENTS[node_type] = assigned_color
+    
+    return NODE_COLOR_ASSIGNMENTS[node_type]
+
+def get_relationship_color(relationship_type):
+    """Dynamically assign colors to relationship types"""
+    global RELATIONSHIP_COLOR_ASSIGNMENTS
+    
+    if relationship_type not in RELATIONSHIP_COLOR_ASSIGNMENTS:
+        # Get a random color from the options
+        assigned_color = random.choice(RELATIONSHIP_COLORS_OPTIONS)
+        RELATIONSHIP_COLOR_ASSIGNMENTS[relationship_type] = assigned_color
+    
+    return RELATIONSHIP_COLOR_ASSIGNMENTS[relationship_type]
+
+
+def flatten_properties(props, prefix=''):
+    flat = {}
+    for k, v in props.items():
+        key = f'{prefix}{k}' if prefix else str(k)
+        if isinstance(v, dict):
+            flat.update(flatten_properties(v, key + '.'))
+        elif isinstance(v, list):
+            if v and all(isinstance(i, dict) for i in v):
+                for idx, item in enumerate(v):
+                    flat.update(flatten_properties(item, f'{key}[{idx}].'))
+            else:
+                flat[key] = ', '.join(str(i) for i in v)
+        else:
+            flat[key] = v
+    return flat
+
+
+SOURCES_QUERY = """
+UNWIND $obs_ids AS obs_id
+MATCH (s:source)-[:has_observation]->(obs:observation_of_identity)
+WHERE elementId(obs) = obs_id
+RETURN obs_id, s
+"""
+
+SOURCE_VALUE_QUERY = """
+MATCH (s:source)-[:has_observation]->(obs:observation_of_identity)
+WHERE elementId(obs) = $obs_id
+RETURN s.value as source_value
+"""
+
+OBSERVATION_COUNT_QUERY = """
+MATCH (obs:observation_of_identity)-[r]->(identifier)
+WHERE elementId(identifier) = $node_id
+RETURN count(DISTINCT obs) as count
+"""
+
+RELATIONSHIP_QUERY = """
+MATCH (from)-[r]->(to)
+WHERE elementId(from) IN $node_ids AND elementId(to) IN $node_ids
+  AND NOT type(r) IN $derived_relationship_types
+RETURN from, r, to
+"""
+
+
+def node_to_dict(node, additional_fields=None):
+    """Convert a Neo4j node to the raw node dict format of the graph search (_collect_graph_nodes)."""
+    node_dict = dict(node)
+    node_dict['id'] = node.id
+    node_dict['elementId'] = node.element_id
+    node_dict['labels'] = list(node.labels)
+    if additional_fields:
+        node_dict.update(additional_fields)
+    return node_dict
+
+
+def build_observation_tooltip(v):
+    """Build the sorted multi-line tooltip for an observation node from its flattened properties."""
+    flat = flatten_properties(v)
+    return '\n'.join(f"{k}: {v}" if not k.endswith('_identifiers') else f"{k}:\n{v}" for k, v in sorted(flat.items()))
+
+
+def format_graph_node(v, initial_node_ids, lazy_details=False, looked_up=None):
+    """
+    Format a raw node dict into the vis.js node shape returned to the frontend.
+
+    With lazy_details the observation tooltip and the copy of the node properties are left out,
+    the frontend fetches them from /api/node-details for the nodes that are actually inspected.
+    looked_up maps node IDs to the source value or observation count looked up for them when
+    the node dict doesn't have it (see _look_up_node_details), nodes missing from it are
+    formatted with an Unknown source or no observations.
+    """
+    v_id = str(v['elementId'])
+    looked_up = looked_up or {}
+
+    # This is the value to display in the node
+    raw_label = v['labels'][0] if v['labels'] else 'default'
+    tooltip = ''
+    
+    if raw_label.startswith('observation_of_'):
+        # Get the source for this observation
+        # First check if source is already included in the node data
+        if 'source' in v:
+            source_value = v['source']
+        else:
+            source_value = looked_up.get(v_id, "Unknown")
+        
+        value = f"{source_value}: {v.get('value', v_id)}"
+        # Count observations for this node
+        num_observations = 1  # Default for observation nodes
+        # With lazy details the tooltip is fetched from /api/node-details on hover instead
+        if not lazy_details:
+            tooltip = build_observation_tooltip(v)
+    else:
+        value = v.get('value', v_id)
+        # Use overlap_count if available, otherwise use observation_count if available, otherwise calculate
+        if 'overlap_count' in v:
+            num_observations = v['overlap_count']
+        elif 'observation_count' in v:
+            num_observations = v['observation_count']
+        else:
+            # Only identifiers are counted, sources and observations have no count
+            num_observations = looked_up.get(v_id, 0)
+
+    name = v.get('name', value)
+    # Use dynamic color assignment
+    color = get_node_color(raw_label)
+
+    # Apply bolded color and larger border width for initial search nodes
+    if v_id in initial_node_ids:
+        color = {
+            'background': '#FFD700',  # Gold background
+            'border': '#FF4500'       # OrangeRed border
+        }
+        border_width = 4  # Larger border width for initial search nodes
+    else:
+        border_width = 1  # Default border width
+
+    # Update the display label for vertices with multiple observations
+    if num_observations > 1:
+        value = f"{value}\n({num_observations} obs)"
+
+    node = {
+        'id': v_id,
+        'label': value,
+        'title': tooltip or name,
+        'group': raw_label,
+        'color': color,
+        'num_observations': num_observations,
+        'is_shared': num_observations > 1,
+        'borderWidth': border_width
+    }
+    if not lazy_details:
+        node['properties'] = {**v, 'num_observations': num_observations}
+    return node
+
+
+def format_graph_relationship(record, relationship_counter):
+    """Format a (from, r, to) record into the vis.js edge shape returned to the frontend."""
+    from_node = record["from"]
+    relationship = record["r"]
+    to_node = record["to"]
+
+    label = relationship.type
+    # Use dynamic color assignment for relationships
+    style = get_relationship_color(label)
+
+    return {
+        'id': f'e{relationship_counter}',
+        'from': str(from_node.element_id),
+        'to': str(to_node.element_id),
+        'label': label,
+        'title': label,
+        'color': style['color'],
+        'width': style['width'],
+        'dashes': style['dashes'],
+        'arrows': {'to': {'enabled': True, 'type': 'arrow'}}
+    }
+
+
+def graph_data_metadata(node_count, relationship_count, lazy_details=False, drill_down=None, budget=None, page=None):
+    """Metadata of a graph data response, with the relationship colors assigned so far, the partial result flags and the page."""
+    # Build the final color mappings for the frontend
+    final_relationship_colors = {}
+    
+    # Add dynamically assigned colors
+    for relationship_type, color in RELATIONSHIP_COLOR_ASSIGNMENTS.items():
+        final_relationship_colors[relationship_type] = color
+
+    metadata = {
+        'nodeCount': node_count,
+        'relationshipCount': relationship_count,
+        'relationshipColors': final_relationship_colors,
+        'lazyDetails': lazy_details,
+        **(budget or WorkBudget()).metadata()
+    }
+    if drill_down:
+        metadata['cluster'] = drill_down
+    if page:
+        metadata.update(page.metadata())
+    return metadata
@@ -0,0 +1,173 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+from lib.constants import (
+    logger,
+    LAYOUT_CACHE_SIZE,
+    LAYOUT_EXACT_REPULSION_MAX_NODES,
+    LAYOUT_GRID_SIZE,
+    LAYOUT_ITERATIONS,
+    LAYOUT_NODE_SPACING,
+)
+
+# Cache of computed layouts keyed by a hash of the graph, most recently used last
+LAYOUT_CACHE = OrderedDict()
+
+# Number of nodes whose forces are computed at once, bounds the (block, n) temporaries
+_BLOCK_SIZE = 1024
+
+
+def _graph_key(node_ids, edges):
+    """Hash the node IDs and edges so the same result set reuses its cached layout."""
+    digest = hashlib.sha1()
+    for node_id in sorted(node_ids):
+        digest.update(node_id.encode('utf-8'))
+        digest.update(b'\0')
+    digest.update(b'\1')
+    for from_id, to_id in sorted(edges):
+        digest.update(f'{from_id}\0{to_id}\0'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _pairwise_repulsion(targets, sources, k, weights=None, min_dist2=1e-9):
+    """Sum of k^2 / d repulsion on each target point from every source point."""
+    disp = np.zeros_like(targets)
+    for start in range(0, len(targets), _BLOCK_SIZE):
+        block = targets[start:start + _BLOCK_SIZE]
+        dx = block[:, 0, None] - sources[None, :, 0]
+        dy = block[:, 1, None] - sources[None, :, 1]
+        strength = (k * k) / np.maximum(dx * dx + dy * dy, min_dist2)
+        if weights is not None:
+            strength *= weights[None, :]
+        disp[start:start + _BLOCK_SIZE, 0] = (dx * strength).sum(axis=1)
+        disp[start:start + _BLOCK_SIZE, 1] = (dy * strength).sum(axis=1)
+    return disp
+
+
+def _repulsion(pos, k, exact):
+    """
+    Fruchterman-Reingold repulsive displacement (k^2 / d away from every other node).
+
+    For small graphs every node pair is computed. For larger graphs nodes are binned into a
+    LAYOUT_GRID_SIZE x LAYOUT_GRID_SIZE grid: the far field is computed once per cell from the
+    other cells' centroids weighted by their node counts, and each node adds the push from its
+    own cell's centroid. That keeps each iteration O(n + cells^2) instead of O(n^2).
+    """
+    if exact:
+        return _pairwise_repulsion(pos, pos, k)
+
+    lower = pos.min(axis=0)
+    cell_size = max((pos.max(axis=0) - lower).max() / LAYOUT_GRID_SIZE, 1e-9)
+    cells = np.minimum(((pos - lower) / cell_size).astype(np.int64), LAYOUT_GRID_SIZE - 1)
+    cell_ids = cells[:, 0] * LAYOUT_GRID_SIZE + cells[:, 1]
+
+    counts = np.bincount(cell_ids, minlength=LAYOUT_GRID_SIZE * LAYOUT_GRID_SIZE)
+    occupied = np.flatnonzero(counts)
+    weights = counts[occupied].astype(np.float64)
+    centroids = np.stack([
+        np.bincount(cell_ids, weights=pos[:, 0], minlength=len(counts))[occupied],
+        np.bincount(cell_ids, weights=pos[:, 1], minlength=len(counts))[occupied],
+    ], axis=1) / weights[:, None]
+
+    # Far field: each occupied cell against every other occupied cell (itself contributes zero)
+    field = np.zeros((len(counts), 2))
+    field[occupied] = _pairwise_repulsion(centroids, centroids, k, weights)
+
+    # Near field: spread nodes that share a cell away from its centroid, capped at a quarter cell
+    own = np.zeros((len(counts), 2))
+    own[occupied] = centroids
+    own_weights = counts[cell_ids].astype(np.float64)
+    delta = pos - own[cell_ids]
+    dist2 = np.maximum((delta ** 2).sum(axis=1), (cell_size / 4) ** 2)
+    near = delta * ((k * k) * own_weights / dist2)[:, None]
+
+    return field[cell_ids] + near
+
+
+def _attraction(pos, sources, targets, k):
+    """Fruchterman-Reingold attractive displacement (d^2 / k towards each neighbour)."""
+    n = len(pos)
+    delta = pos[sources] - pos[targets]
+    dist = np.sqrt((delta ** 2).sum(axis=1))
+    force = delta * (dist / k)[:, None]
+    disp = np.zeros_like(pos)
+    for axis in range(2):
+        disp[:, axis] -= np.bincount(sources, weights=force[:, axis], minlength=n)
+        disp[:, axis] += np.bincount(targets, weights=force[:, axis], minlength=n)
+    return disp
+
+
+def compute_layout(node_ids, edges, iterations=LAYOUT_ITERATIONS, seed=0):
+    """
+    Compute initial (x, y) coordinates for a graph with a vectorized force-directed layout.
+
+    Args:
+        node_ids: List of node IDs
+        edges: List of (from_id, to_id) tuples, edges to unknown nodes are ignored
+        iterations: Number of force-directed iterations
+        seed: Seed for the initial random placement, so the same graph gets the same layout
+
+    Returns:
+        dict: Node ID -> (x, y) in vis.js canvas units
+    """
+    n = len(node_ids)
+    if n == 0:
+        return {}
+
+    index = {node_id: i for i, node_id in enumerate(node_ids)}
+    pairs = np.array([(index[a], index[b]) for a, b in edges if a in index and b in index and a != b], dtype=np.int64).reshape(-1, 2)
+    sources, targets = pairs[:, 0], pairs[:, 1]
+
+    # Random placement in the unit disc, the layout is computed in unit space and scaled at the end
+    rng = np.random.default_rng(seed)
+    radius = np.sqrt(rng.random(n))
+    angle = rng.random(n) * 2 * np.pi
+    pos = np.stack([radius * np.cos(angle), radius * np.sin(angle)], axis=1)
+
+    k = np.sqrt(1.0 / n)
+    exact = n <= LAYOUT_EXACT_REPULSION_MAX_NODES
+    temperature = 0.1
+    cooling = temperature / (iterations + 1)
+
+    for _ in range(iterations):
+        disp = _repulsion(pos, k, exact) + _attraction(pos, sources, targets, k)
+        # Weak gravity keeps disconnected components from drifting apart
+        disp -= pos * (k * 10)
+
+        length = np.maximum(np.sqrt((disp ** 2).sum(axis=1)), 1e-9)
+        pos += disp * (np.minimum(length, temperature) / length)[:, None]
+        temperature -= cooling
+
+    pos -= pos.mean(axis=0)
+    pos *= LAYOUT_NODE_SPACING * np.sqrt(n)
+
+    return {node_id: (float(pos[i, 0]), float(pos[i, 1])) for i, node_id in enumerate(node_ids)}
+
+
+def apply_layout(data):
+    """
+    Add precomputed x/y coordinates to the nodes of get_graph_data output, in place.
+
+    Layouts are cached per result (see LAYOUT_CACHE) so repeating a search doesn't recompute them.
+    """
+    node_ids = [node['id'] for node in data['nodes']]
+    edges = [(relationship['from'], relationship['to']) for relationship in data['relationships']]
+
+    key = _graph_key(node_ids, edges)
+    if key in LAYOUT_CACHE:
+        LAYOUT_CACHE.move_to_end(key)
+        positions = LAYOUT_CACHE[key]
+        logger.info(f"Using cached layout for {len(node_ids)} nodes")
+    else:
+        positions = compute_layout(node_ids, edges)
+        LAYOUT_CACHE[key] = positions
+        if len(LAYOUT_CACHE) > LAYOUT_CACHE_SIZE:
+            LAYOUT_CACHE.popitem(last=False)
+        logger.info(f"Computed layout for {len(node_ids)} nodes and {len(edges)} relationships")
+
+    for node in data['nodes']:
+        node['x'], node['y'] = positions[node['id']]
+    data['metadata']['layout'] = 'server'
+    return data
@@ -0,0 +1,170 @@
+import gzip
+import json
+
+from lib.constants import logger
+
+# Brotli is optional - fall back to gzip when it isn't installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPACT_FORMAT_VERSION = 1
+
+# Per-node property keys that duplicate a column and are restored on decode
+_REDUNDANT_PROPERTY_KEYS = ('elementId', 'num_observations')
+
+
+def _intern(value, values, index):
+    """Return the index of value in values, appending it the first time it is seen."""
+    key = json.dumps(value, sort_keys=True) if isinstance(value, (dict, list)) else value
+    if key not in index:
+        index[key] = len(values)
+        values.append(value)
+    return index[key]
+
+
+def encode_compact_graph(data):
+    """
+    Encode get_graph_data output into the compact columnar wire format.
+
+    Groups, node styles and relationship types are sent once in lookup tables, nodes and
+    relationships as parallel arrays, and relationship endpoints as integer node indexes
+    instead of repeated elementId strings. decode_compact_graph (and decodeCompactGraphData
+    in the frontend) restores the original shape.
+    """
+    groups, group_index = [], {}
+    styles, style_index = [], {}
+    relationship_types, relationship_type_index = [], {}
+    node_index = {}
+
+    nodes = {
+        'id': [],
+        'label': [],
+        'title': [],
+        'group': [],
+        'style': [],
+        'num_observations': [],
+        'borderWidth': [],
+        'properties': []
+    }
+    for i, node in enumerate(data['nodes']):
+        node_index[node['id']] = i
+        nodes['id'].append(node['id'])
+        nodes['label'].append(node['label'])
+        # Most titles repeat the label, only send the ones that differ
+        nodes['title'].append(node.get('title') if node.get('title') != node['label'] else None)
+        nodes['group'].append(_intern(node['group'], groups, group_index))
+        nodes['style'].append(_intern(node.get('color'), styles, style_index))
+        nodes['num_observations'].append(node.get('num_observations', 0))
+        nodes['borderWidth'].append(node.get('borderWidth', 1))
+
+        properties = {k: v for k, v in node.get('properties', {}).items() if k not in _REDUNDANT_PROPERTY_KEYS}
+        if properties.get('labels') == [node['group']]:
+            del properties['labels']
+        nodes['properties'].append(properties)
+
+    # Server-side layout coordinates (layout=server) are only sent when present
+    if data['nodes'] and 'x' in data['nodes'][0]:
+        nodes['x'] = [node['x'] for node in data['nodes']]
+        nodes['y'] = [node['y'] for node in data['nodes']]
+    # Cluster sizes of aggregated results
+    if any('value' in node for node in data['nodes']):
+        nodes['value'] = [node.get('value') for node in data['nodes']]
+
+    relationships = {
+        'from': [],
+        'to': [],
+        'type': []
+    }
+    for relationship in data['relationships']:
+        relationships['from'].append(node_index[relationship['from']])
+        relationships['to'].append(node_index[relationship['to']])
+        relationships['type'].append(_intern(relationship['label'], relationship_types, relationship_type_index))
+    # Relationship counts between the clusters of aggregated results
+    if any('value' in relationship for relationship in data['relationships']):
+        relationships['value'] = [relationship.get('value') for relationship in data['relationships']]
+
+    return {
+        'format': 'compact',
+        'version': COMPACT_FORMAT_VERSION,
+        'groups': groups,
+        'styles': styles,
+        'relationshipTypes': relationship_types,
+        'nodes': nodes,
+        'relationships': relationships,
+        'metadata': data['metadata']
+    }
+
+
+def decode_compact_graph(compact):
+    """Decode the compact columnar wire format back into the get_graph_data shape."""
+    groups = compact['groups']
+    styles = compact['styles']
+    relationship_types = compact['relationshipTypes']
+    relationship_colors = compact['metadata'].get('relationshipColors', {})
+    columns = compact['nodes']
+
+    nodes = []
+    for i, node_id in enumerate(columns['id']):
+        group = groups[columns['group'][i]]
+        num_observations = columns['num_observations'][i]
+        properties = {'labels': [group], **columns['properties'][i], 'elementId': node_id, 'num_observations': num_observations}
+        nodes.append({
+            'id': node_id,
+            'label': columns['label'][i],
+            'title': columns['title'][i] if columns['title'][i] is not None else columns['label'][i],
+            'group': group,
+            'color': styles[columns['style'][i]],
+            'num_observations': num_observations,
+            'is_shared': num_observations > 1,
+            'properties': properties,
+            'borderWidth': columns['borderWidth'][i]
+        })
+        if 'x' in columns:
+            nodes[-1]['x'] = columns['x'][i]
+            nodes[-1]['y'] = columns['y'][i]
+        if 'value' in columns and columns['value'][i] is not None:
+            nodes[-1]['value'] = columns['value'][i]
+
+    relationships = []
+    relationship_values = compact['relationships'].get('value')
+    for i, type_index in enumerate(compact['relationships']['type']):
+        label = relationship_types[type_index]
+        style = relationship_colors.get(label, {})
+        relationships.append({
+            'id': f'e{i}',
+            'from': columns['id'][compact['relationships']['from'][i]],
+            'to': columns['id'][compact['relationships']['to'][i]],
+            'label': label,
+            'title': label,
+            'color': style.get('color'),
+            'width': style.get('width'),
+            'dashes': style.get('dashes'),
+            'arrows': {'to': {'enabled': True, 'type': 'arrow'}}
+        })
+        if relationship_values and relationship_values[i] is not None:
+            relationships[-1]['value'] = relationship_values[i]
+            relationships[-1]['title'] = f'{relationship_values[i]:,} relationships'
+
+    return {
+        'nodes': nodes,
+        'relationships': relationships,
+        'metadata': compact['metadata']
+    }
+
+
+def compress_payload(body, accept_encoding):
+    """
+    Compress a response body using the best encoding the client accepts.
+
+    Returns (body, content_encoding) where content_encoding is None when the body is sent as-is.
+    """
+    accepted = {encoding.split(';')[0].strip().lower() for encoding in (accept_encoding or '').split(',')}
+    if brotli is not None and 'br' in accepted:
+        return brotli.compress(body, quality=5), 'br'
+    if 'gzip' in accepted:
+        return gzip.compress(body, compresslevel=6), 'gzip'
+    logger.debug(f"No supported encoding in Accept-Encoding '{accept_encoding}', sending uncompressed")
+    return body, None
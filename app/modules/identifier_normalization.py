@@ -0,0 +1,34 @@
+from personatrace_common.normalizers import IdentifierNormalizer, default_normalizers, CASE_INSENSITIVE_LABELS
+
+from lib.constants import NORMALIZE_IDENTIFIERS, DEFAULT_PHONE_COUNTRY_CODE
+
+# The dataloader's normalizers when the graph was loaded with --normalize_identifiers, None otherwise
+identifier_normalizer = IdentifierNormalizer(default_normalizers(DEFAULT_PHONE_COUNTRY_CODE)) if NORMALIZE_IDENTIFIERS else None
+
+
+def candidate_values(label, value):
+    """Values an identifier of label (any label if None) looked up as value may be stored as, the value itself without normalization."""
+    if identifier_normalizer is None:
+        return [value]
+    return identifier_normalizer.candidates(label, value)
+
+
+def normalize_search(search_value, node_type, search_operator, case_sensitive):
+    """
+    The value search of a node value search, on the canonical values of a normalized graph.
+
+    Only exact searches are normalized, a fragment of a value (e.g. part of a phone number) has no
+    canonical form. An exact search of a normalized label is a search of its canonical value, case
+    sensitive when the canonical form doesn't depend on case, so it's a seek of the label's value
+    index. Other exact searches match any of the value's candidate values.
+
+    Returns:
+        tuple: (search_value, case_sensitive, search_values), search_values being the values any of
+        which is an exact match (None for a search of search_value alone)
+    """
+    if search_operator != 'equals':
+        return search_value, case_sensitive, None
+    search_values = candidate_values(node_type, search_value)
+    if len(search_values) > 1:
+        return search_value, case_sensitive, search_values
+    return search_values[0], case_sensitive or (identifier_normalizer is not None and node_type in CASE_INSENSITIVE_LABELS), None
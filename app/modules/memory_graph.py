@@ -0,0 +1,504 @@
+import gzip
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from lib.constants import logger, DERIVED_RELATIONSHIP_TYPES
+from modules.graph_backend import UnsupportedFeatureError
+from personatrace_common.graph_schema import OBSERVATION_LABEL, SOURCE_LABEL
+
+# Sections of the nodes of an observation, as the data loader's NODE_SCHEMAS: the label of their
+# nodes and the type of the observation's relationships to them (None for the node's type and
+# has_<type>) and the properties kept on the nodes
+IDENTIFIER_SECTIONS = {
+    'names': (None, None, ('value', 'type')),
+    'online_identifiers': (None, None, ('value', 'category', 'type')),
+    'location_identifiers': (None, None, ('value', 'category', 'type')),
+    'identity_documents': ('identity_document', 'has_identity_document', ('value', 'type', 'issuer')),
+}
+REQUIRED_FIELDS = ('node_type', 'id', 'source', 'observation_date')
+
+
+class MemoryNode(dict):
+    """A node of the in-memory graph, its properties with the attributes of a neo4j Node."""
+
+    def __init__(self, index, label, properties):
+        super().__init__(properties)
+        self.id = index
+        self.element_id = f'4:memory:{index}'
+        self.labels = frozenset([label])
+        self.label = label
+
+
+class MemoryRelationship(dict):
+    """A relationship of the in-memory graph, its properties with the attributes of a neo4j Relationship."""
+
+    def __init__(self, index, type_, start_node, end_node):
+        super().__init__()
+        self.id = index
+        self.element_id = f'5:memory:{index}'
+        self.type = type_
+        self.start_node = start_node
+        self.end_node = end_node
+
+
+def _flatten(obj, parent_key=''):
+    """Flatten nested dicts and lists into path keys, as the data loader's deep_flatten."""
+    if isinstance(obj, dict):
+        items = {}
+        for k, v in obj.items():
+            items.update(_flatten(v, f"{parent_key}.{k}" if parent_key else str(k)))
+        return items
+    if isinstance(obj, list):
+        if not obj:
+            return {}
+        if all(isinstance(item, dict) for item in obj):
+            return {parent_key: '\n'.join(json.dumps(item, separators=(',', ':'), ensure_ascii=False) for item in obj)}
+        return {parent_key: '\n'.join(str(item) for item in obj)}
+    return {parent_key: obj}
+
+
+def _in_window(node, date_window):
+    """Whether an observation is dated within date_window (modules/date_window.py), always without one."""
+    if not date_window:
+        return True
+    observation_date = node.get('observation_date')
+    if not isinstance(observation_date, str):
+        return False
+    if date_window.get('date_from') and observation_date < date_window['date_from']:
+        return False
+    if date_window.get('date_until') and observation_date >= date_window['date_until']:
+        return False
+    return True
+
+
+def _matches(value, search_value, search_operator, case_sensitive, search_values=None):
+    """Whether a node value matches a search as the Cypher of modules/search_queries.build_search_query would."""
+    if search_values and search_operator == 'equals':
+        return any(_matches(value, other, search_operator, case_sensitive) for other in search_values)
+    if search_operator == 'equals' and case_sensitive:
+        return value == search_value
+    if not isinstance(value, str) or not isinstance(search_value, str):
+        return False
+    if not case_sensitive:
+        value, search_value = value.lower(), search_value.lower()
+    if search_operator == 'equals':
+        return value == search_value
+    if search_operator == 'contains':
+        return search_value in value
+    if search_operator == 'starts_with':
+        return value.startswith(search_value)
+    return value.endswith(search_value)
+
+
+class MemoryGraph:
+    """
+    The graph of a set of observations held in memory, for demos, tests and benchmarks without Neo4j
+    (--graph_backend memory).
+
+    Observations are loaded from the NDJSON files the data loader reads into the same nodes and
+    relationships it creates. Nodes are indexed by elementId and by label and value, and each node
+    has adjacency lists of its outgoing and incoming relationships, so every lookup of a search only
+    touches the nodes it returns.
+
+    The graph stands in for the neo4j driver: session() returns the graph itself, and
+    modules/graph_backend.MemoryBackend answers each lookup of the app (get_initial_nodes,
+    get_graph_data, /api/find-paths, /api/node-details, /api/bulk-match...) with the method below
+    that mirrors its query, returning records with the same keys and nodes and relationships with
+    the same attributes. The overlap projection and source overlap matrix are built in Neo4j by the
+    data loader and are rejected by the app on this backend (see GraphBackend.unsupported_reason),
+    as is any Cypher query run on the graph (UnsupportedFeatureError).
+    Lookups don't charge the rows of the work budget, its hops and time still apply.
+    """
+
+    def __init__(self, normalizer=None):
+        # Identifiers are merged on their canonical value like the dataloader's --normalize_identifiers
+        self.normalizer = normalizer
+        self.nodes = []
+        self.relationships = []
+        self._element_ids = {}
+        # label -> value -> node index
+        self._values = {}
+        # node index -> relationship indexes
+        self._out = []
+        self._in = []
+        self.skipped_identifiers = 0
+
+    # ------------------------------------------------------------------------------------------
+    # Driver and session surface
+    # ------------------------------------------------------------------------------------------
+    def session(self, **kwargs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def close(self):
+        # Shared by every request for the life of the process
+        pass
+
+    def run(self, query, parameters=None, **kwargs):
+        raise UnsupportedFeatureError('cypher_queries')
+
+    # ------------------------------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------------------------------
+    def _merge_node(self, label, value, properties, update=False):
+        """The node of label with value, created with properties if new (and updated with them if update)."""
+        values = self._values.setdefault(label, {})
+        index = values.get(value)
+        if index is None:
+            index = len(self.nodes)
+            node = MemoryNode(index, label, properties)
+            self.nodes.append(node)
+            self._element_ids[node.element_id] = index
+            values[value] = index
+            self._out.append([])
+            self._in.append([])
+        elif update:
+            self.nodes[index].update(properties)
+        return self.nodes[index]
+
+    def _create_relationship(self, type_, start_node, end_node, properties=None):
+        index = len(self.relationships)
+        relationship = MemoryRelationship(index, type_, start_node, end_node)
+        if properties:
+            relationship.update(properties)
+        self.relationships.append(relationship)
+        self._out[start_node.id].append(index)
+        self._in[end_node.id].append(index)
+
+    def add_observation(self, observation):
+        """Add one observation (observation_schema.json) with its source and identifiers, as process_batch loads it."""
+        for field in REQUIRED_FIELDS:
+            if field not in observation:
+                raise ValueError(f"Observation missing required field: {field}")
+
+        properties = {'value': observation['id'], 'source': observation['source'], 'observation_date': observation['observation_date']}
+        for k, v in observation.items():
+            if isinstance(v, (str, int, float, bool)):
+                properties[k] = v
+            elif isinstance(v, dict):
+                properties.update(_flatten(v, k))
+            elif isinstance(v, list):
+                properties[k] = json.dumps(v)
+        # Neo4j doesn't store null properties
+        properties = {k: v for k, v in properties.items() if v is not None}
+        obs = self._merge_node(observation['node_type'], observation['id'], properties, update=True)
+
+        source = self._merge_node(SOURCE_LABEL, observation['source'], {'value': observation['source']})
+        self._create_relationship('has_observation', source, obs)
+
+        for section, (label, relationship_type, kept_properties) in IDENTIFIER_SECTIONS.items():
+            for node in (observation.get('nodes') or {}).get(section) or []:
+                if not isinstance(node, dict) or node.get('value') is None:
+                    self.skipped_identifiers += 1
+                    continue
+                node_label = label or node.get('type')
+                identifier_properties = {k: node.get(k) for k in kept_properties if k in node}
+                relationship_properties = None
+                if self.normalizer is not None:
+                    identifier_properties['value'] = self.normalizer.normalize(section, node_label, node['value'])
+                    if identifier_properties['value'] != node['value']:
+                        relationship_properties = {'raw_value': node['value']}
+                identifier = self._merge_node(node_label, identifier_properties['value'], identifier_properties)
+                self._create_relationship(relationship_type or f"has_{node.get('type')}", obs, identifier, relationship_properties)
+
+    def load(self, path):
+        """Load the observations of an NDJSON file (gzipped if it ends with .gz) or of every file under a folder."""
+        paths = [os.path.join(root, name) for root, _, names in os.walk(path) for name in sorted(names)] if os.path.isdir(path) else [path]
+        start = time.perf_counter()
+        observations = 0
+        for file_path in paths:
+            with (gzip.open(file_path, 'rt') if file_path.endswith('.gz') else open(file_path, 'r')) as f:
+                for line in f:
+                    if line.strip():
+                        self.add_observation(json.loads(line))
+                        observations += 1
+        if self.skipped_identifiers:
+            logger.warning(f"Skipped {self.skipped_identifiers} identifiers without a value")
+        logger.info(f"Loaded {observations} observations from {path} into the in-memory graph: "
+                    f"{len(self.nodes)} nodes, {len(self.relationships)} relationships in {time.perf_counter() - start:.2f}s")
+        return self
+
+    # ------------------------------------------------------------------------------------------
+    # Lookups, each named after and returning what its query in the search pipeline returns
+    # ------------------------------------------------------------------------------------------
+    def node(self, element_id):
+        index = self._element_ids.get(element_id)
+        return self.nodes[index] if index is not None else None
+
+    def _neighbours(self, node, direction='both'):
+        """(relationship, other node) of the relationships of node, derived ones excepted."""
+        if direction in ('out', 'both'):
+            for index in self._out[node.id]:
+                relationship = self.relationships[index]
+                if relationship.type not in DERIVED_RELATIONSHIP_TYPES:
+                    yield relationship, relationship.end_node
+        if direction in ('in', 'both'):
+            for index in self._in[node.id]:
+                relationship = self.relationships[index]
+                if relationship.type not in DERIVED_RELATIONSHIP_TYPES:
+                    yield relationship, relationship.start_node
+
+    def labels(self):
+        """Labels of the nodes (CALL db.labels())."""
+        return sorted(label for label, values in self._values.items() if values)
+
+    def source_values(self):
+        """Values of the source nodes."""
+        return sorted(self.nodes[index]['value'] for index in self._values.get(SOURCE_LABEL, {}).values())
+
+    def nodes_by_id(self, element_ids):
+        """The nodes of the elementIds that exist."""
+        return [node for node in (self.node(element_id) for element_id in element_ids) if node is not None]
+
+    def observations_of_identifier(self, identifier_id, date_window=None):
+        """Distinct observations with a relationship to the identifier, within date_window if given."""
+        identifier = self.node(identifier_id)
+        if identifier is None:
+            return []
+        observations = {}
+        for _, obs in self._neighbours(identifier, 'in'):
+            if obs.label == OBSERVATION_LABEL and _in_window(obs, date_window):
+                observations.setdefault(obs.id, obs)
+        return list(observations.values())
+
+    def source_of(self, obs_id):
+        """The source node of an observation, or None."""
+        obs = self.node(obs_id)
+        if obs is None or obs.label != OBSERVATION_LABEL:
+            return None
+        for relationship, source in self._neighbours(obs, 'in'):
+            if relationship.type == 'has_observation' and source.label == SOURCE_LABEL:
+                return source
+        return None
+
+    def direct_observation_records(self, initial_ids, date_window=None):
+        """{'obs'} records of the distinct observations related to any of the nodes, within date_window."""
+        observations = {}
+        for node in self.nodes_by_id(initial_ids):
+            for _, obs in self._neighbours(node):
+                if obs.label == OBSERVATION_LABEL and _in_window(obs, date_window):
+                    observations.setdefault(obs.id, obs)
+        return [{'obs': obs} for obs in observations.values()]
+
+    def overlapping_identifier_records(self, observation_ids, date_window=None):
+        """{'identifier', 'overlap_count'} records of the identifiers of the observations with 2+ observations within date_window."""
+        identifiers = {}
+        for obs in self.nodes_by_id(observation_ids):
+            for _, identifier in self._neighbours(obs, 'out'):
+                if identifier.label != OBSERVATION_LABEL:
+                    identifiers.setdefault(identifier.id, identifier)
+        records = []
+        for identifier in identifiers.values():
+            overlap_count = len(self.observations_of_identifier(identifier.element_id, date_window))
+            if overlap_count >= 2:
+                records.append({'identifier': identifier, 'overlap_count': overlap_count})
+        return records
+
+    def relationship_records(self, node_ids):
+        """{'from', 'r', 'to'} records of the relationships between the nodes, derived ones excepted."""
+        nodes = self.nodes_by_id(node_ids)
+        node_indexes = {node.id for node in nodes}
+        return [{'from': node, 'r': relationship, 'to': other}
+                for node in nodes for relationship, other in self._neighbours(node, 'out') if other.id in node_indexes]
+
+    def observation_relationship_records(self, observation_ids):
+        """{'from', 'r', 'to'} records of every relationship of the observations, whatever the node at the other end, derived ones excepted."""
+        return [{'from': relationship.start_node, 'r': relationship, 'to': relationship.end_node}
+                for node in self.nodes_by_id(observation_ids) for relationship, _ in self._neighbours(node)]
+
+    def bulk_match_records(self, label, lookups):
+        """
+        {'input', 'value', 'element_id', 'observation_count', 'sources'} records of the identifiers
+        of label with the value of each {'input', 'value'} lookup (the match query of modules/bulk_match.py).
+        """
+        values = self._values.get(label, {})
+        records = []
+        for lookup in lookups:
+            index = values.get(lookup['value'])
+            if index is None:
+                continue
+            identifier = self.nodes[index]
+            observations = self.observations_of_identifier(identifier.element_id)
+            sources = dict.fromkeys(source.get('value') for source in (self.source_of(obs.element_id) for obs in observations) if source is not None)
+            records.append({'input': lookup['input'], 'value': identifier.get('value'), 'element_id': identifier.element_id,
+                            'observation_count': len(observations), 'sources': list(sources)})
+        return records
+
+    def search_records(self, search_value, node_type=None, search_operator='equals', case_sensitive=True, sources=None, date_window=None, search_values=None):
+        """
+        Records of a node value search (modules/search_queries.build_search_query): {'v'} records,
+        or {'v', 'o', 's'} records of the matching identifiers of the observations of sources when
+        sources are given (None for no source filtering). An exact search with search_values
+        matches any of them.
+        """
+        if search_operator not in ('equals', 'contains', 'starts_with', 'ends_with'):
+            raise ValueError(f"Invalid search operator: {search_operator}")
+
+        if sources is not None:
+            records = {}
+            for source_value in sources:
+                index = self._values.get(SOURCE_LABEL, {}).get(source_value)
+                if index is None:
+                    continue
+                source = self.nodes[index]
+                for relationship, obs in self._neighbours(source, 'out'):
+                    if relationship.type != 'has_observation' or obs.label != OBSERVATION_LABEL or not _in_window(obs, date_window):
+                        continue
+                    for relationship_to, v in self._neighbours(obs, 'out'):
+                        if node_type and (v.label != node_type or relationship_to.type != f'has_{node_type}'):
+                            continue
+                        if v.label != OBSERVATION_LABEL and _matches(v.get('value'), search_value, search_operator, case_sensitive, search_values):
+                            records.setdefault((v.id, obs.id, source.id), {'v': v, 'o': obs, 's': source})
+            return list(records.values())
+
+        # An exact case sensitive search of one label is a lookup of the value index
+        if node_type and search_operator == 'equals' and case_sensitive:
+            values = self._values.get(node_type, {})
+            candidates = [self.nodes[values[value]] for value in dict.fromkeys(search_values or [search_value]) if value in values]
+        elif node_type:
+            candidates = [self.nodes[index] for index in self._values.get(node_type, {}).values()]
+        else:
+            candidates = self.nodes
+        records = []
+        for v in candidates:
+            if not _matches(v.get('value'), search_value, search_operator, case_sensitive, search_values):
+                continue
+            if date_window:
+                in_window = _in_window(v, date_window) if v.label == OBSERVATION_LABEL else bool(self.observations_of_identifier(v.element_id, date_window))
+                if not in_window:
+                    continue
+            records.append({'v': v})
+        return records
+
+    def persona_records(self, search_value, date_window=None):
+        """{'member'} records of the observations of the persona of an observation or persona_id (build_persona_query)."""
+        index = self._values.get(OBSERVATION_LABEL, {}).get(search_value)
+        persona_id = self.nodes[index].get('persona_id') if index is not None else None
+        persona_id = search_value if persona_id is None else persona_id
+        return [{'member': self.nodes[index]} for index in self._values.get(OBSERVATION_LABEL, {}).values()
+                if self.nodes[index].get('persona_id') == persona_id and _in_window(self.nodes[index], date_window)]
+
+    def shared_identifier_records(self, identity_labels, primary_sources=None, compare_sources=None, min_connections=1, date_window=None, by_source=True):
+        """
+        {'identifier', 'observation_count'} records of the identifiers with at least min_connections
+        observations, most observed first (build_show_all_overlaps_query). by_source counts, as
+        the query does, the observations of primary_sources plus those of compare_sources (every
+        source when empty), only of identifiers with some of each.
+        """
+        records = []
+        for label in identity_labels:
+            for index in self._values.get(label, {}).values():
+                identifier = self.nodes[index]
+                observations = self.observations_of_identifier(identifier.element_id, date_window)
+                if by_source:
+                    source_values = [source.get('value') for source in (self.source_of(obs.element_id) for obs in observations) if source is not None]
+                    primary_count = sum(1 for value in source_values if not primary_sources or value in primary_sources)
+                    compare_count = sum(1 for value in source_values if not compare_sources or value in compare_sources)
+                    count = primary_count + compare_count if primary_count and compare_count else 0
+                else:
+                    count = len(observations)
+                if count and count >= min_connections:
+                    records.append({'identifier': identifier, 'observation_count': count})
+        records.sort(key=lambda record: -record['observation_count'])
+        return records
+
+    def _page_rank(self, node, order_by, observations=False):
+        """The rank of a node in a paged search (SearchPage.rank_clause)."""
+        if observations:
+            return (node.get('observation_date') or '') if order_by == 'recency' else 1
+        identifier_observations = self.observations_of_identifier(node.element_id)
+        if order_by == 'observations':
+            return len(identifier_observations)
+        if order_by == 'sources':
+            return len({source.id for source in (self.source_of(obs.element_id) for obs in identifier_observations) if source is not None})
+        return max((obs.get('observation_date') or '' for obs in identifier_observations), default='')
+
+    def page_records(self, records, page, key_variables, observations=False, observation_count=None):
+        """
+        The records of one page of a search (modules/search_pages.SearchPage), ranked and keyed as
+        SearchPage.return_clause ranks and keys them. The total of the first page is exact.
+        """
+        for record in records:
+            if page.order_by == 'observations' and observation_count:
+                rank = record[observation_count]
+            else:
+                rank = self._page_rank(record[key_variables[0]], page.order_by, observations)
+            record['page_key'] = [rank] + [record[variable].element_id for variable in key_variables]
+        if page.after is not None:
+            after_rank, after_ids = page.after[0], page.after[1:]
+            records = [record for record in records
+                       if record['page_key'][0] < after_rank or (record['page_key'][0] == after_rank and record['page_key'][1:] > after_ids)]
+        else:
+            page.total_estimate = len(records)
+        records.sort(key=lambda record: record['page_key'][1:])
+        records.sort(key=lambda record: record['page_key'][0], reverse=True)
+        return page.take(records[:page.limit + 1])
+
+    def shortest_path_records(self, from_node_id, to_node_id, max_depth, date_window=None):
+        """
+        {'pathNodes', 'pathRelationsihps'} records of every shortest path of at most max_depth
+        relationships between the nodes, in either direction, through observations within
+        date_window (the find paths query of modules/graph_backend.py). Paths are generated one at
+        a time, so a caller can stop early.
+        """
+        start, end = self.node(from_node_id), self.node(to_node_id)
+
+        def allowed(node):
+            return node.label != OBSERVATION_LABEL or _in_window(node, date_window)
+
+        if start is None or end is None or start.id == end.id or not allowed(start) or not allowed(end):
+            return
+
+        # Breadth first from start, keeping every (relationship, node) a node is reached from at its depth
+        depths = {start.id: 0}
+        reached_from = {start.id: []}
+        frontier = deque([start])
+        while frontier and end.id not in depths:
+            next_frontier = deque()
+            for node in frontier:
+                depth = depths[node.id] + 1
+                if depth > max_depth:
+                    continue
+                for relationship, other in self._neighbours(node):
+                    if not allowed(other):
+                        continue
+                    if other.id not in depths:
+                        depths[other.id] = depth
+                        reached_from[other.id] = []
+                        next_frontier.append(other)
+                    if depths[other.id] == depth:
+                        reached_from[other.id].append((relationship, node))
+            frontier = next_frontier
+        if end.id not in depths:
+            return
+
+        # Every path back to start through the nodes each one was reached from
+        stack = [(end, [end], [])]
+        while stack:
+            node, path_nodes, path_relationships = stack.pop()
+            if node.id == start.id:
+                yield {'pathNodes': path_nodes[::-1], 'pathRelationsihps': path_relationships[::-1]}
+                continue
+            for relationship, previous in reversed(reached_from[node.id]):
+                stack.append((previous, path_nodes + [previous], path_relationships + [relationship]))
+
+
+_memory_graph = None
+_memory_graph_lock = threading.Lock()
+
+
+def get_memory_graph(path, normalizer=None):
+    """The in-memory graph of the observations at path, loaded on first use and shared by every request."""
+    global _memory_graph
+    with _memory_graph_lock:
+        if _memory_graph is None:
+            _memory_graph = MemoryGraph(normalizer).load(path)
+        return _memory_graph
@@ -0,0 +1,115 @@
+from lib.constants import logger, SHARES_IDENTIFIERS, DERIVED_RELATIONSHIP_TYPES
+from modules.date_window import date_condition, date_window_params
+from modules.graph_format import node_to_dict
+from modules.work_budget import WorkBudget
+
+
+def path_relationship_filter(use_overlap_projection):
+    """
+    Cypher predicate on a path relationship r (between path endpoints start and end) for find-paths.
+
+    Without the projection derived relationships are never traversed. With it, observations are
+    only connected through shares_identifiers relationships of at least $min_shared_identifiers,
+    and the original relationships are only used to step from a non-observation endpoint (an
+    identifier or source) onto its observations.
+    """
+    if not use_overlap_projection:
+        return "NOT type(r) IN $derived_relationship_types"
+    return f"""(type(r) = '{SHARES_IDENTIFIERS}' AND r.weight >= $min_shared_identifiers)
+        OR (NOT type(r) IN $derived_relationship_types AND (
+            (NOT start:observation_of_identity AND start IN [startNode(r), endNode(r)])
+            OR (NOT end:observation_of_identity AND end IN [startNode(r), endNode(r)])))"""
+
+
+def collect_nodes_via_overlap_projection(driver, initial_nodes, num_hops, min_shared_identifiers=1, date_window=None, budget=None):
+    """
+    Collect the raw node dicts within num_hops of the initial nodes using the shares_identifiers projection.
+
+    Equivalent to the hop loop of _collect_graph_nodes, but each hop is one indexed expansion over
+    shares_identifiers (optionally keeping only pairs sharing at least min_shared_identifiers
+    identifiers) instead of the two-hop pattern through every identifier, and the shared
+    identifiers and sources of the reached observations are fetched once at the end.
+    Hops stop early once the work budget is exhausted, the shared identifiers and sources
+    of the observations reached so far are still fetched.
+
+    Args:
+        driver: Neo4j driver
+        initial_nodes: Node dicts from get_initial_nodes
+        num_hops: Number of observation -> observation hops
+        min_shared_identifiers: Minimum shares_identifiers weight to traverse
+        date_window: Only reach observations within this window (see parse_date_window)
+        budget: WorkBudget of the request (unlimited if not given)
+
+    Returns:
+        list: Unique raw node dicts
+    """
+    budget = budget or WorkBudget()
+    nodes = {}
+    for v in initial_nodes:
+        nodes[str(v['elementId'])] = v
+
+    with driver.session() as session:
+        # Observations of the initial nodes, the initial non-observation nodes are identifiers or sources
+        observation_ids = {node_id for node_id, v in nodes.items() if 'observation_of_identity' in v.get('labels', [])}
+        other_ids = [node_id for node_id in nodes if node_id not in observation_ids]
+        if other_ids:
+            direct_obs_query = f"""
+            MATCH (identifier)-[r]-(obs:observation_of_identity)
+            WHERE elementId(identifier) IN $initial_ids AND NOT type(r) IN $derived_relationship_types{date_condition('obs', date_window)}
+            RETURN DISTINCT obs
+            """
+            for record in session.run(direct_obs_query, initial_ids=other_ids, derived_relationship_types=DERIVED_RELATIONSHIP_TYPES,
+                                      **date_window_params(date_window)):
+                obs = record['obs']
+                nodes.setdefault(str(obs.element_id), node_to_dict(obs))
+                observation_ids.add(str(obs.element_id))
+
+        # One shares_identifiers hop per step
+        neighbours_query = f"""
+        MATCH (obs:observation_of_identity)-[s:{SHARES_IDENTIFIERS}]-(other:observation_of_identity)
+        WHERE elementId(obs) IN $observation_ids AND s.weight >= $min_shared_identifiers{date_condition('other', date_window)}
+        RETURN DISTINCT other
+        """
+        frontier = set(observation_ids)
+        for hop in range(1, num_hops + 1):
+            if not frontier or budget.exhausted():
+                break
+            new_ids = set()
+            for record in session.run(neighbours_query, observation_ids=list(frontier), min_shared_identifiers=min_shared_identifiers,
+                                      **date_window_params(date_window)):
+                if budget.exhausted():
+                    break
+                other = record['other']
+                other_id = str(other.element_id)
+                if other_id not in observation_ids:
+                    nodes[other_id] = node_to_dict(other)
+                    new_ids.add(other_id)
+            observation_ids |= new_ids
+            frontier = new_ids
+            logger.info(f"Overlap projection hop {hop}: found {len(new_ids)} new observations")
+
+        # Identifiers shared by two or more of the reached observations, with their total observation count
+        shared_identifiers_query = """
+        MATCH (obs:observation_of_identity)-[r]->(identifier)
+        WHERE elementId(obs) IN $observation_ids
+          AND NOT type(r) IN $derived_relationship_types AND NOT identifier:source
+        WITH identifier, count(DISTINCT obs) AS reached_count
+        WHERE reached_count >= 2
+        RETURN identifier, COUNT { (identifier)<-[]-(:observation_of_identity) } AS overlap_count
+        """
+        for record in session.run(shared_identifiers_query, observation_ids=list(observation_ids), derived_relationship_types=DERIVED_RELATIONSHIP_TYPES):
+            identifier = record['identifier']
+            nodes.setdefault(str(identifier.element_id), node_to_dict(identifier, {'overlap_count': record['overlap_count']}))
+
+        # Sources of the reached observations
+        sources_query = """
+        MATCH (s:source)-[:has_observation]->(obs:observation_of_identity)
+        WHERE elementId(obs) IN $observation_ids
+        RETURN DISTINCT s
+        """
+        for record in session.run(sources_query, observation_ids=list(observation_ids)):
+            source = record['s']
+            nodes.setdefault(str(source.element_id), node_to_dict(source))
+
+    logger.info(f"Found {len(nodes)} total unique nodes ({len(observation_ids)} observations) via the overlap projection")
+    return list(nodes.values())
@@ -0,0 +1,65 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from lib.constants import QUERY_CONCURRENCY
+from modules.graph_backend import graph_backend
+
+# Worker threads of every request's concurrent lookups, so the lookups running at once are bounded
+# by QUERY_CONCURRENCY across the process and threads are reused rather than started per lookup
+_executor = ThreadPoolExecutor(max_workers=QUERY_CONCURRENCY, thread_name_prefix='neo4j-query')
+
+
+def batches(items, max_size, concurrency=QUERY_CONCURRENCY):
+    """items split into at most max_size long lists, spread over at least concurrency of them when there are enough items."""
+    items = list(items)
+    if not items:
+        return []
+    size = max(1, min(max_size, -(-len(items) // concurrency)))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def run_on_sessions(driver, run, items, concurrency=QUERY_CONCURRENCY):
+    """
+    run(session, item) for each of items, returning the results in the order of items.
+
+    The items are split into up to concurrency chunks, each run with its own session from the
+    driver's connection pool (a session must only be used by one thread): the first on the calling
+    thread, the others on the shared worker threads, so independent lookups of one request run
+    concurrently. Exceptions raised by run are raised here once every chunk has finished. On a
+    backend without concurrent sessions (the in-memory graph, see modules/graph_backend.py) the
+    items run one after the other on one session.
+    """
+    items = list(items)
+    if not items:
+        return []
+    if not graph_backend.concurrent_sessions:
+        with driver.session() as session:
+            return [run(session, item) for item in items]
+    chunks = batches(items, len(items), concurrency)
+
+    def run_chunk(chunk):
+        with driver.session() as session:
+            return [run(session, item) for item in chunk]
+
+    futures = [_executor.submit(run_chunk, chunk) for chunk in chunks[1:]]
+    try:
+        results = run_chunk(chunks[0])
+    finally:
+        # Every chunk finishes before this returns or raises, so none outlives the request
+        wait(futures)
+    for future in futures:
+        results.extend(future.result())
+    return results
+
+
+def submit_on_session(driver, run, *args):
+    """
+    Start run(session, *args) on a worker thread with its own session, returning its Future.
+
+    Used to run a query while the calling thread runs others, e.g. the relationships of a graph
+    search while the details of its nodes are looked up.
+    """
+    def run_on_session():
+        with driver.session() as session:
+            return run(session, *args)
+
+    return _executor.submit(run_on_session)
@@ -0,0 +1,57 @@
+import json
+import os
+import threading
+
+from neo4j import Bookmarks, READ_ACCESS
+
+from lib.constants import logger, LOAD_BOOKMARKS_FILE
+
+
+class LoadBookmarks:
+    """
+    Bookmarks of the data loader's last committed load (see dataloader/lib/load_bookmarks.py).
+
+    The file is re-read whenever it changes, so a new load is picked up without restarting the
+    app. A missing or unreadable file means no bookmarks, i.e. reads don't wait for any load.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._bookmarks = None
+
+    def get(self):
+        """The bookmarks of the last load, or None."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+        with self._lock:
+            if mtime != self._mtime:
+                self._mtime = mtime
+                try:
+                    with open(self.path, 'r') as f:
+                        values = json.load(f).get('bookmarks') or []
+                    self._bookmarks = Bookmarks.from_raw_values(values) if values else None
+                    logger.info(f"Reading after the load bookmarks of {self.path} ({len(values)} bookmarks)")
+                except (OSError, ValueError, AttributeError) as e:
+                    logger.warning(f"Could not read the load bookmarks of {self.path}: {e}")
+                    self._bookmarks = None
+            return self._bookmarks
+
+
+load_bookmarks = LoadBookmarks(LOAD_BOOKMARKS_FILE)
+
+
+def read_session_kwargs():
+    """
+    Arguments of the app's sessions: read access mode, so their queries are routed to the readers
+    of a cluster (neo4j:// endpoint), and the bookmarks of the last load, so a reader only runs
+    them once it has caught up with that load. Single instances (bolt://) ignore the access mode.
+    """
+    kwargs = {'default_access_mode': READ_ACCESS}
+    bookmarks = load_bookmarks.get()
+    if bookmarks is not None:
+        kwargs['bookmarks'] = bookmarks
+    return kwargs
@@ -0,0 +1,426 @@
+import logging
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, has_request_context, request
+from neo4j import Query
+from neo4j.exceptions import Neo4jError
+
+from lib.constants import logger, DEBUG_DUMP_SAMPLE_RATE, QUERY_CACHE_SIZE
+from modules.read_routing import read_session_kwargs
+from modules.slow_queries import slow_query_log
+from modules.work_budget import WorkBudget, is_timeout_error, query_timeout_for, work_budget_for
+
+# Search types reported as a metrics label, anything else is reported as 'other' so a client
+# can't create unbounded label values
+SEARCH_TYPES = {'nodeValue', 'persona', 'showAllOverlaps'}
+
+# Histogram buckets in seconds, from a single indexed lookup to a multi-hop overlap search
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def log_sampled(build_message):
+    """
+    Log a large debug dump (e.g. every initial node) for a sample of the calls only.
+
+    build_message is only called when the dump is logged, so unsampled calls cost nothing.
+    The sample rate is --debug_dump_sample_rate and dumps are only logged in --debug mode.
+    """
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < DEBUG_DUMP_SAMPLE_RATE:
+        logger.debug(build_message())
+
+
+#########################################################################################
+# Metrics
+#########################################################################################
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=''):
+    labels = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class Histogram:
+    """Prometheus histogram with fixed buckets, one series per label combination."""
+
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, label_values, value):
+        series = self._series.setdefault(tuple(label_values), {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series['buckets'][i] += 1
+        series['sum'] += value
+        series['count'] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for label_values, series in sorted(self._series.items()):
+            for bound, count in zip(self.buckets, series['buckets']):
+                bucket_labels = _format_labels(self.label_names, label_values, 'le="%s"' % bound)
+                lines.append(f'{self.name}_bucket{bucket_labels} {count}')
+            inf_labels = _format_labels(self.label_names, label_values, 'le="+Inf"')
+            lines.append(f'{self.name}_bucket{inf_labels} {series["count"]}')
+            lines.append(f'{self.name}_sum{_format_labels(self.label_names, label_values)} {series["sum"]}')
+            lines.append(f'{self.name}_count{_format_labels(self.label_names, label_values)} {series["count"]}')
+        return lines
+
+
+class Counter:
+    """Prometheus counter, one series per label combination."""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._series = {}
+
+    def inc(self, label_values, value=1):
+        self._series[tuple(label_values)] = self._series.get(tuple(label_values), 0) + value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for label_values, value in sorted(self._series.items()):
+            lines.append(f'{self.name}{_format_labels(self.label_names, label_values)} {value}')
+        return lines
+
+
+_metrics_lock = threading.Lock()
+REQUEST_DURATION = Histogram('personatrace_request_duration_seconds', 'Request latency, until the response (or the last streamed frame) is sent',
+                             ['endpoint', 'search_type'])
+REQUESTS = Counter('personatrace_requests_total', 'Requests by endpoint, search type and status code',
+                   ['endpoint', 'search_type', 'status'])
+REQUEST_DB_DURATION = Histogram('personatrace_request_db_seconds', 'Time spent waiting on Neo4j per request',
+                                ['endpoint', 'search_type'])
+QUERY_DURATION = Histogram('personatrace_query_duration_seconds', 'Time spent waiting on Neo4j per query, by the function that ran it',
+                           ['endpoint', 'query'])
+QUERY_ROWS = Counter('personatrace_query_rows_total', 'Rows returned by Neo4j, by the function that ran the query',
+                     ['endpoint', 'query'])
+QUERIES_BY_SERVER = Counter('personatrace_queries_by_server_total', 'Queries by the Neo4j server that ran them, e.g. to check that reads go to the readers of a cluster',
+                            ['server'])
+QUERY_PLAN_CACHE = Counter('personatrace_query_plan_cache_total', 'Queries by the function that ran them and whether their text was run recently enough for Neo4j to have its plan cached (estimated)',
+                           ['query', 'result'])
+PARTIAL_RESULTS = Counter('personatrace_partial_results_total', 'Requests that stopped early and returned a partial result, by reason',
+                          ['endpoint', 'reason'])
+METRICS = [REQUEST_DURATION, REQUESTS, REQUEST_DB_DURATION, QUERY_DURATION, QUERY_ROWS, QUERIES_BY_SERVER, QUERY_PLAN_CACHE, PARTIAL_RESULTS]
+
+
+class QueryPlanCache:
+    """
+    Estimate of Neo4j's query plan cache: the last size query texts run by this process, least
+    recently used first.
+
+    Neo4j plans a query once per distinct text and keeps the plans of the last
+    server.db.query_cache_size texts, so a text seen here recently is most likely planned already
+    (other processes sharing the server also fill its cache, so this is an estimate). Queries that
+    put values in their text instead of parameters each get a new text, and show up as misses.
+    """
+
+    def __init__(self, size=QUERY_CACHE_SIZE):
+        self.size = size
+        self._texts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, query):
+        """'hit' if query's text is in the cache, 'miss' otherwise, adding it as the most recently used."""
+        text = str(query)
+        with self._lock:
+            if text in self._texts:
+                self._texts.move_to_end(text)
+                return 'hit'
+            self._texts[text] = None
+            if len(self._texts) > self.size:
+                self._texts.popitem(last=False)
+            return 'miss'
+
+
+query_plan_cache = QueryPlanCache()
+
+
+def render_metrics():
+    """All metrics of this process in the Prometheus text exposition format."""
+    with _metrics_lock:
+        lines = []
+        for metric in METRICS:
+            lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+#########################################################################################
+# Query spans
+#########################################################################################
+class RequestTrace:
+    """
+    Spans of the Neo4j queries run while serving one request, with the transaction timeout of
+    its queries and its work budget (None for endpoints without one, see modules/work_budget.py).
+    """
+
+    def __init__(self, endpoint, search_type, query_timeout=None, budget=None):
+        self.endpoint = endpoint
+        self.search_type = search_type
+        self.query_timeout = query_timeout
+        self.budget = budget
+        self.start = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add_span(self, span):
+        with self._lock:
+            self.spans.append(span)
+        logger.debug(f"Query span {span['name']}: {span['db_seconds'] * 1000:.1f}ms db, {span['rows']} rows, "
+                     f"result available after {span['result_available_after']}ms")
+
+    def finish(self, status):
+        """Record the request's metrics and log its summary."""
+        seconds = time.perf_counter() - self.start
+        with self._lock:
+            spans = list(self.spans)
+        db_seconds = sum(span['db_seconds'] for span in spans)
+        rows = sum(span['rows'] for span in spans)
+        with _metrics_lock:
+            REQUEST_DURATION.observe((self.endpoint, self.search_type), seconds)
+            REQUESTS.inc((self.endpoint, self.search_type, status))
+            REQUEST_DB_DURATION.observe((self.endpoint, self.search_type), db_seconds)
+            for span in spans:
+                QUERY_DURATION.observe((self.endpoint, span['name']), span['db_seconds'])
+                QUERY_ROWS.inc((self.endpoint, span['name']), span['rows'])
+                if span.get('server'):
+                    QUERIES_BY_SERVER.inc((span['server'],))
+                if span.get('plan_cache'):
+                    QUERY_PLAN_CACHE.inc((span['name'], span['plan_cache']))
+            if self.budget is not None and self.budget.partial_reason is not None:
+                PARTIAL_RESULTS.inc((self.endpoint, self.budget.partial_reason))
+        if spans:
+            # Queries run concurrently in ASGI mode overlap, so db time can exceed the request time
+            logger.info(f"{self.endpoint} {status} in {seconds:.3f}s: {len(spans)} queries, "
+                        f"{db_seconds:.3f}s db, {rows} rows, {max(seconds - db_seconds, 0):.3f}s app")
+        return seconds, db_seconds
+
+
+def server_address(summary):
+    """host:port of the server that ran a query, from its result summary (None if unknown)."""
+    address = getattr(getattr(summary, 'server', None), 'address', None)
+    return f"{address[0]}:{address[1]}" if address else None
+
+
+class TracingResult:
+    """
+    Wraps a neo4j Result to count its rows and time spent fetching them.
+
+    Only the time inside the driver is counted, so the caller formatting each record while
+    iterating isn't charged to the database. Slow queries are passed on to the slow query log.
+    Rows are charged to the request's work budget, and with a budget a query that runs out of
+    its transaction timeout ends its result early (flagged partial) instead of failing the request.
+    """
+
+    def __init__(self, result, span, trace, query, parameters):
+        self._result = result
+        self._span = span
+        self._trace = trace
+        self._budget = trace.budget if trace is not None else None
+        self._query = query
+        self._parameters = parameters
+        self._timeout_reached = False
+        self._finished = False
+
+    def __iter__(self):
+        iterator = iter(self._result)
+        while True:
+            start = time.perf_counter()
+            try:
+                record = next(iterator)
+            except StopIteration:
+                self._span['db_seconds'] += time.perf_counter() - start
+                break
+            except Neo4jError as e:
+                self._span['db_seconds'] += time.perf_counter() - start
+                self._timed_out(e)
+                break
+            self._span['db_seconds'] += time.perf_counter() - start
+            self._span['rows'] += 1
+            if self._budget is not None:
+                self._budget.charge_rows()
+            yield record
+        self.finish()
+
+    def single(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            record = self._result.single(*args, **kwargs)
+        except Neo4jError as e:
+            self._span['db_seconds'] += time.perf_counter() - start
+            self._timed_out(e)
+            record = None
+        else:
+            self._span['db_seconds'] += time.perf_counter() - start
+        self._span['rows'] += 1 if record is not None else 0
+        if self._budget is not None and record is not None:
+            self._budget.charge_rows()
+        self.finish()
+        return record
+
+    def _timed_out(self, error):
+        """Flag the request's result as partial if error is a transaction timeout, re-raise it otherwise."""
+        if self._budget is None or not is_timeout_error(error):
+            raise error
+        logger.warning(f"Query in {self._span['name']} ran out of its transaction timeout")
+        self._timeout_reached = True
+        self._budget.stop('query_timeout')
+
+    def consume(self):
+        start = time.perf_counter()
+        summary = self._result.consume()
+        self._span['db_seconds'] += time.perf_counter() - start
+        self.finish(summary)
+        return summary
+
+    def finish(self, summary=None):
+        """Record the span once, with the server timings of the result summary."""
+        if self._finished:
+            return
+        self._finished = True
+        if summary is None:
+            try:
+                summary = self._result.consume()
+            except Exception:
+                summary = None
+        self._span['result_available_after'] = getattr(summary, 'result_available_after', None)
+        self._span['result_consumed_after'] = getattr(summary, 'result_consumed_after', None)
+        self._span['server'] = server_address(summary)
+        if self._trace is not None:
+            self._trace.add_span(self._span)
+        slow_query_log.record(self._query, self._parameters, self._span['db_seconds'], self._span['rows'], self._span['name'],
+                              self._trace.endpoint if self._trace is not None else None,
+                              self._trace.query_timeout if self._trace is not None else None, self._timeout_reached)
+
+    def __getattr__(self, name):
+        return getattr(self._result, name)
+
+
+class TracingSession:
+    """
+    Wraps a neo4j Session so every run() becomes a span of the request trace (if any), run with
+    the transaction timeout of the request's endpoint.
+    """
+
+    def __init__(self, session, trace):
+        self._session = session
+        self._trace = trace
+        self._results = []
+
+    def run(self, query, parameters=None, **kwargs):
+        span = {
+            # The function that ran the query, e.g. get_initial_nodes or _collect_graph_nodes
+            'name': sys._getframe(1).f_code.co_name,
+            'query': ' '.join(str(query).split())[:200],
+            'db_seconds': 0.0,
+            'rows': 0,
+            'plan_cache': query_plan_cache.lookup(query),
+        }
+        start = time.perf_counter()
+        timeout = self._trace.query_timeout if self._trace is not None else None
+        result = self._session.run(Query(query, timeout=timeout) if timeout else query, parameters, **kwargs)
+        span['db_seconds'] += time.perf_counter() - start
+        traced = TracingResult(result, span, self._trace, query, {**(parameters or {}), **kwargs})
+        self._results.append(traced)
+        return traced
+
+    def close(self):
+        for result in self._results:
+            result.finish()
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for result in self._results:
+            result.finish()
+        return self._session.__exit__(exc_type, exc_value, traceback)
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+
+class TracingDriver:
+    """
+    Wraps a neo4j Driver so the sessions it opens are traced (see get_neo4j_connection), and
+    opened for reading after the last load unless told otherwise (see modules/read_routing.py).
+    """
+
+    def __init__(self, driver, trace):
+        self._driver = driver
+        self._trace = trace
+
+    def session(self, **kwargs):
+        return TracingSession(self._driver.session(**{**read_session_kwargs(), **kwargs}), self._trace)
+
+    def __getattr__(self, name):
+        return getattr(self._driver, name)
+
+
+def trace_driver(driver):
+    """
+    Trace the queries of driver as part of the current request, if there is one.
+
+    Outside of a request (e.g. bulk_match.py) queries are only timed for the slow query log.
+    """
+    if not has_request_context() or 'request_trace' not in g:
+        return TracingDriver(driver, None)
+    return TracingDriver(driver, g.request_trace)
+
+
+def current_work_budget():
+    """
+    The work budget of the current request, or an unlimited one.
+
+    The budget stays with the request trace, so a streamed response keeps charging it after
+    the request context is gone.
+    """
+    trace = g.get('request_trace') if has_request_context() else None
+    if trace is None or trace.budget is None:
+        return WorkBudget()
+    return trace.budget
+
+
+#########################################################################################
+# Flask hooks
+#########################################################################################
+def _start_request_trace():
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    search_type = request.args.get('searchType', '')
+    g.request_trace = RequestTrace(endpoint, search_type if search_type in SEARCH_TYPES or not search_type else 'other',
+                                   query_timeout_for(endpoint), work_budget_for(endpoint))
+
+
+def _finish_request_trace(response):
+    trace = g.pop('request_trace', None)
+    if trace is None:
+        return response
+    status = str(response.status_code)
+    if response.is_streamed:
+        # Streamed responses are still being produced, they are recorded when the stream is closed
+        response.call_on_close(lambda: trace.finish(status))
+        return response
+    seconds, db_seconds = trace.finish(status)
+    response.headers['Server-Timing'] = (f'db;dur={db_seconds * 1000:.1f};desc="{len(trace.spans)} queries", '
+                                         f'app;dur={(seconds - db_seconds) * 1000:.1f}')
+    return response
+
+
+def init_request_tracing(app):
+    """Trace every request of the app and record its metrics (served by /metrics)."""
+    app.before_request(_start_request_trace)
+    app.after_request(_finish_request_trace)
@@ -0,0 +1,145 @@
+import base64
+import json
+
+# Orders of a paged search, each ranking results most first:
+# - observations: identifiers by their number of observations
+# - sources: identifiers by the number of distinct sources that observed them
+# - recency: identifiers by their latest observation date, observations by their own
+# Observations rank equally by observations and sources, so they are ordered by elementId.
+ORDERINGS = ('observations', 'sources', 'recency')
+
+
+def _encode_cursor(order_by, key):
+    return base64.urlsafe_b64encode(json.dumps([order_by, *key], separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor, order_by):
+    """The sort key after which a page starts, from the cursor of the previous page."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if not isinstance(values, list) or len(values) < 3 or values[0] != order_by:
+        raise ValueError("Invalid cursor, it belongs to a search with another orderBy")
+    return values[1:]
+
+
+class SearchPage:
+    """
+    One page of the initial nodes of a search: at most limit results after cursor.
+
+    Results are ranked by order_by, with ties broken by elementId, so the pages of one search are
+    disjoint however many there are. The cursor of the next page is the sort key of the last result
+    of this one (keyset pagination), so a page costs the same wherever it is in the result. Only the
+    page is expanded into the graph. get_initial_nodes fills in the next cursor and, on the first
+    page, the planner's estimate of the total number of results (see metadata()).
+    """
+
+    def __init__(self, limit, order_by='observations', cursor=None):
+        if limit < 1:
+            raise ValueError(f"limit must be positive, got {limit}")
+        if order_by not in ORDERINGS:
+            raise ValueError(f"Invalid orderBy {order_by}, expected one of {', '.join(ORDERINGS)}")
+        self.limit = limit
+        self.order_by = order_by
+        self.cursor = cursor or None
+        self.after = _decode_cursor(cursor, order_by) if cursor else None
+        self.next_cursor = None
+        self.returned = 0
+        self.total_estimate = None
+
+    def rank_clause(self, variable, observations=False, observation_count=None):
+        """
+        Cypher (a WITH or CALL clause) binding page_rank for the nodes bound to variable.
+
+        observations tells the nodes are observations, and observation_count names a variable that
+        already holds the number of observations of each identifier (e.g. a filtered count).
+        """
+        if observations:
+            rank = f"coalesce({variable}.observation_date, '')" if self.order_by == 'recency' else '1'
+            return f"WITH *, {rank} AS page_rank"
+        if self.order_by == 'observations' and observation_count:
+            return f"WITH *, {observation_count} AS page_rank"
+        if self.order_by == 'observations':
+            ranked = "count(DISTINCT page_obs)"
+            pattern = f"(page_obs:observation_of_identity)-->({variable})"
+        elif self.order_by == 'sources':
+            ranked = "count(DISTINCT page_source)"
+            pattern = f"(page_source:source)-[:has_observation]->(page_obs:observation_of_identity)-->({variable})"
+        else:
+            ranked = "coalesce(max(page_obs.observation_date), '')"
+            pattern = f"(page_obs:observation_of_identity)-->({variable})"
+        return f"CALL {{ WITH {variable} OPTIONAL MATCH {pattern} RETURN {ranked} AS page_rank }}"
+
+    def return_clause(self, variables, key_variables):
+        """
+        Cypher returning one page of the ranked rows: variables, and page_key, the sort key of the
+        row (page_rank then the elementIds of key_variables), which the next page starts after.
+        """
+        key_ids = [f"elementId({variable})" for variable in key_variables]
+        where = ''
+        if self.after is not None:
+            # Rows after the cursor: lower rank, or the same rank and a later elementId
+            ids_after = f"{key_ids[-1]} > $page_after[{len(key_ids)}]"
+            for i in range(len(key_ids) - 1, 0, -1):
+                ids_after = f"{key_ids[i - 1]} > $page_after[{i}] OR ({key_ids[i - 1]} = $page_after[{i}] AND ({ids_after}))"
+            where = f"WHERE page_rank < $page_after[0] OR (page_rank = $page_after[0] AND ({ids_after}))\n"
+        return (f"WITH *\n{where}"
+                f"RETURN {', '.join(variables)}, [page_rank, {', '.join(key_ids)}] AS page_key\n"
+                f"ORDER BY page_rank DESC, {', '.join(key_ids)}\n"
+                f"LIMIT $page_limit")
+
+    def parameters(self):
+        """Query parameters of the page, one more row than the limit tells whether there is a next page."""
+        parameters = {'page_limit': self.limit + 1}
+        if self.after is not None:
+            parameters['page_after'] = self.after
+        return parameters
+
+    def take(self, records):
+        """The records of this page, remembering the cursor of the next one if there are more."""
+        records = list(records)
+        page_records = records[:self.limit]
+        if len(records) > self.limit:
+            self.next_cursor = _encode_cursor(self.order_by, page_records[-1]['page_key'])
+        self.returned = len(page_records)
+        return page_records
+
+    def metadata(self):
+        """Page of the response metadata."""
+        return {'page': {
+            'limit': self.limit,
+            'orderBy': self.order_by,
+            'cursor': self.cursor,
+            'nextCursor': self.next_cursor,
+            'hasMore': self.next_cursor is not None,
+            'returned': self.returned,
+            'totalEstimate': self.total_estimate,
+        }}
+
+
+def parse_search_page(limit=None, order_by='observations', cursor=None):
+    """
+    Build the SearchPage of a request from its limit, orderBy and cursor parameters.
+
+    Returns:
+        SearchPage: The page, or None when the request has no limit
+
+    Raises:
+        ValueError: If the limit, order or cursor is invalid
+    """
+    if not limit:
+        return None
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ValueError(f"limit must be a number, got {limit}")
+    return SearchPage(limit, (order_by or 'observations').lower(), cursor)
+
+
+def estimate_rows(plan):
+    """Rows the planner expects a query to return, from its EXPLAIN plan (statistics of the count store and indexes)."""
+    if not plan:
+        return None
+    estimate = (plan.get('args') or {}).get('EstimatedRows')
+    return int(round(estimate)) if estimate is not None else None
@@ -0,0 +1,300 @@
+from lib.constants import logger
+from modules.date_window import date_condition, date_window_params
+from modules.search_pages import estimate_rows
+
+# Cypher of the initial node searches (node value, persona and show all overlaps), run by
+# modules/graph_backend.Neo4jBackend and by get_initial_nodes_async in the ASGI mode
+LABELS_QUERY = """
+CALL db.labels() YIELD label
+RETURN label
+ORDER BY label
+"""
+
+
+def quote_name(name):
+    """A label or relationship type quoted for Cypher, names can't be parameters."""
+    return "`" + name.replace("`", "``") + "`"
+
+
+def build_search_query(search_value, node_type=None, search_operator='equals', case_sensitive=True, search_source_select='', date_window=None, search_values=None):
+    """
+    Build the Cypher query of a node value search, only matching nodes observed within date_window if given.
+
+    An exact search with search_values (see modules/identifier_normalization.normalize_search)
+    matches any of them instead of search_value.
+
+    Values (the search value, sources and window) are always passed as parameters, so the query
+    text only depends on the node type (quoted, as labels can't be parameters), operator, case
+    sensitivity, whether sources are selected and the bounds of the window, and Neo4j reuses one
+    cached plan for each combination.
+
+    Returns:
+        tuple: (query, parameters)
+    """
+    # Define operator mappings
+    operator_map = {
+        'equals': '=',
+        'contains': 'CONTAINS',
+        'starts_with': 'STARTS WITH',
+        'ends_with': 'ENDS WITH'
+    }
+    
+    if search_operator not in operator_map:
+        raise ValueError(f"Invalid search operator: {search_operator}")
+    
+    operator = operator_map[search_operator]
+    parameters = dict(search_value=search_value, **date_window_params(date_window))
+    
+    # Build the WHERE clause for the node value
+    if search_values and search_operator == 'equals':
+        parameters['search_values'] = search_values
+        where_clause = "v.value IN $search_values" if case_sensitive else "toLower(v.value) IN [value IN $search_values | toLower(value)]"
+    elif case_sensitive:
+        where_clause = f"v.value {operator} $search_value"
+    else:
+        where_clause = f"toLower(v.value) {operator} toLower($search_value)"
+
+    # With source filtering the observation is matched and restricted directly, otherwise an
+    # identifier must have at least one observation within the window
+    observation_window = date_condition('o', date_window)
+    if date_window and node_type == 'observation_of_identity':
+        node_window = date_condition('v', date_window)
+    elif date_window and node_type:
+        node_window = f" AND EXISTS {{ MATCH (o:observation_of_identity)-[]->(v){date_condition('o', date_window, 'WHERE')} }}"
+    elif date_window:
+        node_window = (f" AND ((v:observation_of_identity{date_condition('v', date_window)})"
+                       f" OR (NOT v:observation_of_identity AND EXISTS {{ MATCH (o:observation_of_identity)-[]->(v){date_condition('o', date_window, 'WHERE')} }}))")
+    else:
+        node_window = ''
+    
+    # Handle source filtering
+    if search_source_select and search_source_select.strip():
+        # Parse comma-separated sources, one source or several are matched with the same IN list
+        # (an index seek on source.value either way)
+        parameters['sources'] = [s.strip() for s in search_source_select.split(',') if s.strip()]
+        if node_type:
+            query = f"""
+            MATCH (s:source)-[:has_observation]->(o:observation_of_identity)-[:{quote_name('has_' + node_type)}]->(v:{quote_name(node_type)})
+            WHERE s.value IN $sources AND {where_clause}{observation_window}
+            RETURN DISTINCT v, o, s
+            """
+        else:
+            query = f"""
+            MATCH (s:source)-[:has_observation]->(o:observation_of_identity)-[r]->(v)
+            WHERE s.value IN $sources AND NOT v:observation_of_identity AND {where_clause}{observation_window}
+            RETURN DISTINCT v, o, s
+            """
+    else:
+        # No source filtering - search all sources
+        if node_type:
+            query = f"MATCH (v:{quote_name(node_type)}) WHERE {where_clause}{node_window} RETURN v"
+        else:
+            query = f"MATCH (v) WHERE {where_clause}{node_window} RETURN v"
+    
+    return query, parameters
+
+def build_persona_query(date_window=None):
+    """
+    Query for all observations in the persona cluster of the given observation (or persona_id),
+    precomputed by the dataloader (--build_persona_clusters) and matched on the persona_id index.
+    """
+    return f"""
+    OPTIONAL MATCH (o:observation_of_identity {{value: $search_value}})
+    WITH coalesce(o.persona_id, $search_value) AS persona_id
+    MATCH (member:observation_of_identity {{persona_id: persona_id}})
+    {date_condition('member', date_window, 'WHERE')}
+    RETURN member
+    """
+
+
+def build_show_all_overlaps_query(identity_labels, overlap_source_select1, overlap_source_select2, num_connections_show_all_overlaps, date_window=None):
+    """
+    Build the show all overlaps query (identifiers with at least num_connections_show_all_overlaps
+    observations, optionally only counting observations of the given sources and within date_window).
+
+    Returns:
+        tuple: (query, parameters)
+    """
+    # Build Cypher query to find shared identifiers with source filtering
+    # Always enter source filtering logic if either parameter is provided (even if empty)
+    # This allows us to handle empty arrays as "search all sources" properly
+    if overlap_source_select1 is not None or overlap_source_select2 is not None:
+        logger.info(f"Source filtering is enabled: overlap_source_select1='{overlap_source_select1}', overlap_source_select2='{overlap_source_select2}'")
+        # Parse source lists
+        primary_sources = []
+        if overlap_source_select1 and overlap_source_select1.strip():
+            primary_sources = [s.strip() for s in overlap_source_select1.split(',') if s.strip()]
+
+        compare_sources = []
+        if overlap_source_select2 and overlap_source_select2.strip():
+            compare_sources = [s.strip() for s in overlap_source_select2.split(',') if s.strip()]
+
+        logger.info(f"Parsed sources: primary_sources={primary_sources}, compare_sources={compare_sources}")
+        if primary_sources and compare_sources:
+            logger.info(f"Search pattern: Primary sources: {primary_sources} + Compare sources: {compare_sources}")
+        elif primary_sources and not compare_sources:
+            logger.info(f"Search pattern: Primary sources: {primary_sources} + Compare sources: ALL SOURCES")
+        elif compare_sources and not primary_sources:
+            logger.info(f"Search pattern: Primary sources: ALL SOURCES + Compare sources: {compare_sources}")
+        else:
+            logger.info("Search pattern: Primary sources: ALL SOURCES + Compare sources: ALL SOURCES")
+
+        # Build query with source filtering
+        # Handle different combinations: both specified, only primary, only compare, or mixed (one empty, one specified)
+        # 
+        # Logic for empty arrays:
+        # - If primary_sources=[] and compare_sources=['source1'], it means:
+        #   * Search ALL sources for primary observations
+        #   * Search only 'source1' for compare observations
+        # - If primary_sources=['source1'] and compare_sources=[], it means:
+        #   * Search only 'source1' for primary observations  
+        #   * Search ALL sources for compare observations
+        # - If both are empty (primary_sources=[] and compare_sources=[]), it means:
+        #   * Search ALL sources for primary observations
+        #   * Search ALL sources for compare observations
+        #   * This is different from "no source filtering" because it still uses the source filtering structure
+        #
+        if date_window:
+            logger.info(f"Using query restricted to observations within {date_window}")
+            # Start from the observations within the window (observation_date index) so the
+            # cost follows the size of the window, and count both sides within it
+            query = f"""
+            MATCH (obs1:observation_of_identity){date_condition('obs1', date_window, 'WHERE')}
+            MATCH (s1:source)-[:has_observation]->(obs1)-[r1]->(identifier)
+            WHERE (size($primary_sources) = 0 OR s1.value IN $primary_sources)
+              AND ANY(label IN labels(identifier) WHERE label IN $identity_labels)
+            WITH identifier, count(DISTINCT obs1) as primary_count
+            MATCH (s2:source)-[:has_observation]->(obs2:observation_of_identity)-[r2]->(identifier)
+            WHERE (size($compare_sources) = 0 OR s2.value IN $compare_sources){date_condition('obs2', date_window)}
+            WITH identifier, primary_count, count(DISTINCT obs2) as compare_count
+            WITH identifier, primary_count + compare_count as total_count
+            WHERE total_count >= $min_connections
+            RETURN identifier, total_count as observation_count
+            ORDER BY observation_count DESC
+            """
+
+            return query, dict(identity_labels=identity_labels, primary_sources=primary_sources, compare_sources=compare_sources, min_connections=num_connections_show_all_overlaps, **date_window_params(date_window))
+        elif primary_sources and compare_sources:
+            logger.info("Using query with both primary and compare sources specified")
+            # Both primary and compare sources specified
+            query = """
+            MATCH (identifier)
+            WHERE ANY(label IN labels(identifier) WHERE label IN $identity_labels)
+            WITH identifier
+            MATCH (s1:source)-[:has_observation]->(obs1:observation_of_identity)-[r1]->(identifier)
+            WHERE s1.value IN $primary_sources
+            WITH identifier, count(DISTINCT obs1) as primary_count
+            MATCH (s2:source)-[:has_observation]->(obs2:observation_of_identity)-[r2]->(identifier)
+            WHERE s2.value IN $compare_sources
+            WITH identifier, primary_count, count(DISTINCT obs2) as compare_count
+            WITH identifier, primary_count + compare_count as total_count
+            WHERE total_count >= $min_connections
+            RETURN identifier, total_count as observation_count
+            ORDER BY observation_count DESC
+            """
+
+            return query, dict(identity_labels=identity_labels, primary_sources=primary_sources, compare_sources=compare_sources, min_connections=num_connections_show_all_overlaps)
+        elif primary_sources and not compare_sources:
+            logger.info("Using query with only primary sources specified (compare_sources is empty - search all sources for comparison)")
+            # Only primary sources specified, compare against all sources
+            query = """
+            MATCH (identifier)
+            WHERE ANY(label IN labels(identifier) WHERE label IN $identity_labels)
+            WITH identifier
+            MATCH (s1:source)-[:has_observation]->(obs1:observation_of_identity)-[r1]->(identifier)
+            WHERE s1.value IN $primary_sources
+            WITH identifier, count(DISTINCT obs1) as primary_count
+            MATCH (s2:source)-[:has_observation]->(obs2:observation_of_identity)-[r2]->(identifier)
+            WITH identifier, primary_count, count(DISTINCT obs2) as compare_count
+            WITH identifier, primary_count + compare_count as total_count
+            WHERE total_count >= $min_connections
+            RETURN identifier, total_count as observation_count
+            ORDER BY observation_count DESC
+            """
+
+            return query, dict(identity_labels=identity_labels, primary_sources=primary_sources, min_connections=num_connections_show_all_overlaps)
+        elif compare_sources and not primary_sources:
+            logger.info("Using query with only compare sources specified (primary_sources is empty - search all sources for primary)")
+            # Only compare sources specified, search all sources for primary
+            query = """
+            MATCH (identifier)
+            WHERE ANY(label IN labels(identifier) WHERE label IN $identity_labels)
+            WITH identifier
+            MATCH (s1:source)-[:has_observation]->(obs1:observation_of_identity)-[r1]->(identifier)
+            WITH identifier, count(DISTINCT obs1) as primary_count
+            MATCH (s2:source)-[:has_observation]->(obs2:observation_of_identity)-[r2]->(identifier)
+            WHERE s2.value IN $compare_sources
+            WITH identifier, primary_count, count(DISTINCT obs2) as compare_count
+            WITH identifier, primary_count + compare_count as total_count
+            WHERE total_count >= $min_connections
+            RETURN identifier, total_count as observation_count
+            ORDER BY observation_count DESC
+            """
+
+            return query, dict(identity_labels=identity_labels, compare_sources=compare_sources, min_connections=num_connections_show_all_overlaps)
+        elif not primary_sources and not compare_sources:
+            logger.info("Using query with both sides empty - search all sources for both primary and compare")
+            # Both primary and compare sources are empty - search all sources on both sides
+            query = """
+            MATCH (identifier)
+            WHERE ANY(label IN labels(identifier) WHERE label IN $identity_labels)
+            WITH identifier
+            MATCH (s1:source)-[:has_observation]->(obs1:observation_of_identity)-[r1]->(identifier)
+            WITH identifier, count(DISTINCT obs1) as primary_count
+            MATCH (s2:source)-[:has_observation]->(obs2:observation_of_identity)-[r2]->(identifier)
+            WITH identifier, primary_count, count(DISTINCT obs2) as compare_count
+            WITH identifier, primary_count + compare_count as total_count
+            WHERE total_count >= $min_connections
+            RETURN identifier, total_count as observation_count
+            ORDER BY observation_count DESC
+            """
+
+            return query, dict(identity_labels=identity_labels, min_connections=num_connections_show_all_overlaps)
+        else:
+            # This shouldn't happen given our logic above, but just in case
+            logger.warning("Unexpected state: both primary_sources and compare_sources are empty")
+            # Fall back to no source filtering
+            query = """
+            MATCH (identifier)
+            WHERE ANY(label IN labels(identifier) WHERE label IN $identity_labels)
+            WITH identifier
+            MATCH (obs:observation_of_identity)-[r]->(identifier)
+            WITH identifier, count(DISTINCT obs) as observation_count
+            WHERE observation_count >= $min_connections
+            RETURN identifier, observation_count
+            ORDER BY observation_count DESC
+            """
+
+            return query, dict(identity_labels=identity_labels, min_connections=num_connections_show_all_overlaps)
+    else:
+        logger.info("Using query with no source filtering (all sources)")
+        logger.info("Both overlap_source_select1 and overlap_source_select2 are empty or whitespace - searching ALL sources")
+        # No source filtering - use original query
+        query = f"""
+        MATCH (identifier)
+        WHERE ANY(label IN labels(identifier) WHERE label IN $identity_labels)
+        WITH identifier
+        MATCH (obs:observation_of_identity)-[r]->(identifier){date_condition('obs', date_window, 'WHERE')}
+        WITH identifier, count(DISTINCT obs) as observation_count
+        WHERE observation_count >= $min_connections
+        RETURN identifier, observation_count
+        ORDER BY observation_count DESC
+        """
+
+        return query, dict(identity_labels=identity_labels, min_connections=num_connections_show_all_overlaps, **date_window_params(date_window))
+
+
+def run_page(session, query, parameters, page, variables, key_variables, observations=False, observation_count=None):
+    """
+    Records of one page of query (see modules/search_pages.SearchPage): its rows ranked by the page's
+    order, starting after the page's cursor, with only the rank computed for the rows it skips.
+
+    On the first page the planner's estimate of the total number of rows is read from the plan of the
+    unpaged query (EXPLAIN, which doesn't run it) into page.total_estimate.
+    """
+    if page.cursor is None:
+        page.total_estimate = estimate_rows(session.run(f"EXPLAIN {query}", **parameters).consume().plan)
+    paged_query = (f"CALL {{\n{query}\n}}\n"
+                   f"{page.rank_clause(variables[0], observations, observation_count)}\n"
+                   f"{page.return_clause(variables, key_variables)}")
+    return page.take(session.run(paged_query, **parameters, **page.parameters()))
@@ -0,0 +1,162 @@
+import atexit
+from collections import defaultdict
+import json
+from pathlib import Path
+import queue
+import re
+import threading
+import time
+
+from neo4j import Query
+from personatrace_common.slow_query_log import JsonLinesLog, simplify_plan, slow_query_entry, total_db_hits
+
+from lib.constants import (logger, SLOW_QUERY_THRESHOLD, SLOW_QUERY_PLAN,
+                           SLOW_QUERY_LOG_FILE, SLOW_QUERY_LOG_MAX_BYTES, SLOW_QUERY_LOG_BACKUPS)
+from modules.read_routing import read_session_kwargs
+
+# Parameters that never hold identifier values, logged as they are. Every other string is redacted
+NON_PII_PARAMETERS = frozenset({'derived_relationship_types', 'identity_labels', 'primary_sources', 'compare_sources',
+                                'date_from', 'date_until', 'min_shared_identifiers', 'num_connections', 'limit'})
+
+# Clauses that write, such queries are only ever planned with EXPLAIN, never re-run with PROFILE
+WRITE_CLAUSES = re.compile(r'\b(CREATE|MERGE|SET|DELETE|REMOVE|DROP|FOREACH|LOAD\s+CSV)\b', re.IGNORECASE)
+
+# Number of slow queries waiting for their plan, more are logged without one
+PLAN_QUEUE_SIZE = 16
+
+# Seconds to wait at shutdown for the plans already queued
+PLAN_SHUTDOWN_SECONDS = 5
+
+
+class SlowQueryLog:
+    """
+    Records queries slower than a threshold to a rotating JSON lines log.
+
+    The plan of a slow query is captured by a background thread, re-running read queries under
+    PROFILE (to get the db hits) or EXPLAIN (plan only) on a driver of its own from the shared
+    connection helper, so capturing it never slows down the request that ran the query. The
+    driver is closed when the log is closed at shutdown.
+
+    PROFILE runs the query again in full, so it runs with the query's own transaction timeout, and
+    a query that ran out of its timeout is only EXPLAINed: profiling it would just time out again.
+    """
+
+    def __init__(self, path, threshold, plan_mode, max_bytes, backups):
+        self.path = path
+        self.threshold = threshold
+        self.plan_mode = plan_mode
+        self._log = JsonLinesLog(path, max_bytes, backups)
+        self._queue = queue.Queue(maxsize=PLAN_QUEUE_SIZE)
+        self._worker = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def record(self, query, parameters, seconds, rows, caller, endpoint=None, timeout=None, timed_out=False):
+        """
+        Record a finished query if it was slow, timeout being the transaction timeout it ran with
+        and timed_out whether it ran out of it (its rows are then only the ones read until then).
+        """
+        if self.threshold <= 0 or seconds < self.threshold:
+            return
+        entry = {'endpoint': endpoint, **slow_query_entry(query, parameters, seconds, rows, caller, NON_PII_PARAMETERS)}
+        if timed_out:
+            entry['timed_out'] = True
+        logger.warning(f"Slow query in {caller} ({seconds:.2f}s, {rows} rows), see {self.path}")
+        if self.plan_mode == 'none' or not self._start_worker():
+            self._log.write(entry)
+            return
+        try:
+            self._queue.put_nowait((entry, query, parameters, timeout, timed_out))
+        except queue.Full:
+            entry['plan_error'] = 'Plan queue full'
+            self._log.write(entry)
+
+    def close(self):
+        """Stop the plan worker once it has planned the queued queries, closing its driver."""
+        with self._lock:
+            self._closed = True
+            worker, self._worker = self._worker, None
+        if worker is None:
+            return
+        try:
+            self._queue.put(None, timeout=PLAN_SHUTDOWN_SECONDS)
+        except queue.Full:
+            return
+        worker.join(PLAN_SHUTDOWN_SECONDS)
+
+    def _start_worker(self):
+        """Start the plan worker if it isn't running, False once the log is closed."""
+        with self._lock:
+            if self._closed:
+                return False
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._capture_plans, name='slow-query-plans', daemon=True)
+                self._worker.start()
+            return True
+
+    def _capture_plans(self):
+        # Imported here as lib.neo4j_connection traces its drivers through this module
+        from lib.neo4j_connection import create_driver
+        driver = create_driver()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                entry, query, parameters, timeout, timed_out = item
+                mode = 'EXPLAIN' if self.plan_mode == 'explain' or timed_out or WRITE_CLAUSES.search(str(query)) else 'PROFILE'
+                try:
+                    start = time.perf_counter()
+                    # Planned on a reader like the query itself, within the same timeout
+                    with driver.session(**read_session_kwargs()) as session:
+                        summary = session.run(Query(f"{mode} {query}", timeout=timeout) if timeout else f"{mode} {query}", parameters).consume()
+                    plan = summary.profile if mode == 'PROFILE' else summary.plan
+                    entry['plan_mode'] = mode
+                    entry['plan_seconds'] = round(time.perf_counter() - start, 4)
+                    entry['db_hits'] = total_db_hits(plan) if mode == 'PROFILE' else None
+                    entry['plan'] = simplify_plan(plan)
+                except Exception as e:
+                    entry['plan_error'] = str(e)
+                self._log.write(entry)
+        finally:
+            driver.close()
+
+
+def read_slow_queries(path, limit=20):
+    """
+    Group the recorded slow queries (including rotated logs) by query text, worst first.
+
+    Returns:
+        list: {'query', 'count', 'maxSeconds', 'avgSeconds', 'lastSeenAt', 'callers', 'endpoints',
+        'worst'} per query, worst being the slowest recorded run with its parameters and plan
+    """
+    paths = sorted(Path(path).parent.glob(Path(path).name + '*'), key=lambda p: p.stat().st_mtime)
+    groups = defaultdict(list)
+    for log_path in paths:
+        with open(log_path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                groups[entry['query']].append(entry)
+
+    offenders = []
+    for query, entries in groups.items():
+        worst = max(entries, key=lambda entry: entry['seconds'])
+        offenders.append({
+            'query': query,
+            'count': len(entries),
+            'maxSeconds': worst['seconds'],
+            'avgSeconds': round(sum(entry['seconds'] for entry in entries) / len(entries), 4),
+            'lastSeenAt': max(entry['recorded_at'] for entry in entries),
+            'callers': sorted({entry['caller'] for entry in entries if entry.get('caller')}),
+            'endpoints': sorted({entry['endpoint'] for entry in entries if entry.get('endpoint')}),
+            'worst': {key: worst.get(key) for key in ('recorded_at', 'parameters', 'rows', 'plan_mode', 'db_hits', 'plan', 'plan_error')},
+        })
+    offenders.sort(key=lambda offender: (-offender['maxSeconds'], -offender['count']))
+    return offenders[:limit]
+
+
+slow_query_log = SlowQueryLog(SLOW_QUERY_LOG_FILE, SLOW_QUERY_THRESHOLD, SLOW_QUERY_PLAN, SLOW_QUERY_LOG_MAX_BYTES, SLOW_QUERY_LOG_BACKUPS)
+atexit.register(slow_query_log.close)
@@ -0,0 +1,81 @@
+from lib.constants import logger, SOURCE_OVERLAP
+
+
+def _label_counts(labels, counts):
+    return dict(zip(labels or [], counts or []))
+
+
+def get_source_overlap_matrix(driver, source=None):
+    """
+    Read the precomputed source x source shared identifier counts.
+
+    Args:
+        driver: Neo4j driver
+        source: Only return the overlaps of this source, ranked by shared identifiers
+
+    Returns:
+        dict: 'sources' (sorted source values), 'identifierCounts' and 'identifierLabelCounts' per
+        source, 'matrix' (shared identifier counts in the order of 'sources', the diagonal being each
+        source's identifier count), 'labelMatrices' (the same per identifier label) and 'computedAt'.
+        With source, 'overlaps' lists {'source', 'sharedIdentifiers', 'labelCounts'} instead of the matrices.
+    """
+    with driver.session() as session:
+        source_records = list(session.run("""
+        MATCH (s:source)
+        RETURN s.value AS value, s.identifier_count AS identifier_count, s.identifier_labels AS identifier_labels,
+               s.identifier_label_counts AS identifier_label_counts, s.overlap_computed_at AS computed_at
+        ORDER BY value
+        """))
+        overlap_records = list(session.run(f"""
+        MATCH (a:source)-[o:{SOURCE_OVERLAP}]->(b:source)
+        RETURN a.value AS from, b.value AS to, o.shared_identifiers AS shared_identifiers,
+               o.identifier_labels AS identifier_labels, o.identifier_label_counts AS identifier_label_counts
+        """))
+
+    sources = [record['value'] for record in source_records if record['value'] is not None]
+    computed_at = max((record['computed_at'] for record in source_records if record['computed_at']), default=None)
+    data = {
+        'sources': sources,
+        'identifierCounts': {record['value']: record['identifier_count'] or 0 for record in source_records if record['value'] is not None},
+        'identifierLabelCounts': {record['value']: _label_counts(record['identifier_labels'], record['identifier_label_counts'])
+                                  for record in source_records if record['value'] is not None},
+        'computedAt': computed_at,
+    }
+    if computed_at is None:
+        logger.warning("The source overlap matrix has not been built, run the dataloader with --build_source_overlap_matrix")
+
+    # Ranked overlaps of one source
+    if source is not None:
+        overlaps = []
+        for record in overlap_records:
+            if source not in (record['from'], record['to']):
+                continue
+            overlaps.append({
+                'source': record['to'] if record['from'] == source else record['from'],
+                'sharedIdentifiers': record['shared_identifiers'],
+                'labelCounts': _label_counts(record['identifier_labels'], record['identifier_label_counts'])
+            })
+        overlaps.sort(key=lambda overlap: (-overlap['sharedIdentifiers'], overlap['source']))
+        data['source'] = source
+        data['overlaps'] = overlaps
+        return data
+
+    # Full symmetric matrices
+    index = {value: i for i, value in enumerate(sources)}
+    matrix = [[0] * len(sources) for _ in sources]
+    label_matrices = {}
+    for value, i in index.items():
+        matrix[i][i] = data['identifierCounts'][value]
+        for label, count in data['identifierLabelCounts'][value].items():
+            label_matrices.setdefault(label, [[0] * len(sources) for _ in sources])[i][i] = count
+    for record in overlap_records:
+        i, j = index.get(record['from']), index.get(record['to'])
+        if i is None or j is None:
+            continue
+        matrix[i][j] = matrix[j][i] = record['shared_identifiers']
+        for label, count in _label_counts(record['identifier_labels'], record['identifier_label_counts']).items():
+            label_matrix = label_matrices.setdefault(label, [[0] * len(sources) for _ in sources])
+            label_matrix[i][j] = label_matrix[j][i] = count
+    data['matrix'] = matrix
+    data['labelMatrices'] = label_matrices
+    return data
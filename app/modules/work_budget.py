@@ -0,0 +1,81 @@
+import threading
+import time
+
+from lib.constants import (logger, QUERY_TIMEOUT, ENDPOINT_QUERY_TIMEOUTS, WORK_BUDGET_ENDPOINTS, MAX_REQUEST_ROWS,
+                           MAX_REQUEST_SECONDS, MAX_HOPS)
+
+# Neo4j error codes of a transaction terminated by its timeout (server or client configured)
+TIMEOUT_ERROR_CODES = ('Neo.ClientError.Transaction.TransactionTimedOut',
+                       'Neo.ClientError.Transaction.TransactionTimedOutClientConfiguration')
+
+
+def is_timeout_error(error):
+    """Whether a neo4j error is a transaction that ran out of its timeout."""
+    return getattr(error, 'code', None) in TIMEOUT_ERROR_CODES
+
+
+class WorkBudget:
+    """
+    Cooperative work budget of one request: rows read from Neo4j, hops expanded and wall time.
+
+    Nothing is interrupted when the budget runs out, the traversal loops check exhausted()
+    between steps and stop expanding, and the nodes reached so far are returned flagged as
+    partial (see metadata()). Rows are charged by the traced driver (modules/request_tracing.py),
+    possibly from several threads (see modules/parallel_queries.py). The default budget has no limits.
+    """
+
+    def __init__(self, max_rows=None, max_hops=None, max_seconds=None):
+        self.max_rows = max_rows
+        self.max_hops = max_hops
+        self.deadline = time.monotonic() + max_seconds if max_seconds else None
+        self.rows = 0
+        self.partial_reason = None
+        self.stopped = False
+        self._lock = threading.Lock()
+
+    def charge_rows(self, rows=1):
+        with self._lock:
+            self.rows += rows
+
+    def mark_partial(self, reason):
+        """Flag the result as partial, keeping the first reason (e.g. 'max_rows' or 'query_timeout')."""
+        if self.partial_reason is None:
+            self.partial_reason = reason
+            logger.warning(f"Work budget: returning a partial result ({reason}, {self.rows} rows read)")
+
+    def stop(self, reason):
+        """Stop the traversal, e.g. because a query timed out or the client went away ('client_disconnected')."""
+        self.stopped = True
+        self.mark_partial(reason)
+
+    def exhausted(self):
+        """Whether the traversal should stop expanding, stopping it (and flagging the result) the first time."""
+        if not self.stopped:
+            if self.max_rows is not None and self.rows > self.max_rows:
+                self.stop('max_rows')
+            elif self.deadline is not None and time.monotonic() > self.deadline:
+                self.stop('max_seconds')
+        return self.stopped
+
+    def clip_hops(self, num_hops):
+        """num_hops, cut to max_hops (flagging the result as partial) if it is larger."""
+        if self.max_hops is not None and num_hops > self.max_hops:
+            self.mark_partial('max_hops')
+            return self.max_hops
+        return num_hops
+
+    def metadata(self):
+        """Partial result flags for the response metadata."""
+        return {'partial': self.partial_reason is not None, 'partialReason': self.partial_reason}
+
+
+def query_timeout_for(endpoint):
+    """Transaction timeout in seconds of the queries of endpoint (None for none)."""
+    return ENDPOINT_QUERY_TIMEOUTS.get(endpoint, QUERY_TIMEOUT)
+
+
+def work_budget_for(endpoint):
+    """A new work budget for a request to endpoint, or None if the endpoint has none."""
+    if endpoint not in WORK_BUDGET_ENDPOINTS:
+        return None
+    return WorkBudget(max_rows=MAX_REQUEST_ROWS, max_hops=MAX_HOPS, max_seconds=MAX_REQUEST_SECONDS)
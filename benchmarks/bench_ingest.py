@@ -0,0 +1,92 @@
+#! /usr/bin/env python3
+'''
+Observations loaded per second by the data loader's process_batch into a running Neo4j, for
+several batch sizes, on seeded synthetic observations (dataloader/generate_observations.py):
+
+    cd dataloader && uv run ../benchmarks/bench_ingest.py --clear_graph --observations 100000 --batch_sizes 1000 5000 20000
+
+The graph is deleted before each batch size is loaded, so --clear_graph is required and the
+benchmark must only be pointed at a scratch database (--neo4j_endpoint, --neo4j_username and
+--neo4j_password are passed on to the data loader). The graph of the last batch size is left
+loaded, which is what bench_queries.py runs on in the benchmark suite (run_suite.py).
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_utils import REPO_ROOT, use_component, write_results
+
+parser = argparse.ArgumentParser(description='Benchmark loading observations with process_batch',
+                                 epilog='Other arguments (e.g. --neo4j_endpoint) are passed on to the data loader')
+parser.add_argument('--observations', type=int, default=100000, help='Number of synthetic observations to load')
+parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1000, 5000, 20000], help='Batch sizes to benchmark')
+parser.add_argument('--seed', type=int, default=7, help='Seed of the synthetic observations')
+parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Processes generating the synthetic observations')
+parser.add_argument('--clear_graph', action='store_true', help='Required: delete the whole graph before loading each batch size')
+parser.add_argument('--output', type=str, help='Also write the JSON results to this file')
+args, loader_args = parser.parse_known_args()
+if not args.clear_graph:
+    parser.error('--clear_graph is required, the benchmark deletes the graph before each run')
+
+use_component('dataloader', ['--live_data'] + loader_args)
+from neo4j import GraphDatabase
+from lib.constants import NEO4J_ENDPOINT, NEO4J_USERNAME, NEO4J_PASSWORD, NODE_SCHEMAS
+from lib.graph_delete import delete_graph
+import load_data
+from load_data import process_batch, create_constraints, create_indexes, create_observation_date_index
+
+
+def generate_observations(directory):
+    """The synthetic observations, generated with the data loader's generator (which has its own command line)."""
+    path = os.path.join(directory, 'observations.json')
+    subprocess.run([sys.executable, str(REPO_ROOT / 'dataloader' / 'generate_observations.py'),
+                    '--observations', str(args.observations), '--seed', str(args.seed),
+                    '--workers', str(args.workers), '--output', path], check=True)
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load(driver, observations, batch_size):
+    """Load observations into an empty graph in batches of batch_size, returning the seconds taken."""
+    delete_graph(driver)
+    # process_batch remembers the nodes and indexes it created in this process, which are gone now
+    load_data.created_end_label_indices.clear()
+    load_data.created_source_nodes.clear()
+    load_data.created_node_values_dict.clear()
+    create_constraints(driver, ['observation_of_identity', 'source'])
+    create_indexes(driver, NODE_SCHEMAS.keys())
+    create_observation_date_index(driver)
+    start = time.perf_counter()
+    for i in range(0, len(observations), batch_size):
+        process_batch(driver, observations[i:i + batch_size])
+    return time.perf_counter() - start
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        observations = generate_observations(directory)
+
+    driver = GraphDatabase.driver(NEO4J_ENDPOINT, auth=(NEO4J_USERNAME, NEO4J_PASSWORD))
+    results = []
+    try:
+        for batch_size in args.batch_sizes:
+            seconds = load(driver, observations, batch_size)
+            results.append({
+                'observations': len(observations),
+                'seed': args.seed,
+                'batch_size': batch_size,
+                'seconds': round(seconds, 2),
+                'observations_per_second': round(len(observations) / seconds),
+            })
+    finally:
+        driver.close()
+
+    write_results('ingest', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
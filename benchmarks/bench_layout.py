@@ -0,0 +1,77 @@
+#! /usr/bin/env python3
+'''
+Time the server-side graph layout (layout=server) on synthetic graphs and report how well it
+places connected nodes together, plus the cost of a cached repeat of the same result.
+
+    python benchmarks/bench_layout.py --nodes 1000 10000 100000
+'''
+import argparse
+
+import numpy as np
+
+from bench_utils import use_component, timed, write_results
+
+parser = argparse.ArgumentParser(description='Benchmark the server-side graph layout')
+parser.add_argument('--nodes', type=int, nargs='+', default=[1000, 10000, 100000], help='Graph sizes (node counts) to benchmark')
+parser.add_argument('--seed', type=int, default=7, help='Random seed for the synthetic graphs')
+parser.add_argument('--output', type=str, help='Also write the JSON results to this file')
+args = parser.parse_args()
+
+use_component('app')
+from modules.graph_layout import apply_layout, compute_layout, LAYOUT_CACHE
+
+
+def make_graph_data(num_nodes, rng):
+    """
+    Build the parts of get_graph_data output the layout uses: ~1/4 observations with three
+    identifiers each, where identifier popularity follows a Zipf distribution so some are shared
+    by many observations, as in real breach data.
+    """
+    num_observations = num_nodes // 4
+    node_ids = [f'4:bench:{i}' for i in range(num_nodes)]
+    num_identifiers = num_nodes - num_observations
+
+    observations = np.repeat(np.arange(num_identifiers, num_nodes), 3)
+    identifiers = (rng.zipf(1.8, len(observations)) - 1) % num_identifiers
+    relationships = [{'from': node_ids[a], 'to': node_ids[b]} for a, b in zip(observations, identifiers)]
+
+    return {'nodes': [{'id': node_id} for node_id in node_ids], 'relationships': relationships, 'metadata': {}}
+
+
+def edge_length_ratio(data, rng):
+    """Mean relationship length divided by the mean distance between random node pairs (lower is better)."""
+    index = {node['id']: i for i, node in enumerate(data['nodes'])}
+    pos = np.array([(node['x'], node['y']) for node in data['nodes']])
+    edges = np.array([(index[r['from']], index[r['to']]) for r in data['relationships']])
+    pairs = rng.integers(0, len(pos), size=(10000, 2))
+    edge_length = np.linalg.norm(pos[edges[:, 0]] - pos[edges[:, 1]], axis=1).mean()
+    random_length = np.linalg.norm(pos[pairs[:, 0]] - pos[pairs[:, 1]], axis=1).mean()
+    return float(edge_length / random_length)
+
+
+def main():
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for num_nodes in args.nodes:
+        data = make_graph_data(num_nodes, rng)
+        node_ids = [node['id'] for node in data['nodes']]
+        edges = [(r['from'], r['to']) for r in data['relationships']]
+
+        _, layout_time = timed(compute_layout, node_ids, edges)
+        LAYOUT_CACHE.clear()
+        apply_layout(data)
+        _, cached_time = timed(apply_layout, data)
+
+        results.append({
+            'nodes': num_nodes,
+            'relationships': len(edges),
+            'layout_seconds': round(layout_time, 4),
+            'cached_layout_seconds': round(cached_time, 4),
+            'edge_length_ratio': round(edge_length_ratio(data, rng), 3),
+        })
+
+    write_results('layout', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#! /usr/bin/env python3
+'''
+Time the ingest-time identifier normalization (dataloader --normalize_identifiers) per value, with
+and without the per-normalizer cache, on identifier streams with different numbers of distinct values.
+
+    python benchmarks/bench_normalizers.py --values 1000000 --distinct 10000 1000000
+'''
+import argparse
+
+import numpy as np
+
+from bench_utils import use_component, timed, write_results
+
+parser = argparse.ArgumentParser(description='Benchmark identifier normalization')
+parser.add_argument('--values', type=int, default=1000000, help='Number of identifier values to normalize')
+parser.add_argument('--distinct', type=int, nargs='+', default=[10000, 1000000], help='Numbers of distinct values to benchmark')
+parser.add_argument('--seed', type=int, default=7, help='Random seed for the synthetic identifiers')
+parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions (best is reported)')
+parser.add_argument('--output', type=str, help='Also write the JSON results to this file')
+args = parser.parse_args()
+
+use_component('dataloader', ['--example_data'])
+from personatrace_common.normalizers import IdentifierNormalizer, default_normalizers, phonenumbers
+
+
+def make_values(rng, num_distinct):
+    """(label, value) pairs of messy emails, phone numbers and IP addresses, as sources write them."""
+    names = np.array(list('abcdefghijklmnopqrstuvwxyz'))[rng.integers(0, 26, size=(num_distinct, 10))]
+    digits = rng.integers(0, 10, size=(num_distinct, 10))
+    octets = rng.integers(0, 256, size=(num_distinct, 4))
+    distinct = []
+    for i in range(num_distinct):
+        kind = i % 3
+        if kind == 0:
+            distinct.append(('email_address', ''.join(names[i]).title() + '@Example.COM'))
+        elif kind == 1:
+            number = ''.join(map(str, digits[i]))
+            distinct.append(('phone_number', f'+1 {number[:3]}-{number[3:6]}-{number[6:]}'))
+        else:
+            distinct.append(('ip_address', '.'.join(map(str, octets[i]))))
+    return [distinct[i] for i in rng.integers(0, num_distinct, size=args.values)]
+
+
+def normalize_all(values, cache_size):
+    normalizer = IdentifierNormalizer(default_normalizers('1'), cache_size=cache_size)
+    for label, value in values:
+        normalizer.normalize('online_identifiers', label, value)
+    return normalizer.num_changed
+
+
+def main():
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for num_distinct in args.distinct:
+        values = make_values(rng, num_distinct)
+        for cache_size in (0, None):
+            changed, seconds = timed(normalize_all, values, cache_size, repeat=args.repeat)
+            results.append({
+                'values': args.values,
+                'distinct': num_distinct,
+                'cache': cache_size != 0,
+                'phone_parser': 'phonenumbers' if phonenumbers is not None else 'digits',
+                'changed': changed,
+                'seconds': round(seconds, 4),
+                'values_per_second': round(args.values / seconds),
+            })
+
+    write_results('normalizers', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
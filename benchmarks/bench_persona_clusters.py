@@ -0,0 +1,124 @@
+#! /usr/bin/env python3
+'''
+Time the offline persona clustering (dataloader --build_persona_clusters) on synthetic
+observation -> identifier relationships, excluding the Neo4j reads and writes.
+
+With --store_edges it also loads smaller graphs batch by batch into the incremental persona
+store (dataloader --persona_store) and checks that it ends up with the same clusters as the full
+build, hub identifiers included.
+
+    python benchmarks/bench_persona_clusters.py --edges 1000000 10000000 30000000
+    python benchmarks/bench_persona_clusters.py --edges 1000000 --store_edges 100000 --hub_threshold 50
+'''
+import argparse
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from bench_utils import use_component, timed, write_results
+
+parser = argparse.ArgumentParser(description='Benchmark persona clustering')
+parser.add_argument('--edges', type=int, nargs='+', default=[1000000, 10000000], help='Numbers of observation -> identifier relationships to benchmark')
+parser.add_argument('--identifiers_per_observation', type=float, default=3, help='Average identifiers per observation')
+parser.add_argument('--hub_threshold', type=int, default=1000, help='Hub identifier threshold (0 for no limit)')
+parser.add_argument('--store_edges', type=int, nargs='*', default=[], help='Numbers of relationships to also load into the incremental persona store and compare with the full build')
+parser.add_argument('--store_batch_size', type=int, default=1000, help='Observations per persona store batch')
+parser.add_argument('--seed', type=int, default=7, help='Random seed for the synthetic graphs')
+parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions (best is reported)')
+parser.add_argument('--output', type=str, help='Also write the JSON results to this file')
+args = parser.parse_args()
+
+use_component('dataloader', ['--build_persona_clusters'])
+from lib.persona_clusters import drop_hub_edges, persona_assignments
+from lib.persona_store import PersonaStore
+
+
+def make_edges(num_edges, rng):
+    """
+    Observation -> identifier relationships where identifier popularity follows a Zipf
+    distribution, so most identifiers belong to one observation and a few are hubs.
+    """
+    num_observations = int(num_edges / args.identifiers_per_observation)
+    num_identifiers = num_edges
+    observations = rng.integers(0, num_observations, num_edges)
+    identifiers = (rng.zipf(1.6, num_edges) - 1) % num_identifiers
+    return num_observations, observations, identifiers
+
+
+def cluster(num_observations, observations, identifiers):
+    """The in-memory part of build_persona_clusters: hub exclusion and connected components."""
+    observations, identifiers = drop_hub_edges(observations, identifiers, args.hub_threshold)
+    return persona_assignments(num_observations, observations, identifiers)
+
+
+def load_store(path, num_observations, observations, identifiers):
+    """Add the observations to a new persona store batch by batch, as the data loader does while loading."""
+    order = np.argsort(observations, kind='stable')
+    bounds = np.searchsorted(observations[order], np.arange(num_observations + 1))
+    store = PersonaStore(path, args.hub_threshold)
+    for batch_start in range(0, num_observations, args.store_batch_size):
+        batch_end = min(batch_start + args.store_batch_size, num_observations)
+        store.update({
+            observation: [('email', str(identifier)) for identifier in identifiers[order[bounds[observation]:bounds[observation + 1]]]]
+            for observation in range(batch_start, batch_end)
+        })
+        store.commit()
+    return store
+
+
+def same_clusters(store, roots):
+    """Whether the store groups the observations like the full build's roots (smallest index of each cluster)."""
+    _, store_clusters = np.unique([store.find(str(observation)) for observation in range(len(roots))], return_inverse=True)
+    smallest = np.full(store_clusters.max() + 1, len(roots))
+    np.minimum.at(smallest, store_clusters, np.arange(len(roots)))
+    return bool(np.array_equal(smallest[store_clusters], roots))
+
+
+def check_store(num_edges, rng):
+    """Time the incremental persona store on a synthetic graph and compare its clusters with a full build."""
+    num_observations, observations, identifiers = make_edges(num_edges, rng)
+    roots, _ = cluster(num_observations, observations, identifiers)
+    with tempfile.TemporaryDirectory() as directory:
+        store, seconds = timed(load_store, str(Path(directory) / 'persona_store.sqlite3'), num_observations, observations, identifiers)
+        matches = same_clusters(store, roots)
+        store.close()
+    return {
+        'store_edges': num_edges,
+        'observations': num_observations,
+        'batch_size': args.store_batch_size,
+        'clusters': int(len(np.unique(roots))),
+        'seconds': round(seconds, 4),
+        'edges_per_second': round(num_edges / seconds),
+        'matches_full_build': matches,
+    }
+
+
+def main():
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for num_edges in args.edges:
+        num_observations, observations, identifiers = make_edges(num_edges, rng)
+        (roots, sizes), seconds = timed(cluster, num_observations, observations, identifiers, repeat=args.repeat)
+
+        results.append({
+            'edges': num_edges,
+            'observations': num_observations,
+            'clusters': int(len(np.unique(roots))),
+            'largest_cluster': int(sizes.max()),
+            'seconds': round(seconds, 4),
+            'edges_per_second': round(num_edges / seconds),
+            'edge_array_bytes': observations.nbytes + identifiers.nbytes,
+        })
+
+    for num_edges in args.store_edges:
+        results.append(check_store(num_edges, rng))
+
+    write_results('persona_clusters', results, args.output)
+    if not all(result.get('matches_full_build', True) for result in results):
+        sys.exit('The incremental persona store differs from the full build')
+
+
+if __name__ == '__main__':
+    main()
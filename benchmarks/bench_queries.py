@@ -0,0 +1,158 @@
+#! /usr/bin/env python3
+'''
+Latency of the app's graph queries against a running Neo4j loaded with seeded synthetic
+observations (dataloader/generate_observations.py, e.g. by bench_ingest.py):
+
+    cd app && uv run ../benchmarks/bench_queries.py --areas search expansion paths
+
+- search: get_initial_nodes for an email address with each search operator, case sensitive and not
+- expansion: get_graph_data from one email address at 1-5 hops, within the app's work budget
+  (hub identifiers make the graph grow quickly with the hops, results are flagged when partial)
+- paths: /api/find-paths (through the Flask test client) between the email address and identifiers
+  found 2, 4 and 6 relationships away
+
+The values default to ones the generator always produces, --neo4j_endpoint, --neo4j_username and
+--neo4j_password are passed on to the app. To run without Neo4j on the app's in-memory graph of
+the generated observations instead, pass --graph_backend memory --memory_graph_data <file>.
+'''
+import argparse
+import time
+from urllib.parse import urlencode
+
+import numpy as np
+
+from bench_utils import use_component, write_results
+
+AREAS = ('search', 'expansion', 'paths')
+SEARCH_OPERATORS = ('equals', 'contains', 'starts_with', 'ends_with')
+
+parser = argparse.ArgumentParser(description='Benchmark the graph search, expansion and path queries',
+                                 epilog='Other arguments (e.g. --neo4j_endpoint) are passed on to the app')
+parser.add_argument('--areas', type=str, nargs='+', choices=AREAS, default=list(AREAS), help='Query areas to benchmark')
+parser.add_argument('--value', type=str, default='user12@inbox.org', help='Email address searched for, expanded and searched paths from')
+parser.add_argument('--hops', type=int, nargs='+', default=[1, 2, 3, 4, 5], help='Numbers of hops to expand')
+parser.add_argument('--path_distances', type=int, nargs='+', default=[2, 4, 6], help='Relationships away from the value of the path targets')
+parser.add_argument('--repeat', type=int, default=10, help='Repetitions of each query (p50 and p99 are reported)')
+parser.add_argument('--output', type=str, help='Also write the JSON results to this file')
+args, app_args = parser.parse_known_args()
+
+use_component('app', app_args)
+from app import create_app
+from blueprints.graph import get_graph_data
+from lib.neo4j_connection import get_neo4j_connection
+from modules.memory_graph import MemoryGraph
+from modules.neo4j_get_initial_nodes import get_initial_nodes
+from modules.work_budget import work_budget_for
+
+GRAPH_DATA_ENDPOINT = '/api/graph-data'
+
+
+def search_value(operator, case_sensitive):
+    """The part of args.value each operator searches for, upper case for the case insensitive search."""
+    local_part, domain = args.value.split('@', 1)
+    value = {'equals': args.value, 'contains': f'{local_part}@', 'starts_with': local_part, 'ends_with': f'{local_part[-1]}@{domain}'}[operator]
+    return value if case_sensitive else value.upper()
+
+
+def latencies(fn):
+    """Run fn args.repeat times after a warm-up run, returning (its last result, p50 ms, p99 ms)."""
+    result = fn()
+    seconds = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        result = fn()
+        seconds.append(time.perf_counter() - start)
+    return result, round(float(np.percentile(seconds, 50)) * 1000, 1), round(float(np.percentile(seconds, 99)) * 1000, 1)
+
+
+def search_initial_nodes(driver, value, operator='equals', case_sensitive=True):
+    return get_initial_nodes(driver, 'nodeValue', value, operator, 'email_address', 1, case_sensitive, '')
+
+
+def bench_search(driver):
+    results = []
+    for operator in SEARCH_OPERATORS:
+        for case_sensitive in (True, False):
+            value = search_value(operator, case_sensitive)
+            nodes, p50, p99 = latencies(lambda: search_initial_nodes(driver, value, operator, case_sensitive))
+            results.append({'area': 'search', 'operator': operator, 'case_sensitive': case_sensitive, 'value': value,
+                            'initial_nodes': len(nodes), 'p50_ms': p50, 'p99_ms': p99})
+    return results
+
+
+def bench_expansion(driver):
+    initial_nodes = search_initial_nodes(driver, args.value)
+    results = []
+    for num_hops in args.hops:
+        data, p50, p99 = latencies(lambda: get_graph_data(driver, initial_nodes, num_hops, False, False,
+                                                          budget=work_budget_for(GRAPH_DATA_ENDPOINT)))
+        results.append({'area': 'expansion', 'hops': num_hops, 'nodes': len(data['nodes']), 'relationships': len(data['relationships']),
+                        'partial': data['metadata'].get('partial', False), 'p50_ms': p50, 'p99_ms': p99})
+    return results
+
+
+def path_target(driver, distance):
+    """elementIds of args.value and of an identifier distance relationships away along observations (distance is even)."""
+    if isinstance(driver, MemoryGraph):
+        return memory_path_target(driver, distance)
+    pattern = '<--(:observation_of_identity)-->()' * (distance // 2 - 1) + '<--(:observation_of_identity)-->(end)'
+    query = (f"MATCH (start:email_address {{value: $value}}){pattern} "
+             f"WHERE end <> start RETURN elementId(start) AS start, elementId(end) AS end LIMIT 1")
+    with driver.session() as session:
+        record = session.run(query, value=args.value).single()
+    return (record['start'], record['end']) if record else (None, None)
+
+
+def memory_path_target(graph, distance):
+    """path_target on the in-memory graph: a first identifier found distance // 2 observation steps away, breadth first."""
+    records = graph.search_records(args.value, 'email_address')
+    if not records:
+        return None, None
+    start = records[0]['v']
+    seen = {start.element_id}
+    level = [start]
+    for _ in range(distance // 2):
+        observation_ids = {obs.element_id for node in level for obs in graph.observations_of_identifier(node.element_id)}
+        level = [record['identifier'] for record in graph.overlapping_identifier_records(list(observation_ids))
+                 if record['identifier'].element_id not in seen]
+        if not level:
+            return None, None
+        seen.update(node.element_id for node in level)
+    return start.element_id, level[0].element_id
+
+
+def bench_paths(driver):
+    client = create_app().test_client()
+    results = []
+    for distance in args.path_distances:
+        from_node_id, to_node_id = path_target(driver, distance)
+        if from_node_id is None:
+            results.append({'area': 'paths', 'distance': distance, 'paths': None, 'length': None, 'partial': False, 'p50_ms': None, 'p99_ms': None})
+            continue
+        url = '/api/find-paths?' + urlencode({'fromNodeId': from_node_id, 'toNodeId': to_node_id, 'maxDepth': distance})
+        response, p50, p99 = latencies(lambda: client.get(url))
+        data = response.get_json()
+        results.append({'area': 'paths', 'distance': distance, 'paths': data.get('count'),
+                        'length': len(data['paths'][0]['relationships']) if data.get('paths') else None,
+                        'partial': data.get('partial', False), 'p50_ms': p50, 'p99_ms': p99})
+    return results
+
+
+def main():
+    driver = get_neo4j_connection()
+    results = []
+    try:
+        if 'search' in args.areas:
+            results += bench_search(driver)
+        if 'expansion' in args.areas:
+            results += bench_expansion(driver)
+        if 'paths' in args.areas:
+            results += bench_paths(driver)
+    finally:
+        driver.close()
+
+    write_results('queries', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
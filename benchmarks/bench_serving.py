@@ -0,0 +1,153 @@
+#! /usr/bin/env python3
+'''
+Requests per second and latency percentiles of a running app under 10, 100 and 500 concurrent
+clients, each client sending the same graph search back to back. Run it once against the sync
+app (app.py) and once against the ASGI mode (asgi.py) on the same data to compare them:
+
+    cd app && uv run app.py ...
+    python benchmarks/bench_serving.py --name sync --output sync.json
+    cd app && uv run --extra asgi asgi.py ...
+    python benchmarks/bench_serving.py --name asgi --output asgi.json
+
+The default search is one of the example data's email addresses, 2 hops out, requested with
+lazy details as the frontend does (which asgi.py serves on the async driver).
+
+Each result also has the number of queries each Neo4j server ran meanwhile, from the app's
+/metrics, so against a cluster (--neo4j_endpoint neo4j://...) it shows how much of the read load
+the primary was spared, and the estimated hit rate of Neo4j's query plan cache.
+
+Give --path several times for a mixed workload, the clients take turns sending each of them, e.g.
+searches filtered by different combinations of sources (searchSourceSelect=a, =a,b, =b,c...) to
+check that they share cached plans.
+'''
+import argparse
+import asyncio
+import re
+import ssl
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from bench_utils import write_results
+
+DEFAULT_PATH = ('/api/graph-data?searchType=nodeValue&nodeType=email_address&searchOperator=equals'
+                '&searchValue=john.smith@email.com&numHopsNodeSearch=2&lazyDetails=true&fake_data=false')
+
+parser = argparse.ArgumentParser(description='Benchmark the app under concurrent graph searches')
+parser.add_argument('--url', type=str, default='https://localhost:5500', help='Base URL of the running app')
+parser.add_argument('--path', type=str, action='append', help='Request path (and query) sent by the clients, several for a mixed workload (default: an email address search)')
+parser.add_argument('--name', type=str, default='app', help='Name of the server in the results, e.g. sync or asgi')
+parser.add_argument('--clients', type=int, nargs='+', default=[10, 100, 500], help='Numbers of concurrent clients to benchmark')
+parser.add_argument('--duration', type=float, default=30, help='Seconds to send requests for at each number of clients')
+parser.add_argument('--timeout', type=float, default=120, help='Seconds after which a request counts as an error')
+parser.add_argument('--output', type=str, help='Also write the JSON results to this file')
+args = parser.parse_args()
+paths = args.path or [DEFAULT_PATH]
+
+
+def make_ssl_context(url):
+    if urlsplit(url).scheme != 'https':
+        return None
+    # The app is served with self-signed test certificates
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+async def fetch(host, port, ssl_context, path):
+    """Send one request on a new connection, returning (status, response headers and body)."""
+    reader, writer = await asyncio.open_connection(host, port, ssl=ssl_context)
+    try:
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n'.encode())
+        await writer.drain()
+        status_line = await reader.readline()
+        # Read until the server closes the connection
+        response = await reader.read()
+    finally:
+        writer.close()
+    return int(status_line.split()[1]), response
+
+
+async def send_request(host, port, ssl_context, path):
+    """Send one request on a new connection, returning (status, seconds until the whole response was read)."""
+    start = time.perf_counter()
+    status, _ = await fetch(host, port, ssl_context, path)
+    return status, time.perf_counter() - start
+
+
+async def scrape_metrics(host, port, ssl_context):
+    """
+    Queries run so far by each Neo4j server, and query plan cache hits and misses, from the app's
+    /metrics (per process).
+    """
+    try:
+        _, response = await fetch(host, port, ssl_context, '/metrics')
+    except OSError:
+        return {}, {}
+    text = response.decode('utf-8', 'replace')
+    queries_by_server = {server: float(value) for server, value in
+                         re.findall(r'^personatrace_queries_by_server_total\{server="([^"]*)"\} (\S+)$', text, re.M)}
+    plan_cache = {'hit': 0.0, 'miss': 0.0}
+    for result, value in re.findall(r'^personatrace_query_plan_cache_total\{query="[^"]*",result="([^"]*)"\} (\S+)$', text, re.M):
+        plan_cache[result] = plan_cache.get(result, 0.0) + float(value)
+    return queries_by_server, plan_cache
+
+
+async def run_clients(num_clients, host, port, ssl_context):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + args.duration
+
+    async def client(i):
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            try:
+                status, seconds = await asyncio.wait_for(send_request(host, port, ssl_context, path), args.timeout)
+            except (OSError, ssl.SSLError, IndexError, ValueError, asyncio.TimeoutError):
+                errors += 1
+                continue
+            if status == 200:
+                latencies.append(seconds)
+            else:
+                errors += 1
+
+    queries_before, plan_cache_before = await scrape_metrics(host, port, ssl_context)
+    start = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(num_clients)))
+    elapsed = time.perf_counter() - start
+    queries_after, plan_cache_after = await scrape_metrics(host, port, ssl_context)
+    plan_cache = {result: count - plan_cache_before.get(result, 0) for result, count in plan_cache_after.items()}
+    return {
+        'server': args.name,
+        'clients': num_clients,
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 2),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 1) if latencies else None,
+        'p99_ms': round(float(np.percentile(latencies, 99)) * 1000, 1) if latencies else None,
+        'queries_by_server': {server: int(count - queries_before.get(server, 0)) for server, count in sorted(queries_after.items())},
+        'plan_cache_hit_rate': round(plan_cache['hit'] / (plan_cache['hit'] + plan_cache['miss']), 3) if plan_cache and sum(plan_cache.values()) else None,
+    }
+
+
+async def run():
+    url = urlsplit(args.url)
+    ssl_context = make_ssl_context(args.url)
+    port = url.port or (443 if ssl_context else 80)
+    # Warm up the connection pool and the server's caches
+    for path in paths:
+        await send_request(url.hostname, port, ssl_context, path)
+    return [await run_clients(num_clients, url.hostname, port, ssl_context) for num_clients in args.clients]
+
+
+def main():
+    write_results('serving', asyncio.run(run()), args.output)
+
+
+if __name__ == '__main__':
+    main()
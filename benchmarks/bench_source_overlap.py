@@ -0,0 +1,56 @@
+#! /usr/bin/env python3
+'''
+Time the source x source shared identifier counts (dataloader --build_source_overlap_matrix) on
+synthetic observation -> identifier relationships, excluding the Neo4j reads and writes.
+
+    python benchmarks/bench_source_overlap.py --edges 1000000 10000000 --sources 50 500
+'''
+import argparse
+
+import numpy as np
+
+from bench_utils import use_component, timed, write_results
+
+parser = argparse.ArgumentParser(description='Benchmark the source overlap matrix')
+parser.add_argument('--edges', type=int, nargs='+', default=[1000000, 10000000], help='Numbers of observation -> identifier relationships to benchmark')
+parser.add_argument('--sources', type=int, nargs='+', default=[50, 500], help='Numbers of sources to benchmark')
+parser.add_argument('--seed', type=int, default=7, help='Random seed for the synthetic relationships')
+parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions (best is reported)')
+parser.add_argument('--output', type=str, help='Also write the JSON results to this file')
+args = parser.parse_args()
+
+use_component('dataloader', ['--build_source_overlap_matrix'])
+from lib.source_overlap import source_overlap_counts
+
+
+def make_edges(num_edges, num_sources, rng):
+    """
+    (identifier, source) of every relationship, where identifier popularity follows a Zipf
+    distribution and source sizes a geometric one, so a few large sources hold most observations.
+    """
+    identifiers = (rng.zipf(1.6, num_edges) - 1) % num_edges
+    sources = np.minimum(rng.geometric(4 / num_sources, num_edges) - 1, num_sources - 1)
+    return identifiers, sources
+
+
+def main():
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for num_edges in args.edges:
+        for num_sources in args.sources:
+            identifiers, sources = make_edges(num_edges, num_sources, rng)
+            matrix, seconds = timed(source_overlap_counts, identifiers, sources, num_sources, repeat=args.repeat)
+
+            results.append({
+                'edges': num_edges,
+                'sources': num_sources,
+                'overlapping_pairs': int(np.count_nonzero(np.triu(matrix, k=1))),
+                'seconds': round(seconds, 4),
+                'edges_per_second': round(num_edges / seconds),
+            })
+
+    write_results('source_overlap', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
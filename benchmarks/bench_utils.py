@@ -0,0 +1,49 @@
+#! /usr/bin/env python3
+'''
+Shared helpers for the PersonaTrace benchmarks.
+
+The app and the dataloader are separate projects that both have a top-level `lib` package and
+parse their command line arguments when lib.constants is imported, so a benchmark only ever
+imports from one component and hides its own arguments from that parser.
+'''
+import json
+import platform
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def use_component(component, component_args=None):
+    """Put app/ or dataloader/ (and common/, which both import) on sys.path and give its argument parser only component_args."""
+    sys.path.insert(0, str(REPO_ROOT / 'common'))
+    sys.path.insert(0, str(REPO_ROOT / component))
+    sys.argv = [sys.argv[0]] + list(component_args or [])
+
+
+def timed(fn, *args, repeat=1, **kwargs):
+    """Run fn repeat times and return (last result, best wall time in seconds)."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def write_results(benchmark, results, output=None):
+    """Print (and optionally save) benchmark results as JSON."""
+    report = {
+        'benchmark': benchmark,
+        'python': platform.python_version(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'results': results
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if output:
+        Path(output).write_text(text + '\n')
+    return report
@@ -0,0 +1,76 @@
+#! /usr/bin/env python3
+'''
+Time the ingest-time watchlist matching (dataloader --watchlist) per identifier, for watchlists of
+different sizes, to compare against the load throughput of process_batch.
+
+    python benchmarks/bench_watchlist.py --identifiers 1000000 --rules 100 10000
+'''
+import argparse
+import os
+import tempfile
+
+import numpy as np
+
+from bench_utils import use_component, timed, write_results
+
+parser = argparse.ArgumentParser(description='Benchmark watchlist matching')
+parser.add_argument('--identifiers', type=int, default=1000000, help='Number of identifiers to check')
+parser.add_argument('--rules', type=int, nargs='+', default=[100, 10000], help='Watchlist sizes to benchmark')
+parser.add_argument('--substring_fraction', type=float, default=0.1, help='Fraction of the rules that are substring rules')
+parser.add_argument('--seed', type=int, default=7, help='Random seed for the synthetic identifiers and rules')
+parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions (best is reported)')
+parser.add_argument('--output', type=str, help='Also write the JSON results to this file')
+args = parser.parse_args()
+
+use_component('dataloader', ['--example_data'])
+from lib.watchlist import Watchlist, ahocorasick
+
+
+def random_strings(rng, count, length):
+    letters = np.array(list('abcdefghijklmnopqrstuvwxyz0123456789'))
+    return [''.join(row) for row in letters[rng.integers(0, len(letters), size=(count, length))]]
+
+
+def make_identifier_rels(rng):
+    """Email-like identifier values, as process_batch emits them."""
+    values = [f'{name}@example.com' for name in random_strings(rng, args.identifiers, 12)]
+    return [{'start_id': str(i), 'end_label': 'email_address', 'end_val': value} for i, value in enumerate(values)]
+
+
+def check_all(watchlist, batch, identifier_rels):
+    return watchlist.check_batch(batch, identifier_rels)
+
+
+def main():
+    rng = np.random.default_rng(args.seed)
+    identifier_rels = make_identifier_rels(rng)
+    batch = [{'id': r['start_id'], 'source': 'bench'} for r in identifier_rels]
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for num_rules in args.rules:
+            num_substrings = int(num_rules * args.substring_fraction)
+            rules = [f'{name}@example.com' for name in random_strings(rng, num_rules - num_substrings, 12)]
+            rules += [f'*{name}*' for name in random_strings(rng, num_substrings, 6)]
+            watchlist_path = os.path.join(directory, f'watchlist_{num_rules}.txt')
+            with open(watchlist_path, 'w') as f:
+                f.write('\n'.join(rules) + '\n')
+
+            watchlist = Watchlist(watchlist_path, os.path.join(directory, 'alerts.ndjson'))
+            alerts, seconds = timed(check_all, watchlist, batch, identifier_rels, repeat=args.repeat)
+            watchlist.close()
+
+            results.append({
+                'identifiers': args.identifiers,
+                'rules': num_rules,
+                'substring_rules': num_substrings,
+                'substring_matcher': 'aho-corasick' if ahocorasick is not None else 'regex',
+                'alerts': alerts,
+                'seconds': round(seconds, 4),
+                'identifiers_per_second': round(args.identifiers / seconds),
+            })
+
+    write_results('watchlist', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#! /usr/bin/env python3
+'''
+Compare response size and encode/decode time of the regular JSON graph response against the
+compact columnar wire format (raw, gzip and - if installed - brotli) on synthetic graphs.
+
+    python benchmarks/bench_wire_format.py --nodes 1000 10000 50000
+'''
+import argparse
+import gzip
+import json
+import random
+
+from bench_utils import use_component, timed, write_results
+
+parser = argparse.ArgumentParser(description='Benchmark the compact graph wire format')
+parser.add_argument('--nodes', type=int, nargs='+', default=[1000, 10000, 50000], help='Graph sizes (node counts) to benchmark')
+parser.add_argument('--seed', type=int, default=7, help='Random seed for the synthetic graphs')
+parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions (best is reported)')
+parser.add_argument('--output', type=str, help='Also write the JSON results to this file')
+args = parser.parse_args()
+
+use_component('app')
+from modules.graph_wire_format import encode_compact_graph, decode_compact_graph, brotli
+
+IDENTIFIER_TYPES = ['email_address', 'ip_address', 'username', 'phone_number', 'address', 'full_name']
+STYLES = [{'background': f'#D8E6F{i}', 'border': f'#B8C6D{i}'} for i in range(len(IDENTIFIER_TYPES))]
+RELATIONSHIP_COLORS = {f'has_{t}': {'color': '#708090', 'width': 2, 'dashes': True} for t in IDENTIFIER_TYPES}
+RELATIONSHIP_COLORS['has_observation'] = {'color': '#C0C0C0', 'width': 1, 'dashes': False}
+
+
+def make_graph_data(num_nodes, rng):
+    """Build get_graph_data-shaped output: ~1/4 observations, a few sources, the rest identifiers."""
+    sources = [f'source_{i}' for i in range(max(2, num_nodes // 5000))]
+    num_observations = num_nodes // 4
+    nodes, relationships = [], []
+
+    def add_relationship(from_id, to_id, label):
+        style = RELATIONSHIP_COLORS[label]
+        relationships.append({
+            'id': f'e{len(relationships)}', 'from': from_id, 'to': to_id, 'label': label, 'title': label,
+            'color': style['color'], 'width': style['width'], 'dashes': style['dashes'],
+            'arrows': {'to': {'enabled': True, 'type': 'arrow'}}
+        })
+
+    for i, source in enumerate(sources):
+        element_id = f'4:bench:{i}'
+        nodes.append({'id': element_id, 'label': source, 'title': source, 'group': 'source',
+                      'color': {'background': '#FF8000', 'border': '#FF4500'}, 'num_observations': 0, 'is_shared': False,
+                      'properties': {'value': source, 'id': i, 'elementId': element_id, 'labels': ['source'], 'num_observations': 0},
+                      'borderWidth': 1})
+
+    identifier_ids = []
+    for i in range(len(sources), num_nodes - num_observations):
+        element_id = f'4:bench:{i}'
+        type_index = i % len(IDENTIFIER_TYPES)
+        count = 1 + int(rng.paretovariate(1.5)) if rng.random() < 0.3 else 1
+        value = f'{IDENTIFIER_TYPES[type_index]}-{i}@example.org'
+        label = f'{value}\n({count} obs)' if count > 1 else value
+        nodes.append({'id': element_id, 'label': label, 'title': value, 'group': IDENTIFIER_TYPES[type_index],
+                      'color': STYLES[type_index], 'num_observations': count, 'is_shared': count > 1,
+                      'properties': {'value': value, 'category': 'personal', 'type': IDENTIFIER_TYPES[type_index], 'id': i,
+                                     'elementId': element_id, 'labels': [IDENTIFIER_TYPES[type_index]], 'num_observations': count},
+                      'borderWidth': 1})
+        identifier_ids.append((element_id, IDENTIFIER_TYPES[type_index]))
+
+    for i in range(num_nodes - num_observations, num_nodes):
+        element_id = f'4:bench:{i}'
+        source = rng.choice(sources)
+        properties = {'value': f'00000000-0000-0000-0000-{i:012d}', 'source': source, 'observation_date': '2024-03-15',
+                      'metadata.city': 'Portland', 'metadata.state': 'OR', 'metadata.country': 'USA'}
+        tooltip = '\n'.join(f'{k}: {v}' for k, v in sorted(properties.items()))
+        nodes.append({'id': element_id, 'label': f"{source}: {properties['value']}", 'title': tooltip,
+                      'group': 'observation_of_identity', 'color': {'background': '#FFD700', 'border': '#DAA520'},
+                      'num_observations': 1, 'is_shared': False,
+                      'properties': {**properties, 'id': i, 'elementId': element_id, 'labels': ['observation_of_identity'], 'num_observations': 1},
+                      'borderWidth': 1})
+        add_relationship(f'4:bench:{sources.index(source)}', element_id, 'has_observation')
+        for identifier_id, identifier_type in rng.sample(identifier_ids, min(3, len(identifier_ids))):
+            add_relationship(element_id, identifier_id, f'has_{identifier_type}')
+
+    return {'nodes': nodes, 'relationships': relationships,
+            'metadata': {'nodeCount': len(nodes), 'relationshipCount': len(relationships), 'relationshipColors': RELATIONSHIP_COLORS}}
+
+
+def main():
+    rng = random.Random(args.seed)
+    results = []
+    for num_nodes in args.nodes:
+        data = make_graph_data(num_nodes, rng)
+
+        json_body, json_encode_time = timed(lambda: json.dumps(data, separators=(',', ':')).encode('utf-8'), repeat=args.repeat)
+        compact_body, compact_encode_time = timed(lambda: json.dumps(encode_compact_graph(data), separators=(',', ':')).encode('utf-8'), repeat=args.repeat)
+        _, json_decode_time = timed(json.loads, json_body, repeat=args.repeat)
+        _, compact_decode_time = timed(lambda: decode_compact_graph(json.loads(compact_body)), repeat=args.repeat)
+
+        result = {
+            'nodes': len(data['nodes']),
+            'relationships': len(data['relationships']),
+            'json_bytes': len(json_body),
+            'compact_bytes': len(compact_body),
+            'json_gzip_bytes': len(gzip.compress(json_body, compresslevel=6)),
+            'compact_gzip_bytes': len(gzip.compress(compact_body, compresslevel=6)),
+            'json_encode_seconds': round(json_encode_time, 4),
+            'compact_encode_seconds': round(compact_encode_time, 4),
+            'json_decode_seconds': round(json_decode_time, 4),
+            'compact_decode_seconds': round(compact_decode_time, 4),
+        }
+        if brotli is not None:
+            result['json_brotli_bytes'] = len(brotli.compress(json_body, quality=5))
+            result['compact_brotli_bytes'] = len(brotli.compress(compact_body, quality=5))
+        result['compact_size_ratio'] = round(result['compact_bytes'] / result['json_bytes'], 3)
+        results.append(result)
+
+    write_results('wire_format', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+#! /usr/bin/env python3
+'''
+Run the load and query benchmarks end to end and compare them with a stored baseline:
+
+    python benchmarks/run_suite.py --clear_graph --update_baseline   # once, on the reference commit
+    python benchmarks/run_suite.py --clear_graph --output results.json
+
+The ingest benchmark loads seeded synthetic observations into an emptied graph (so only point the
+suite at a scratch database, --neo4j_endpoint, --neo4j_username and --neo4j_password are passed
+on), and the query benchmarks then run on the loaded graph, so every run measures the same data.
+Each benchmark runs in its component's environment (uv run --project app|dataloader if uv is
+installed, else this interpreter). The offline benchmarks can be added with --benchmarks.
+
+With --backend memory the suite needs no Neo4j: the query benchmarks run on the app's in-memory
+graph of the same seeded observations (generated once into a temporary file), the ingest
+benchmark, which measures loading into Neo4j, is left out, and the baseline defaults to
+benchmarks/baseline_memory.json.
+
+The report has the results of every benchmark and the commit they were measured on. Each result
+is compared with the result at the same position in the baseline: a time (seconds, *_ms) more
+than --tolerance higher or a rate (*_per_second) more than --tolerance lower is a regression and
+the suite exits with 1. Results whose other values differ (e.g. node counts) are reported as
+changed, the baseline was probably measured on other data or arguments.
+'''
+import argparse
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bench_utils import REPO_ROOT
+
+# Component and script of each benchmark, and whether it runs against Neo4j
+BENCHMARKS = {
+    'ingest': ('dataloader', 'bench_ingest.py', True),
+    'queries': ('app', 'bench_queries.py', True),
+    'wire_format': ('app', 'bench_wire_format.py', False),
+    'layout': ('app', 'bench_layout.py', False),
+    'persona_clusters': ('dataloader', 'bench_persona_clusters.py', False),
+    'source_overlap': ('dataloader', 'bench_source_overlap.py', False),
+    'watchlist': ('dataloader', 'bench_watchlist.py', False),
+    'normalizers': ('dataloader', 'bench_normalizers.py', False),
+}
+
+parser = argparse.ArgumentParser(description='Run the benchmark suite and compare it with a baseline',
+                                 epilog='Other arguments (e.g. --neo4j_endpoint) are passed on to the Neo4j benchmarks')
+parser.add_argument('--benchmarks', type=str, nargs='+', choices=list(BENCHMARKS), help='Benchmarks to run, in order (default: ingest queries, queries with --backend memory)')
+parser.add_argument('--backend', type=str, choices=['neo4j', 'memory'], default='neo4j', help='Graph the query benchmarks run on')
+parser.add_argument('--observations', type=int, default=100000, help='Number of synthetic observations loaded by the ingest benchmark (or into the in-memory graph)')
+parser.add_argument('--seed', type=int, default=7, help='Seed of the synthetic observations')
+parser.add_argument('--clear_graph', action='store_true', help='Let the ingest benchmark delete the whole graph (required to run it)')
+parser.add_argument('--baseline', type=str, help='Baseline report to compare with (default: benchmarks/baseline.json, baseline_memory.json with --backend memory)')
+parser.add_argument('--update_baseline', action='store_true', help='Save this run as the baseline instead of comparing with it')
+parser.add_argument('--tolerance', type=float, default=0.2, help='Relative slowdown beyond which a result is a regression')
+parser.add_argument('--output', type=str, help='Also write the JSON report to this file')
+args, neo4j_args = parser.parse_known_args()
+if args.benchmarks is None:
+    args.benchmarks = ['queries'] if args.backend == 'memory' else ['ingest', 'queries']
+if args.baseline is None:
+    args.baseline = str(REPO_ROOT / 'benchmarks' / ('baseline_memory.json' if args.backend == 'memory' else 'baseline.json'))
+if 'ingest' in args.benchmarks and args.backend == 'memory':
+    parser.error('the ingest benchmark loads into Neo4j, it cannot run with --backend memory')
+if 'ingest' in args.benchmarks and not args.clear_graph:
+    parser.error('--clear_graph is required to run the ingest benchmark, it deletes the graph before loading')
+
+
+def git_commit():
+    """The checked out commit, with -dirty if there are uncommitted changes."""
+    def git(*command):
+        return subprocess.run(['git', '-C', str(REPO_ROOT), *command], capture_output=True, text=True).stdout.strip()
+    commit = git('rev-parse', '--short', 'HEAD') or None
+    return f'{commit}-dirty' if commit and git('status', '--porcelain', '--untracked-files=no') else commit
+
+
+def python_command(component, script):
+    """Command running script in component's environment."""
+    if shutil.which('uv'):
+        return ['uv', 'run', '--project', str(REPO_ROOT / component), 'python', str(script)]
+    return [sys.executable, str(script)]
+
+
+def benchmark_command(name, memory_graph_data=None):
+    component, script, uses_neo4j = BENCHMARKS[name]
+    command = python_command(component, REPO_ROOT / 'benchmarks' / script)
+    if name == 'ingest':
+        command += ['--clear_graph', '--observations', str(args.observations), '--seed', str(args.seed)]
+    if not uses_neo4j:
+        return command
+    if memory_graph_data:
+        return command + ['--graph_backend', 'memory', '--memory_graph_data', str(memory_graph_data)]
+    return command + neo4j_args
+
+
+def generate_observations(path):
+    """Write the seeded synthetic observations the ingest benchmark loads to path."""
+    print('Generating observations...', file=sys.stderr)
+    subprocess.run(python_command('dataloader', REPO_ROOT / 'dataloader' / 'generate_observations.py') +
+                   ['--observations', str(args.observations), '--seed', str(args.seed), '--output', str(path)],
+                   cwd=REPO_ROOT / 'dataloader', stdout=subprocess.DEVNULL, check=True)
+
+
+def run_benchmark(name, memory_graph_data=None):
+    """Run one benchmark in its component's directory, returning its JSON report."""
+    with tempfile.TemporaryDirectory() as directory:
+        output = Path(directory) / f'{name}.json'
+        print(f'Running {name}...', file=sys.stderr)
+        subprocess.run(benchmark_command(name, memory_graph_data) + ['--output', str(output)], cwd=REPO_ROOT / BENCHMARKS[name][0],
+                       stdout=subprocess.DEVNULL, check=True)
+        return json.loads(output.read_text())
+
+
+def run_benchmarks():
+    """Reports of args.benchmarks, on an in-memory graph of generated observations with --backend memory."""
+    if args.backend != 'memory':
+        return {name: run_benchmark(name) for name in args.benchmarks}
+    with tempfile.TemporaryDirectory() as directory:
+        memory_graph_data = Path(directory) / 'observations.json'
+        generate_observations(memory_graph_data)
+        return {name: run_benchmark(name, memory_graph_data) for name in args.benchmarks}
+
+
+def metric_direction(name):
+    """1 if a higher value of the metric is better, -1 if lower is, None if it isn't a metric."""
+    if name.endswith('_per_second'):
+        return 1
+    if name == 'seconds' or name.endswith('_seconds') or name.endswith('_ms'):
+        return -1
+    return None
+
+
+def compare(report, baseline):
+    """Regressions and changed results of report against baseline, as lines to print."""
+    regressions = []
+    changes = []
+    for name, benchmark in report['benchmarks'].items():
+        baseline_results = baseline.get('benchmarks', {}).get(name, {}).get('results', [])
+        for i, result in enumerate(benchmark['results']):
+            if i >= len(baseline_results):
+                changes.append(f'{name}[{i}]: not in the baseline')
+                continue
+            baseline_result = baseline_results[i]
+            values = {k: v for k, v in result.items() if metric_direction(k) is None}
+            baseline_values = {k: v for k, v in baseline_result.items() if metric_direction(k) is None}
+            if values != baseline_values:
+                changes.append(f'{name}[{i}]: {baseline_values} -> {values}')
+            for metric, value in result.items():
+                direction = metric_direction(metric)
+                previous = baseline_result.get(metric)
+                if direction is None or not value or not previous:
+                    continue
+                # Relative change, positive when worse
+                worse = (previous - value) / previous if direction > 0 else (value - previous) / previous
+                if worse > args.tolerance:
+                    regressions.append(f'{name}[{i}] {metric}: {previous} -> {value} ({worse:+.0%} worse) {values}')
+    return regressions, changes
+
+
+def main():
+    report = {
+        'commit': git_commit(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'backend': args.backend,
+        'benchmarks': run_benchmarks(),
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text + '\n')
+
+    if args.update_baseline:
+        Path(args.baseline).write_text(text + '\n')
+        print(f'Saved the baseline of {report["commit"]} to {args.baseline}', file=sys.stderr)
+        return 0
+    if not Path(args.baseline).exists():
+        print(f'No baseline at {args.baseline}, save one with --update_baseline', file=sys.stderr)
+        return 0
+
+    baseline = json.loads(Path(args.baseline).read_text())
+    regressions, changes = compare(report, baseline)
+    print(f'Compared with the baseline of {baseline.get("commit")} (tolerance {args.tolerance:.0%})', file=sys.stderr)
+    for line in changes:
+        print(f'Changed: {line}', file=sys.stderr)
+    for line in regressions:
+        print(f'Regression: {line}', file=sys.stderr)
+    if not regressions:
+        print('No regressions', file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,18 @@
+'''
+Labels and relationship types of the graph that the data loader (which creates them) and the app
+(which reads them) have to agree on. Both components re-export them from their lib.constants.
+'''
+# Observations and their sources, every other label is the type of an identifier. Every relationship
+# of the loaded data has an observation at one end: source -> observation -> identifier
+OBSERVATION_LABEL = 'observation_of_identity'
+SOURCE_LABEL = 'source'
+
+# Labels that are never treated as identifiers: never matched, shared or counted as overlaps
+NON_IDENTIFIER_LABELS = frozenset({OBSERVATION_LABEL, SOURCE_LABEL})
+
+# Relationships derived from the loaded data by the data loader: the shares_identifiers overlap
+# projection between observations and the source_overlap matrix between sources. They are excluded
+# from the displayed graph and from traversals that expect the original data
+SHARES_IDENTIFIERS = 'shares_identifiers'
+SOURCE_OVERLAP = 'source_overlap'
+DERIVED_RELATIONSHIP_TYPES = [SHARES_IDENTIFIERS, SOURCE_OVERLAP]
@@ -0,0 +1,151 @@
+'''
+Identifier value normalization, shared by the data loader and the app.
+
+The same identifier is often written differently by different sources, e.g. John.Smith@Email.com
+and john.smith@email.com, or +1 503-555-1234 and +15035551234. With --normalize_identifiers every
+identifier value is rewritten to a canonical form before it is merged, so both spellings end up on
+one node whose value can be matched exactly (and through the value index) instead of with a
+case-insensitive contains search. The value as it was observed is kept on the relationship from
+the observation as raw_value whenever it differs.
+
+The app normalizes the values it searches for and bulk matches with the same normalizers when
+it serves a graph loaded with --normalize_identifiers, so an exact search for either spelling
+is an index lookup of the canonical value.
+
+Normalizers are looked up by identifier label (e.g. email_address), then by schema group (e.g.
+names, whose labels are dynamic and only known to the data loader). To normalize another type,
+add its function to default_normalizers. A normalizer takes a string and returns its canonical
+form, and should return the value unchanged rather than raise when it can't parse it.
+'''
+from functools import lru_cache, partial
+import ipaddress
+import logging
+import re
+import unicodedata
+
+logger = logging.getLogger('personatrace.normalizers')
+
+# phonenumbers is optional - fall back to a digits-only E.164 approximation when it isn't installed
+try:
+    import phonenumbers
+except ImportError:
+    phonenumbers = None
+
+# Number of distinct values cached per normalizer, identifiers such as IP addresses repeat a lot
+NORMALIZER_CACHE_SIZE = 2 ** 18
+
+# Labels whose canonical form is the same whatever the case of the value, so a case insensitive
+# exact search of them is an exact search of the canonical value
+CASE_INSENSITIVE_LABELS = frozenset({'email_address', 'phone_number', 'ip_address'})
+
+NON_DIGITS = re.compile(r'\D')
+
+
+def normalize_email(value):
+    """Lowercase the address and encode an internationalized domain to its ASCII (IDNA) form."""
+    value = value.strip().lower()
+    local, at, domain = value.rpartition('@')
+    if not at or not local or not domain:
+        return value
+    try:
+        domain = domain.encode('idna').decode('ascii')
+    except UnicodeError:
+        pass
+    return f'{local}@{domain}'
+
+
+def normalize_phone(value, default_country_code=''):
+    """
+    Format a phone number as E.164 (+15035551234).
+
+    Numbers without an international prefix (+ or 00) are assumed to be in default_country_code
+    (a calling code such as 1 or 44) and are left as digits if it isn't given.
+    """
+    value = value.strip()
+    if phonenumbers is not None:
+        region = phonenumbers.region_code_for_country_code(int(default_country_code)) if default_country_code else None
+        try:
+            number = phonenumbers.parse(value, region)
+            return phonenumbers.format_number(number, phonenumbers.PhoneNumberFormat.E164)
+        except phonenumbers.NumberParseException:
+            pass
+
+    digits = NON_DIGITS.sub('', value)
+    if not digits:
+        return value
+    if value.startswith('+'):
+        return f'+{digits}'
+    if digits.startswith('00'):
+        return f'+{digits[2:]}'
+    if default_country_code:
+        # Drop the national trunk prefix, e.g. 07700 900123 in the UK is +44 7700 900123
+        return f'+{default_country_code}{digits[1:] if digits.startswith("0") else digits}'
+    return digits
+
+
+def normalize_ip(value):
+    """Canonical IPv4 and compressed lowercase IPv6 form, e.g. 2001:DB8:0:0::1 is 2001:db8::1."""
+    value = value.strip()
+    try:
+        return str(ipaddress.ip_address(value))
+    except ValueError:
+        return value
+
+
+def normalize_name(value):
+    """Unicode NFKC with runs of whitespace collapsed to one space, case is kept."""
+    return ' '.join(unicodedata.normalize('NFKC', value).split())
+
+
+# Keys of default_normalizers that are schema groups, whose labels are dynamic, rather than labels
+SCHEMA_GROUPS = frozenset({'names'})
+
+
+def default_normalizers(default_country_code=''):
+    """Normalizers by identifier label or schema group (see NODE_SCHEMAS)."""
+    return {
+        'email_address': normalize_email,
+        'phone_number': partial(normalize_phone, default_country_code=default_country_code),
+        'ip_address': normalize_ip,
+        'names': normalize_name,
+    }
+
+
+class IdentifierNormalizer:
+    """Cached per-type normalization of the identifier values of a load."""
+
+    def __init__(self, normalizers, cache_size=NORMALIZER_CACHE_SIZE):
+        self._normalizers = {key: lru_cache(maxsize=cache_size)(function) for key, function in normalizers.items()}
+        self.num_changed = 0
+        logger.info(f"Normalizing identifier values of {sorted(normalizers)}")
+
+    def normalize(self, schema_key, label, value):
+        """Canonical form of an identifier value of the given schema group (None if unknown) and label."""
+        if not isinstance(value, str):
+            return value
+        normalizer = self._normalizers.get(label) or self._normalizers.get(schema_key)
+        if normalizer is None:
+            return value
+        canonical = normalizer(value)
+        if canonical != value:
+            self.num_changed += 1
+        return canonical
+
+    def candidates(self, label, value):
+        """
+        Values an identifier of label (any label if None) searched for as value may be stored as.
+
+        That's the canonical form of a label with a normalizer, otherwise the value itself and its
+        canonical form in each schema group (only the data loader knows the group of a dynamic label)
+        or, for any label, in each normalized label and group.
+        """
+        if not isinstance(value, str):
+            return [value]
+        if label in self._normalizers:
+            return [self._normalizers[label](value)]
+        keys = [key for key in self._normalizers if key in SCHEMA_GROUPS] if label else list(self._normalizers)
+        return list(dict.fromkeys([value] + [self._normalizers[key](value) for key in keys]))
+
+    def cache_info(self):
+        """Cache statistics per normalizer, to check the hit rate of a load."""
+        return {key: normalizer.cache_info()._asdict() for key, normalizer in self._normalizers.items()}
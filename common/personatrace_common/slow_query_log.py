@@ -0,0 +1,88 @@
+'''
+Slow query log entries, shared by the data loader and the app.
+
+Both write slow queries to a rotating JSON lines log, one entry per query with its Cypher text,
+redacted parameters (identifier values are replaced by their type and size, UNWIND batches by
+their length and first item), latency, rows and plan. How queries are timed and planned is up to
+the caller: the loader EXPLAINs its write queries inline, the app plans read queries on a
+background thread.
+'''
+from datetime import datetime, timezone
+import json
+import logging
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+
+def redact_parameters(parameters, keep=frozenset()):
+    """
+    Query parameters with identifier values replaced by their type and size, e.g. <str:14>.
+
+    Parameters named in keep (that never hold identifier values), numbers and booleans (hops,
+    limits, thresholds) are kept, lists are summarized by their length and first (redacted) item
+    so huge UNWIND batches stay readable.
+    """
+    def redact(key, value):
+        if key in keep or value is None or isinstance(value, (bool, int, float)):
+            return value
+        if isinstance(value, str):
+            return f'<str:{len(value)}>'
+        if isinstance(value, (list, tuple)):
+            return {'length': len(value), 'first': redact(key, value[0])} if value else []
+        if isinstance(value, dict):
+            return {k: redact(k, v) for k, v in value.items()}
+        return f'<{type(value).__name__}>'
+
+    return {key: redact(key, value) for key, value in (parameters or {}).items()}
+
+
+def simplify_plan(plan):
+    """Operator tree of an EXPLAIN / PROFILE plan with its estimated rows, and rows and db hits when profiled."""
+    if not plan:
+        return None
+    arguments = plan.get('args') or plan.get('arguments') or {}
+    return {
+        'operator': plan.get('operatorType'),
+        'details': arguments.get('Details'),
+        'estimatedRows': arguments.get('EstimatedRows'),
+        'rows': plan.get('rows'),
+        'dbHits': plan.get('dbHits'),
+        'children': [simplify_plan(child) for child in plan.get('children', [])],
+    }
+
+
+def total_db_hits(plan):
+    """Db hits of every operator of a PROFILE plan."""
+    if not plan:
+        return None
+    return (plan.get('dbHits') or 0) + sum(total_db_hits(child) or 0 for child in plan.get('children', []))
+
+
+def slow_query_entry(query, parameters, seconds, rows, caller, keep=frozenset()):
+    """Log entry of a slow query, the plan is added by the caller."""
+    return {
+        'recorded_at': datetime.now(timezone.utc).isoformat(),
+        'caller': caller,
+        'query': ' '.join(str(query).split()),
+        'parameters': redact_parameters(parameters, keep),
+        'seconds': round(seconds, 4),
+        'rows': rows,
+    }
+
+
+class JsonLinesLog:
+    """Rotating JSON lines file, rotated at max_bytes keeping backups old files."""
+
+    def __init__(self, path, max_bytes, backups, name='personatrace.slow_queries'):
+        self.path = path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._log = logging.getLogger(name)
+        self._log.propagate = False
+        self._log.setLevel(logging.INFO)
+        if not self._log.handlers:
+            handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self._log.addHandler(handler)
+
+    def write(self, entry):
+        self._log.info(json.dumps(entry, default=str))
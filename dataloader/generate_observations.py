@@ -0,0 +1,259 @@
+#! /usr/bin/env python3
+'''
+Generate synthetic observations in the observation_schema.json shape, one JSON object per line,
+for load and query benchmarks at scale:
+
+    python generate_observations.py --observations 10000000 --output data/synthetic/observations.json.gz
+    uv run load_data.py --live_data --live_data_folder data/synthetic
+
+Identifier values are drawn from a bounded Zipf distribution per identifier type, so most values
+are seen once or a few times and a few are shared by many observations (hubs), as in real data.
+--zipf_exponent sets how skewed the reuse is (closer to 1 and above gives bigger hubs) and
+--identifier_pool the number of distinct values each type draws from. Sources are also picked
+with skewed weights, dates uniformly within --start_date + --days.
+
+Observations are generated in chunks on --workers processes, with all random draws of a chunk
+made at once with NumPy, and each chunk's random stream seeded by --seed and the chunk's
+position, so the output only depends on the arguments, not on the number of workers. With a
+.gz output each chunk is compressed by its worker as a gzip member of the file.
+'''
+import argparse
+import gzip
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+# Identifier types, the nodes section they belong to and their share of the identifiers by default
+IDENTIFIER_TYPES = {
+    'email_address': 'online_identifiers',
+    'phone_number': 'online_identifiers',
+    'username': 'online_identifiers',
+    'ip_address': 'online_identifiers',
+    'address': 'location_identifiers',
+    'geo_location': 'location_identifiers',
+    'full_name': 'names',
+    'passport': 'identity_documents',
+    'state_id': 'identity_documents',
+}
+DEFAULT_IDENTIFIER_MIX = 'email_address=0.3,phone_number=0.2,username=0.15,ip_address=0.15,address=0.07,geo_location=0.03,full_name=0.06,passport=0.02,state_id=0.02'
+SECTIONS = ['names', 'online_identifiers', 'location_identifiers', 'identity_documents']
+
+DOMAINS = ['email.com', 'mail.net', 'inbox.org', 'post.io', 'example.com']
+CATEGORIES = ['personal', 'work', 'home', 'mobile']
+FIRST_NAMES = ['James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael', 'Linda', 'William', 'Elizabeth',
+               'David', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Charles', 'Karen']
+LAST_NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+              'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson', 'Martin']
+STREETS = ['Main St', 'Oak Ave', 'Pine St', 'Maple Ave', 'Cedar Ln', 'Elm St', 'Lake Dr', 'Hill Rd']
+ISSUERS = ['USA', 'GBR', 'CAN', 'DEU', 'FRA', 'OR', 'CA', 'NY']
+CITIES = [('Portland', 'OR'), ('Seattle', 'WA'), ('Austin', 'TX'), ('Denver', 'CO'), ('Boston', 'MA'), ('Chicago', 'IL')]
+# Metadata fields, each given to an observation with probability --metadata_fields / their number
+METADATA_FIELDS = ['date_of_birth', 'age', 'gender', 'nationality', 'languages', 'eye_color', 'hair_color',
+                   'city', 'state', 'country', 'companies', 'schools', 'relationships']
+
+parser = argparse.ArgumentParser(description='Generate synthetic PersonaTrace observations')
+parser.add_argument('--observations', type=int, help='Number of observations to generate', default=1000000)
+parser.add_argument('--output', type=str, help='Output file, gzip compressed if it ends with .gz, - for stdout', default='-')
+parser.add_argument('--seed', type=int, help='Random seed, the same arguments always generate the same file', default=7)
+parser.add_argument('--sources', type=int, help='Number of sources', default=20)
+parser.add_argument('--source_skew', type=float, help='Sources are picked with weight 1 / rank^source_skew (0 for uniform)', default=1.0)
+parser.add_argument('--identifiers_per_observation', type=float, help='Average identifiers per observation (Poisson, at least 1)', default=4)
+parser.add_argument('--identifier_mix', type=str, help='Comma separated type=weight shares of the identifier types', default=DEFAULT_IDENTIFIER_MIX)
+parser.add_argument('--zipf_exponent', type=float, help='Exponent of the Zipf distribution of identifier reuse, higher gives bigger hubs', default=0.8)
+parser.add_argument('--identifier_pool', type=float, help='Distinct values of each identifier type, as a fraction of the identifiers of that type generated', default=1.0)
+parser.add_argument('--metadata_fields', type=float, help='Average number of metadata fields per observation (at most 13)', default=3)
+parser.add_argument('--start_date', type=str, help='First observation date (YYYY-MM-DD)', default='2020-01-01')
+parser.add_argument('--days', type=int, help='Observation dates are spread over this many days from --start_date', default=1826)
+parser.add_argument('--chunk_size', type=int, help='Observations generated per chunk', default=100000)
+parser.add_argument('--workers', type=int, help='Processes generating chunks (default: CPU count)', default=os.cpu_count() or 1)
+parser.add_argument('--compress_level', type=int, help='gzip compression level of a .gz output', default=1)
+args = parser.parse_args()
+
+
+def parse_identifier_mix(mix):
+    """{type: share} of a type=weight,... string, the shares summing to 1."""
+    weights = {}
+    for item in mix.split(','):
+        if not item.strip():
+            continue
+        identifier_type, weight = item.split('=')
+        if identifier_type.strip() not in IDENTIFIER_TYPES:
+            raise ValueError(f"Unknown identifier type {identifier_type}, expected one of {', '.join(IDENTIFIER_TYPES)}")
+        weights[identifier_type.strip()] = float(weight)
+    total = sum(weights.values())
+    if total <= 0:
+        raise ValueError("The identifier mix needs a positive weight")
+    return {identifier_type: weight / total for identifier_type, weight in weights.items()}
+
+
+def bounded_zipf(rng, exponent, pool_sizes):
+    """
+    One value index in [0, pool_size) per entry of pool_sizes, index k drawn with probability
+    proportional to 1 / (k + 1)^exponent, by inverting the continuous Zipf CDF (vectorized).
+    """
+    u = rng.random(len(pool_sizes))
+    upper = pool_sizes.astype(np.float64) + 1
+    if abs(exponent - 1) < 1e-9:
+        x = np.power(upper, u)
+    else:
+        power = 1 - exponent
+        x = np.power(1 + u * (np.power(upper, power) - 1), 1 / power)
+    return np.minimum(x.astype(np.int64) - 1, pool_sizes - 1)
+
+
+def _scramble(indexes):
+    """Spread value indexes below 2^32 over 32 bits (a bijection), so the hubs aren't the lowest values."""
+    return (indexes.astype(np.uint64) * np.uint64(2654435761) + np.uint64(12345)) % np.uint64(2 ** 32)
+
+
+def format_identifiers(identifier_type, indexes):
+    """JSON objects (as strings) of the identifiers of identifier_type with the given value indexes."""
+    ks = indexes.tolist()
+    if identifier_type == 'email_address':
+        return [f'{{"type":"email_address","value":"user{k}@{DOMAINS[k % 5]}","category":"{CATEGORIES[k % 2]}"}}' for k in ks]
+    if identifier_type == 'phone_number':
+        return [f'{{"type":"phone_number","value":"+1{2000000000 + k % 8000000000}","category":"{CATEGORIES[3 - k % 2]}"}}' for k in ks]
+    if identifier_type == 'username':
+        return [f'{{"type":"username","value":"user_{k}","category":"{CATEGORIES[k % 2]}"}}' for k in ks]
+    if identifier_type == 'ip_address':
+        ips = _scramble(indexes).tolist()
+        return [f'{{"type":"ip_address","value":"{ip >> 24}.{(ip >> 16) & 255}.{(ip >> 8) & 255}.{ip & 255}","category":"{CATEGORIES[2 - ip % 2]}"}}' for ip in ips]
+    if identifier_type == 'address':
+        return [f'{{"type":"address","value":"{k % 9999 + 1} {STREETS[k % 8]} #{k // 9999}, {CITIES[k % 6][0]}, {CITIES[k % 6][1]}","category":"home"}}' for k in ks]
+    if identifier_type == 'geo_location':
+        points = _scramble(indexes).tolist()
+        return [f'{{"type":"geo_location","value":"{(p >> 16) / 65536 * 180 - 90:.5f},{(p & 65535) / 65536 * 360 - 180:.5f}","category":"home"}}' for p in points]
+    if identifier_type == 'full_name':
+        return [f'{{"type":"full_name","value":"{FIRST_NAMES[k % 20]} {LAST_NAMES[(k // 20) % 20]}{"" if k < 400 else f" {k // 400}"}"}}' for k in ks]
+    if identifier_type == 'passport':
+        return [f'{{"type":"passport","value":"P{k:09d}","issuer":"{ISSUERS[k % 5]}"}}' for k in ks]
+    return [f'{{"type":"state_id","value":"S{k:09d}","issuer":"{ISSUERS[5 + k % 3]}"}}' for k in ks]
+
+
+def join_groups(strings, groups, num_groups):
+    """
+    The strings of each group joined with commas, '' for groups without any, given the strings
+    and their group (both in any order).
+    """
+    order = np.argsort(groups, kind='stable')
+    strings = np.asarray(strings, dtype=object)[order].tolist()
+    sorted_groups = groups[order]
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]]) if len(groups) else np.array([], dtype=np.int64)
+    ends = np.r_[starts[1:], len(groups)].astype(np.int64)
+    joined = [''] * num_groups
+    for group, start, end in zip(sorted_groups[starts].tolist(), starts.tolist(), ends.tolist()):
+        joined[group] = strings[start] if end - start == 1 else ','.join(strings[start:end])
+    return joined
+
+
+def format_metadata(rng, num_observations, num_fields):
+    """The metadata object (as a string) of each observation, with num_fields fields on average."""
+    formats = {
+        'date_of_birth': lambda v: f'"date_of_birth":"{1940 + v % 65}-{1 + v % 12:02d}-{1 + v % 28:02d}"',
+        'age': lambda v: f'"age":{18 + v % 70}',
+        'gender': lambda v: f'"gender":"{("female", "male", "other")[v % 3]}"',
+        'nationality': lambda v: f'"nationality":"{ISSUERS[v % 5]}"',
+        'languages': lambda v: f'"languages":["{("English", "Spanish", "French", "German")[v % 4]}"]',
+        'eye_color': lambda v: f'"eye_color":"{("brown", "blue", "green", "hazel")[v % 4]}"',
+        'hair_color': lambda v: f'"hair_color":"{("black", "brown", "blond", "red", "gray")[v % 5]}"',
+        'city': lambda v: f'"city":"{CITIES[v % 6][0]}"',
+        'state': lambda v: f'"state":"{CITIES[v % 6][1]}"',
+        'country': lambda v: '"country":"USA"',
+        'companies': lambda v: f'"companies":[{{"name":"Company {v % 5000}","start_date":"{2000 + v % 20}-01-01","end_date":"{2020 + v % 5}-12-31"}}]',
+        'schools': lambda v: f'"schools":[{{"name":"School {v % 2000}","start_date":"{1990 + v % 20}-09-01","end_date":"{1994 + v % 20}-06-30"}}]',
+        'relationships': lambda v: f'"relationships":[{{"type":"{("spouse", "sibling", "parent", "friend")[v % 4]}","name":"{FIRST_NAMES[v % 20]} {LAST_NAMES[(v // 20) % 20]}"}}]',
+    }
+    # Only the fields given to an observation are formatted, field by field
+    included = rng.random((len(METADATA_FIELDS), num_observations)) < min(num_fields / len(METADATA_FIELDS), 1)
+    fields = []
+    owners = []
+    for field, field_included in zip(METADATA_FIELDS, included):
+        positions = np.flatnonzero(field_included)
+        fields.extend(map(formats[field], rng.integers(0, 1 << 30, len(positions)).tolist()))
+        owners.append(positions)
+    return join_groups(fields, np.concatenate(owners), num_observations)
+
+
+def generate_chunk(chunk_index, num_observations, setup):
+    """The lines of one chunk of observations, the chunk_index-th of the output."""
+    types, shares, pool_sizes, sources, source_weights = setup
+    rng = np.random.default_rng([args.seed, chunk_index])
+    first_index = chunk_index * args.chunk_size
+
+    counts = np.maximum(rng.poisson(args.identifiers_per_observation, num_observations), 1)
+    owners = np.repeat(np.arange(num_observations), counts)
+    identifier_types = rng.choice(len(types), len(owners), p=shares)
+    indexes = bounded_zipf(rng, args.zipf_exponent, pool_sizes[identifier_types])
+
+    # Identifier JSON objects joined by observation and nodes section
+    type_sections = np.array([SECTIONS.index(IDENTIFIER_TYPES[identifier_type]) for identifier_type in types])
+    formatted = np.empty(len(owners), dtype=object)
+    for type_index, identifier_type in enumerate(types):
+        positions = np.flatnonzero(identifier_types == type_index)
+        formatted[positions] = format_identifiers(identifier_type, indexes[positions])
+    nodes = join_groups(formatted, owners * len(SECTIONS) + type_sections[identifier_types], num_observations * len(SECTIONS))
+
+    observation_sources = rng.choice(len(sources), num_observations, p=source_weights).tolist()
+    dates = (np.datetime64(args.start_date) + rng.integers(0, max(args.days, 1), num_observations)).astype(str).tolist()
+    metadata = format_metadata(rng, num_observations, args.metadata_fields)
+
+    id_prefix = f'{args.seed & 0xffffffff:08x}-0000-4000-8000-'
+    lines = [
+        f'{{"node_type":"observation_of_identity","id":"{id_prefix}{first_index + i:012x}",'
+        f'"source":"{sources[source]}","observation_date":"{date}",'
+        f'"nodes":{{"names":[{names}],"online_identifiers":[{online}],"location_identifiers":[{locations}],"identity_documents":[{documents}]}},'
+        f'"metadata":{{{observation_metadata}}}}}\n'
+        for i, source, date, names, online, locations, documents, observation_metadata in
+        zip(range(num_observations), observation_sources, dates, nodes[0::4], nodes[1::4], nodes[2::4], nodes[3::4], metadata)
+    ]
+    return ''.join(lines).encode('utf-8')
+
+
+def _generate(job):
+    chunk_index, num_observations, setup, compress = job
+    data = generate_chunk(chunk_index, num_observations, setup)
+    # Concatenated gzip members are one valid gzip file
+    return gzip.compress(data, compresslevel=args.compress_level, mtime=0) if compress else data
+
+
+def main():
+    mix = parse_identifier_mix(args.identifier_mix)
+    types = list(mix)
+    shares = np.array([mix[identifier_type] for identifier_type in types])
+    expected_identifiers = args.observations * args.identifiers_per_observation * shares
+    pool_sizes = np.maximum((expected_identifiers * args.identifier_pool).astype(np.int64), 1)
+    sources = [f'source_{i:03d}' for i in range(1, args.sources + 1)]
+    source_weights = 1 / np.arange(1, args.sources + 1) ** args.source_skew
+    setup = (types, shares, pool_sizes, sources, source_weights / source_weights.sum())
+
+    compress = args.output.endswith('.gz')
+    jobs = [(chunk_index, min(args.chunk_size, args.observations - first), setup, compress)
+            for chunk_index, first in enumerate(range(0, args.observations, args.chunk_size))]
+    if args.output != '-' and os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    output = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+
+    start = time.perf_counter()
+    last_report = start
+    generated = 0
+    try:
+        with Pool(max(args.workers, 1)) as pool:
+            # In order, so the file is the same whatever the number of workers
+            for job, data in zip(jobs, pool.imap(_generate, jobs)):
+                output.write(data)
+                generated += job[1]
+                now = time.perf_counter()
+                if now - last_report >= 5 or generated == args.observations:
+                    last_report = now
+                    print(f"Generated {generated:,} of {args.observations:,} observations "
+                          f"({generated / (now - start):,.0f}/s)", file=sys.stderr)
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -7,7 +7,7 @@ parser = argparse.ArgumentParser(description='Load data into graph database')
 # Data source
 ########################################################
 # Data source
-group = parser.add_mutually_exclusive_group(required=True)
+group = parser.add_mutually_exclusive_group()
 group.add_argument('--example_data', action='store_true', help='Load example data')
 group.add_argument('--live_data', action='store_true', help='Load live data')
 # Other arguments
@@ -20,7 +20,38 @@ parser.add_argument('--batch_size', type=int, help='Batch size of observations t
 parser.add_argument('--deletion_batch_size', type=int, help='Batch size for deletion operations', default=50000)
 parser.add_argument('--example_data_folder', type=str, help='Full folder path for example data if not in data/example_data')
 parser.add_argument('--live_data_folder', type=str, help='Full folder path for live data if not in data/live_data')
+# Persona clusters
+parser.add_argument('--build_persona_clusters', action='store_true', help='Compute persona clusters (persona_id, persona_size on observations) after loading, or on their own without a data source')
+parser.add_argument('--persona_hub_threshold', type=int, help='Identifiers shared by more observations than this are ignored when building persona clusters (0 for no limit)', default=1000)
+parser.add_argument('--persona_excluded_labels', type=str, help='Comma separated identifier labels ignored when building persona clusters, e.g. city,country', default='')
+parser.add_argument('--persona_store', type=str, help='SQLite file holding the persona clusters, when given they are updated incrementally while loading')
+# Observation overlap projection
+parser.add_argument('--build_overlap_projection', action='store_true', help='Rebuild the shares_identifiers relationships between observations after loading, or on their own without a data source')
+parser.add_argument('--maintain_overlap_projection', action='store_true', help='Create the shares_identifiers relationships of new observations while loading')
+parser.add_argument('--overlap_hub_threshold', type=int, help='Identifiers shared by more observations than this are ignored by the overlap projection (0 for no limit)', default=1000)
+parser.add_argument('--overlap_excluded_labels', type=str, help='Comma separated identifier labels ignored by the overlap projection, e.g. city,country', default='')
+# Source overlap matrix
+parser.add_argument('--build_source_overlap_matrix', action='store_true', help='Count the identifiers shared by every pair of sources (source_overlap relationships) after loading, or on their own without a data source')
+parser.add_argument('--source_overlap_excluded_labels', type=str, help='Comma separated identifier labels not counted by the source overlap matrix, e.g. city,country', default='')
+# Watchlist
+parser.add_argument('--watchlist', type=str, help='Watchlist file (one identifier, or *substring*, per line) to check every loaded identifier against')
+parser.add_argument('--watchlist_alerts', type=str, help='NDJSON file watchlist matches are appended to if not data/watchlist_alerts.ndjson')
+# Identifier normalization
+parser.add_argument('--normalize_identifiers', action='store_true', help='Merge identifiers on a canonical value (lowercased emails, E.164 phone numbers, canonical IP addresses, NFKC names)')
+parser.add_argument('--default_phone_country_code', type=str, help='Calling code (e.g. 1 or 44) of phone numbers without an international prefix when normalizing', default='')
+# Ingest profiling
+parser.add_argument('--ingest_report', type=str, help='JSON file the per-stage timings and counters of the load are written to if not data/ingest_reports/ingest_report_<time>.json')
+parser.add_argument('--profile', type=str, choices=['cprofile', 'py-spy'], help='Profile the whole load with cProfile or py-spy (sampling, if installed)')
+parser.add_argument('--profile_output', type=str, help='File the profile is written to if not data/ingest_reports/profile_<time>.prof (cProfile) or .json (py-spy)')
+# Slow query log
+parser.add_argument('--slow_query_threshold', type=float, help='Queries taking longer than this many seconds are recorded to the slow query log with their EXPLAIN plan (0 to disable)', default=30.0)
+parser.add_argument('--slow_query_log', type=str, help='Slow query log file if not data/slow_queries.log')
+# Causal consistency with the app
+parser.add_argument('--load_bookmarks', type=str, help='File the bookmarks of the load are written to once it has committed, for the app to read from replicas that have caught up with it, if not data/load_bookmarks.json')
 args = parser.parse_args()
+# A data source is required unless only derived data is built
+if not (args.example_data or args.live_data or args.build_persona_clusters or args.build_overlap_projection or args.build_source_overlap_matrix):
+    parser.error('one of the arguments --example_data --live_data --build_persona_clusters --build_overlap_projection --build_source_overlap_matrix is required')
 ########################################################
 # Neo4j configuration
 ########################################################
@@ -33,6 +64,25 @@ NEO4J_PASSWORD = args.neo4j_password
 BATCH_SIZE = args.batch_size
 DELETION_BATCH_SIZE = args.deletion_batch_size
 ########################################################
+# Persona clusters
+########################################################
+BUILD_PERSONA_CLUSTERS = args.build_persona_clusters
+PERSONA_HUB_THRESHOLD = args.persona_hub_threshold
+PERSONA_EXCLUDED_LABELS = [label.strip() for label in args.persona_excluded_labels.split(',') if label.strip()]
+PERSONA_STORE_FILE = args.persona_store
+########################################################
+# Observation overlap projection
+########################################################
+BUILD_OVERLAP_PROJECTION = args.build_overlap_projection
+MAINTAIN_OVERLAP_PROJECTION = args.maintain_overlap_projection
+OVERLAP_HUB_THRESHOLD = args.overlap_hub_threshold
+OVERLAP_EXCLUDED_LABELS = [label.strip() for label in args.overlap_excluded_labels.split(',') if label.strip()]
+########################################################
+# Source overlap matrix
+########################################################
+BUILD_SOURCE_OVERLAP_MATRIX = args.build_source_overlap_matrix
+SOURCE_OVERLAP_EXCLUDED_LABELS = [label.strip() for label in args.source_overlap_excluded_labels.split(',') if label.strip()]
+########################################################
 # Folder paths
 ########################################################
 from pathlib import Path
@@ -40,6 +90,37 @@ DATA_FOLDER = Path(__file__).parent.parent / "data"
 EXAMPLE_DATA_FOLDER = args.example_data_folder if args.example_data_folder else f"{DATA_FOLDER}/example_data"
 LIVE_DATA_FOLDER = args.live_data_folder if args.live_data_folder else f"{DATA_FOLDER}/live_data"
 ########################################################
+# Watchlist
+########################################################
+WATCHLIST_FILE = args.watchlist
+WATCHLIST_ALERTS_FILE = args.watchlist_alerts if args.watchlist_alerts else f"{DATA_FOLDER}/watchlist_alerts.ndjson"
+########################################################
+# Identifier normalization
+########################################################
+NORMALIZE_IDENTIFIERS = args.normalize_identifiers
+DEFAULT_PHONE_COUNTRY_CODE = args.default_phone_country_code.strip().lstrip('+')
+########################################################
+# Ingest profiling
+########################################################
+import time
+RUN_TIMESTAMP = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+INGEST_REPORTS_FOLDER = f"{DATA_FOLDER}/ingest_reports"
+INGEST_REPORT_FILE = args.ingest_report if args.ingest_report else f"{INGEST_REPORTS_FOLDER}/ingest_report_{RUN_TIMESTAMP}.json"
+PROFILER = args.profile
+PROFILE_OUTPUT_FILE = args.profile_output if args.profile_output else \
+    f"{INGEST_REPORTS_FOLDER}/profile_{RUN_TIMESTAMP}.{'prof' if PROFILER == 'cprofile' else 'json'}"
+########################################################
+# Slow query log
+########################################################
+SLOW_QUERY_THRESHOLD = args.slow_query_threshold
+SLOW_QUERY_LOG_FILE = args.slow_query_log if args.slow_query_log else f"{DATA_FOLDER}/slow_queries.log"
+SLOW_QUERY_LOG_MAX_BYTES = 10 * 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = 5
+########################################################
+# Load bookmarks
+########################################################
+LOAD_BOOKMARKS_FILE = args.load_bookmarks if args.load_bookmarks else f"{DATA_FOLDER}/load_bookmarks.json"
+########################################################
 # Logging configuration
 ########################################################
 import colorlog
@@ -68,6 +149,9 @@ console = Console()
 ########################################################
 # Node types
 ########################################################
+# Labels that are never identifiers and the relationship types derived from the loaded data
+# (overlap projection, source overlap matrix), shared with the app
+from personatrace_common.graph_schema import NON_IDENTIFIER_LABELS, SHARES_IDENTIFIERS, SOURCE_OVERLAP, DERIVED_RELATIONSHIP_TYPES
 NODE_SCHEMAS = {
     'observation_of_identity': {
         'node_type': 'observation_of_identity',
@@ -1,4 +1,5 @@
 #! /usr/bin/env python3
+import gzip
 import os
 
 
@@ -12,7 +13,9 @@ def get_all_files(folder_path):
     return all_files
 
 
-
-
-
-
+# Open an observations file for reading, decompressing it if it is gzipped
+def open_observations_file(file_path):
+    """Open an observations file for reading as text, decompressing it if its name ends with .gz"""
+    if str(file_path).endswith('.gz'):
+        return gzip.open(file_path, 'rt')
+    return open(file_path, 'r')
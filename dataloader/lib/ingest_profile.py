@@ -0,0 +1,148 @@
+#! /usr/bin/env python3
+'''
+Ingest profiling.
+
+IngestProfile collects per-stage wall times and row counters while loading, so a slow load can be
+traced to a stage (JSON parsing, deep_flatten, the node MERGEs per label, has_observation edges,
+each relationship group...) rather than to the overall obs/sec. Every run ends with a JSON report
+(see IngestProfile.report) that can be diffed between runs.
+
+SamplingProfiler optionally profiles the whole run with cProfile or py-spy (a sampling profiler
+attached to the loader's process, if it is installed).
+'''
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import cProfile
+import json
+import os
+from pathlib import Path
+import shutil
+import signal
+import subprocess
+import time
+
+from lib.constants import logger
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class IngestProfile:
+    """Stage timers and counters of one load."""
+
+    def __init__(self):
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        self.stage_seconds = defaultdict(float)
+        self.stage_calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.rows_per_label = defaultdict(int)
+        self.rows_per_relationship_type = defaultdict(int)
+        self.batch_seconds = []
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block as stage name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds, calls=1):
+        """Add time measured elsewhere, e.g. accumulated over the observations of a batch."""
+        self.stage_seconds[name] += seconds
+        self.stage_calls[name] += calls
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def report(self, arguments=None):
+        """
+        The profile as a JSON serializable dict.
+
+        Stages are sorted by time, with their share of the total run time. Nested stages
+        (e.g. merge_nodes.email_address within merge_nodes) are also listed on their own.
+        """
+        seconds = time.perf_counter() - self._start
+        stages = {
+            name: {
+                'seconds': round(stage_seconds, 4),
+                'calls': self.stage_calls[name],
+                'share': round(stage_seconds / seconds, 4) if seconds > 0 else None,
+            }
+            for name, stage_seconds in sorted(self.stage_seconds.items(), key=lambda item: -item[1])
+        }
+        observations = self.counters.get('observations', 0)
+        return {
+            'started_at': self.started_at.isoformat(),
+            'finished_at': datetime.now(timezone.utc).isoformat(),
+            'seconds': round(seconds, 4),
+            'arguments': arguments or {},
+            'totals': {
+                **dict(sorted(self.counters.items())),
+                'observations_per_second': round(observations / seconds, 1) if seconds > 0 else None,
+            },
+            'batches': {
+                'count': len(self.batch_seconds),
+                'p50_seconds': _percentile(self.batch_seconds, 0.5),
+                'p95_seconds': _percentile(self.batch_seconds, 0.95),
+                'max_seconds': max(self.batch_seconds, default=None),
+            },
+            'stages': stages,
+            'rows_per_label': dict(sorted(self.rows_per_label.items())),
+            'rows_per_relationship_type': dict(sorted(self.rows_per_relationship_type.items())),
+        }
+
+    def write(self, path, arguments=None):
+        """Write the report to path (creating its folder) and log the slowest stages."""
+        report = self.report(arguments)
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+        slowest = ', '.join(f"{name} {stage['seconds']:.2f}s" for name, stage in list(report['stages'].items())[:5])
+        logger.info(f"Ingest report written to {path}. Slowest stages: {slowest}")
+        return report
+
+
+class SamplingProfiler:
+    """
+    Profile the whole load with cProfile (deterministic, in process) or py-spy (sampling, as a
+    separate process attached to this one, which is cheaper on long loads).
+    """
+
+    def __init__(self, kind, output):
+        self.kind = kind
+        self.output = output
+        self._profiler = None
+        self._process = None
+
+    def start(self):
+        Path(self.output).parent.mkdir(parents=True, exist_ok=True)
+        if self.kind == 'cprofile':
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        elif self.kind == 'py-spy':
+            if shutil.which('py-spy') is None:
+                logger.warning("py-spy is not installed, not profiling")
+                return
+            # py-spy may need root (or ptrace permission) to attach to a running process
+            self._process = subprocess.Popen(['py-spy', 'record', '--pid', str(os.getpid()),
+                                              '--format', 'speedscope', '--output', self.output])
+        logger.info(f"Profiling the load with {self.kind}, writing the profile to {self.output}")
+
+    def stop(self):
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler.dump_stats(self.output)
+            logger.info(f"cProfile stats written to {self.output} (view with python -m pstats or snakeviz)")
+        elif self._process is not None:
+            # py-spy writes its output when interrupted
+            self._process.send_signal(signal.SIGINT)
+            self._process.wait()
+            logger.info(f"py-spy profile written to {self.output} (open in https://www.speedscope.app)")
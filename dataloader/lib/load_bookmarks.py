@@ -0,0 +1,46 @@
+#! /usr/bin/env python3
+'''
+Bookmarks of a load, for causally consistent reads by the app.
+
+Every session of a load shares one bookmark manager (BookmarkingDriver), so once the load has
+committed it holds the bookmarks of all of its transactions. They are written to
+--load_bookmarks, and the app opens its read sessions with them: on a cluster, a replica only
+answers once it has caught up with the whole load, so analysts never see it half replicated.
+'''
+from datetime import datetime, timezone
+import json
+import os
+from pathlib import Path
+
+from neo4j import GraphDatabase
+
+from lib.constants import logger
+
+
+class BookmarkingDriver:
+    """Wraps a neo4j Driver so every session it opens shares one bookmark manager."""
+
+    def __init__(self, driver):
+        self._driver = driver
+        self.bookmark_manager = GraphDatabase.bookmark_manager()
+
+    def session(self, **kwargs):
+        kwargs.setdefault('bookmark_manager', self.bookmark_manager)
+        return self._driver.session(**kwargs)
+
+    def bookmarks(self):
+        """Bookmarks of every transaction committed through the driver so far."""
+        return sorted(self.bookmark_manager.get_bookmarks())
+
+    def __getattr__(self, name):
+        return getattr(self._driver, name)
+
+
+def write_load_bookmarks(path, bookmarks):
+    """Write the bookmarks of a committed load, replacing the previous load's in one step."""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump({'bookmarks': bookmarks, 'committedAt': datetime.now(timezone.utc).isoformat()}, f, indent=2)
+    os.replace(temp_path, path)
+    logger.info(f"Bookmarks of the load written to {path}")
@@ -0,0 +1,108 @@
+#! /usr/bin/env python3
+'''
+Observation overlap projection.
+
+Materializes a derived shares_identifiers relationship between every pair of observations that
+share at least one identifier, so "which observations overlap with this one" is a single hop
+instead of the two-hop (obs)-[]->(identifier)<-[]-(other_obs) pattern. Each relationship carries
+a weight (the number of identifiers the pair shares) and identifier_types (the labels of those
+identifiers). It always points from the observation with the smaller value to the larger one and
+should be traversed undirected.
+
+The projection is built over the whole graph with build_overlap_projection and can be kept
+current while loading with update_overlap_projection. Relationships between existing
+observations are not revisited when loading, so an identifier that crosses the hub threshold
+later keeps its existing pairs until the projection is rebuilt.
+'''
+import time
+
+from lib.constants import BATCH_SIZE, DELETION_BATCH_SIZE, SHARES_IDENTIFIERS, logger, console
+
+# Pairs of (observation in $values, other observation) that share an identifier. With $ordered
+# only the pairs where the batch observation has the smaller value are returned, so a full build
+# computes every pair once.
+OVERLAP_PROJECTION_QUERY = """
+UNWIND $values AS value
+MATCH (a:observation_of_identity {value: value})-[]->(identifier)<-[]-(b:observation_of_identity)
+WHERE a <> b
+  AND NOT identifier:observation_of_identity AND NOT identifier:source
+  AND NOT any(label IN labels(identifier) WHERE label IN $excluded_labels)
+  AND (NOT $ordered OR a.value < b.value)
+  AND ($hub_threshold <= 0 OR COUNT { (identifier)<-[]-(:observation_of_identity) } <= $hub_threshold)
+WITH a, b, count(DISTINCT identifier) AS weight, collect(DISTINCT labels(identifier)[0]) AS identifier_types
+WITH CASE WHEN a.value < b.value THEN a ELSE b END AS first,
+     CASE WHEN a.value < b.value THEN b ELSE a END AS second,
+     weight, identifier_types
+MERGE (first)-[s:shares_identifiers]->(second)
+SET s.weight = weight, s.identifier_types = identifier_types
+RETURN count(s) AS count
+"""
+
+
+def update_overlap_projection(session, observation_values, hub_threshold=0, excluded_labels=(), ordered=False):
+    """
+    Create or refresh the shares_identifiers relationships of the given observations.
+
+    Args:
+        session: Neo4j session
+        observation_values: Values of the observations to update
+        hub_threshold: Identifiers shared by more observations than this don't count (0 for no limit)
+        excluded_labels: Identifier labels that don't count
+        ordered: Only update the pairs where the given observation has the smaller value
+
+    Returns:
+        int: Number of shares_identifiers relationships written
+    """
+    record = session.run(OVERLAP_PROJECTION_QUERY,
+                         values=list(observation_values),
+                         hub_threshold=hub_threshold,
+                         excluded_labels=list(excluded_labels),
+                         ordered=ordered).single()
+    return record['count'] if record else 0
+
+
+def delete_overlap_projection(session):
+    """Delete every shares_identifiers relationship in DELETION_BATCH_SIZE batches."""
+    total_deleted = 0
+    while True:
+        deleted = session.run("""
+        MATCH ()-[s:shares_identifiers]->()
+        WITH s LIMIT $batch_size
+        DELETE s
+        RETURN count(*) AS deleted
+        """, batch_size=DELETION_BATCH_SIZE).single()['deleted']
+        total_deleted += deleted
+        if deleted < DELETION_BATCH_SIZE:
+            return total_deleted
+
+
+def build_overlap_projection(driver, hub_threshold=0, excluded_labels=()):
+    """
+    Rebuild the shares_identifiers relationships over the whole graph.
+
+    Args:
+        driver: Neo4j driver
+        hub_threshold: Identifiers shared by more observations than this don't count (0 for no limit),
+            so e.g. a shared office IP address doesn't connect everyone behind it
+        excluded_labels: Identifier labels that don't count
+
+    Returns:
+        int: Number of shares_identifiers relationships
+    """
+    start_time = time.time()
+    with driver.session() as session:
+        with console.status("[bold red]Deleting the previous overlap projection...", spinner="dots"):
+            deleted = delete_overlap_projection(session)
+        logger.info(f"Deleted {deleted} existing {SHARES_IDENTIFIERS} relationships")
+
+        observation_values = [record['value'] for record in session.run("MATCH (obs:observation_of_identity) RETURN obs.value AS value")]
+
+        total_written = 0
+        total_batches = (len(observation_values) + BATCH_SIZE - 1) // BATCH_SIZE
+        for batch_number, batch_start in enumerate(range(0, len(observation_values), BATCH_SIZE), 1):
+            with console.status(f"[bold green]Building overlap projection batch {batch_number} of {total_batches}...", spinner="dots"):
+                total_written += update_overlap_projection(session, observation_values[batch_start:batch_start + BATCH_SIZE],
+                                                           hub_threshold, excluded_labels, ordered=True)
+
+    logger.info(f"Built {total_written} {SHARES_IDENTIFIERS} relationships between {len(observation_values)} observations in {time.time() - start_time:.2f}s")
+    return total_written
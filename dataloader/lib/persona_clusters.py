@@ -0,0 +1,191 @@
+#! /usr/bin/env python3
+'''
+Offline persona clustering.
+
+Observations that share an identifier, directly or through other observations, are treated as
+the same persona. Every observation -> identifier relationship is streamed out of the graph into
+compact integer arrays, connected components are computed over them with NumPy, and each
+observation gets a persona_id (the value of one observation of its cluster) and persona_size
+(the number of observations in its cluster). Looking up a persona is then an indexed property
+match on persona_id instead of a multi-hop traversal.
+'''
+from array import array
+import time
+
+import numpy as np
+
+from lib.constants import BATCH_SIZE, NON_IDENTIFIER_LABELS, logger, console
+
+
+def connected_components(num_nodes, sources, targets):
+    """
+    Label every node with the smallest node index of its connected component.
+
+    Alternates hooking (every root points to the smallest root among its neighbours) and
+    shortcutting (pointer jumping until every node points to a root) until no relationship
+    joins two different components, all in vectorized NumPy over the edge arrays.
+
+    Args:
+        num_nodes: Number of nodes, nodes are the integers 0..num_nodes-1
+        sources: Integer array of relationship start nodes
+        targets: Integer array of relationship end nodes
+
+    Returns:
+        np.ndarray: Component label (smallest node index in the component) for each node
+    """
+    labels = np.arange(num_nodes, dtype=sources.dtype)
+    while True:
+        source_labels, target_labels = labels[sources], labels[targets]
+        crossing = source_labels != target_labels
+        if not crossing.any():
+            return labels
+
+        # Hook: point the root of each component at the smallest root it is connected to
+        source_labels, target_labels = source_labels[crossing], target_labels[crossing]
+        smallest = np.minimum(source_labels, target_labels)
+        np.minimum.at(labels, source_labels, smallest)
+        np.minimum.at(labels, target_labels, smallest)
+
+        # Shortcut: jump pointers until every node points directly at its root
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+
+
+def drop_hub_edges(observations, identifiers, hub_threshold):
+    """Drop the relationships of identifiers shared by more than hub_threshold observations (0 keeps all)."""
+    if hub_threshold <= 0 or len(identifiers) == 0:
+        return observations, identifiers
+    degree = np.bincount(identifiers)
+    keep = degree[identifiers] <= hub_threshold
+    logger.info(f"Ignoring {int((degree > hub_threshold).sum())} hub identifiers shared by more than {hub_threshold} observations")
+    return observations[keep], identifiers[keep]
+
+
+def persona_assignments(num_observations, observations, identifiers):
+    """
+    Compute (persona root index, persona size) for every observation.
+
+    Observations are nodes 0..num_observations-1 and identifiers follow them, so the smallest
+    index of a component - its label - is always an observation.
+    """
+    num_identifiers = int(identifiers.max()) + 1 if len(identifiers) else 0
+    labels = connected_components(num_observations + num_identifiers, observations, identifiers + num_observations)
+    roots = labels[:num_observations]
+    sizes = np.bincount(roots, minlength=num_observations)[roots]
+    return roots, sizes
+
+
+def _stream_observation_edges(session, observation_index, excluded_labels, identifier_rows=None):
+    """
+    Stream every observation -> identifier relationship into integer arrays.
+
+    Identifiers are read one label at a time so only one label's identifier values are held in
+    a dict at once, the arrays themselves only hold integer indexes. If identifier_rows is a list,
+    (label, value, first observation index) is appended to it for every identifier.
+    """
+    observations, identifiers = array('q'), array('q')
+    next_identifier = 0
+
+    labels = [record['label'] for record in session.run("CALL db.labels() YIELD label RETURN label")]
+    for label in labels:
+        if label in NON_IDENTIFIER_LABELS or label in excluded_labels:
+            continue
+
+        identifier_index = {}
+        label_start = time.time()
+        edge_query = f"""
+        MATCH (obs:observation_of_identity)-[]->(identifier:`{label}`)
+        RETURN obs.value AS observation, identifier.value AS identifier
+        """
+        for record in session.run(edge_query):
+            observation = observation_index.get(record['observation'])
+            if observation is None:
+                continue
+            identifier = identifier_index.get(record['identifier'])
+            if identifier is None:
+                identifier = identifier_index[record['identifier']] = next_identifier
+                next_identifier += 1
+                if identifier_rows is not None:
+                    identifier_rows.append((label, record['identifier'], observation))
+            observations.append(observation)
+            identifiers.append(identifier)
+
+        logger.info(f"Read {len(identifier_index)} {label} identifiers in {time.time() - label_start:.2f}s")
+
+    return np.frombuffer(observations, dtype=np.int64), np.frombuffer(identifiers, dtype=np.int64)
+
+
+def create_persona_index(driver):
+    """Index persona_id so persona lookups and incremental merges are property matches."""
+    with driver.session() as session:
+        session.run("CREATE INDEX IF NOT EXISTS FOR (n:observation_of_identity) ON (n.persona_id)")
+
+
+def build_persona_clusters(driver, hub_threshold=0, excluded_labels=(), persona_store=None):
+    """
+    Compute persona clusters over the whole graph and write persona_id and persona_size to every observation.
+
+    Args:
+        driver: Neo4j driver
+        hub_threshold: Identifiers shared by more observations than this don't join clusters (0 for no limit),
+            so e.g. a shared office IP address doesn't merge everyone behind it into one persona
+        excluded_labels: Identifier labels that never join clusters
+        persona_store: PersonaStore (see lib/persona_store.py) to replace with the result, so later
+            loads can update the clusters incrementally
+
+    Returns:
+        int: Number of persona clusters
+    """
+    start_time = time.time()
+    with driver.session() as session:
+        with console.status("[bold green]Reading observations...", spinner="dots"):
+            observation_values = [record['value'] for record in session.run("MATCH (obs:observation_of_identity) RETURN obs.value AS value")]
+            observation_index = {value: i for i, value in enumerate(observation_values)}
+
+        with console.status("[bold green]Reading observation identifiers...", spinner="dots"):
+            identifier_rows = [] if persona_store is not None else None
+            observations, identifiers = _stream_observation_edges(session, observation_index, set(excluded_labels), identifier_rows)
+        logger.info(f"Read {len(observation_values)} observations and {len(observations)} identifier relationships in {time.time() - start_time:.2f}s")
+
+        cluster_start = time.time()
+        identifier_counts = np.bincount(identifiers) if persona_store is not None else None
+        # The store keeps every relationship, hub ones included, to split clusters when a later load makes a hub
+        all_observations, all_identifiers = observations, identifiers
+        observations, identifiers = drop_hub_edges(observations, identifiers, hub_threshold)
+        roots, sizes = persona_assignments(len(observation_values), observations, identifiers)
+        num_clusters = len(np.unique(roots))
+        logger.info(f"Found {num_clusters} persona clusters in {time.time() - cluster_start:.2f}s")
+
+        create_persona_index(driver)
+
+        write_start = time.time()
+        write_query = """
+        UNWIND $rows AS row
+        MATCH (obs:observation_of_identity {value: row.value})
+        SET obs.persona_id = row.persona_id, obs.persona_size = row.persona_size
+        """
+        with console.status("[bold green]Writing persona clusters...", spinner="dots"):
+            for batch_start in range(0, len(observation_values), BATCH_SIZE):
+                batch_end = min(batch_start + BATCH_SIZE, len(observation_values))
+                rows = [{
+                    'value': observation_values[i],
+                    'persona_id': observation_values[roots[i]],
+                    'persona_size': int(sizes[i])
+                } for i in range(batch_start, batch_end)]
+                session.run(write_query, rows=rows)
+        logger.info(f"Wrote persona clusters to {len(observation_values)} observations in {time.time() - write_start:.2f}s")
+
+    if persona_store is not None:
+        persona_store.replace_all(observation_values, roots, sizes, (
+            (label, value, observation_values[observation], identifier_counts[i])
+            for i, (label, value, observation) in enumerate(identifier_rows)
+        ), (
+            (*identifier_rows[identifier][:2], observation_values[observation])
+            for observation, identifier in zip(all_observations, all_identifiers)
+        ))
+
+    logger.info(f"Built {num_clusters} persona clusters in {time.time() - start_time:.2f}s")
+    return num_clusters
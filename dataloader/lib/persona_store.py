@@ -0,0 +1,299 @@
+#! /usr/bin/env python3
+'''
+Incremental persona clusters.
+
+A union-find over observations persisted in a local SQLite file, so the persona clusters built
+by lib/persona_clusters.py can be kept current while loading instead of being recomputed. Each
+identifier remembers the first observation it was seen with; a new observation sharing that
+identifier is merged into that observation's cluster. When two clusters merge the larger one
+keeps its persona_id and only the observations of the smaller one are rewritten in the graph.
+
+Like a full build, identifiers shared by more than hub_threshold observations don't join
+clusters. Union-find can't undo a merge, so every observation -> identifier relationship is
+also stored and when an identifier becomes a hub the clusters it merged are recomputed from
+them without it, which keeps the clusters the same as a full build of the same data.
+'''
+import sqlite3
+import time
+
+from lib.constants import logger
+
+# Values per SQLite IN (...) list, well below SQLite's limit on query parameters
+SQLITE_CHUNK_SIZE = 500
+
+class PersonaChanges:
+    """Persona updates of one batch, to be written to the graph with write_persona_changes."""
+
+    def __init__(self):
+        # New observation value -> persona_id
+        self.new_observations = {}
+        # Old persona_id -> persona_id it was merged into
+        self.merged = {}
+        # persona_id -> persona_size for every cluster that changed
+        self.sizes = {}
+        # Observation value -> persona_id for every observation of a split cluster
+        self.reassigned = {}
+
+
+class PersonaStore:
+    """
+    Persisted union-find over observations.
+
+    Parents and cluster sizes are cached in memory while a batch is processed and written to
+    SQLite when it is committed, so each batch is a handful of SQLite transactions however many
+    merges it causes.
+    """
+
+    def __init__(self, path, hub_threshold=0, excluded_labels=()):
+        self.path = path
+        self.hub_threshold = hub_threshold
+        self.excluded_labels = set(excluded_labels)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS observations (value TEXT PRIMARY KEY, parent TEXT NOT NULL) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS personas (root TEXT PRIMARY KEY, size INTEGER NOT NULL) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS identifiers (key TEXT PRIMARY KEY, observation TEXT NOT NULL, count INTEGER NOT NULL) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS edges (key TEXT NOT NULL, observation TEXT NOT NULL, PRIMARY KEY (key, observation)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS edges_observation ON edges (observation);
+        """)
+        self._reset_cache()
+
+    def _reset_cache(self):
+        self._parents = {}
+        self._sizes = {}
+        self._identifiers = {}
+        self._removed_personas = set()
+
+    def close(self):
+        self.connection.close()
+
+    ################################################################################################
+    # Union-find
+    ################################################################################################
+    def _parent(self, value):
+        if value not in self._parents:
+            row = self.connection.execute("SELECT parent FROM observations WHERE value = ?", (value,)).fetchone()
+            self._parents[value] = row[0] if row else None
+        return self._parents[value]
+
+    def _size(self, root):
+        if root not in self._sizes:
+            row = self.connection.execute("SELECT size FROM personas WHERE root = ?", (root,)).fetchone()
+            self._sizes[root] = row[0] if row else 1
+        return self._sizes[root]
+
+    def _identifier(self, key):
+        if key not in self._identifiers:
+            row = self.connection.execute("SELECT observation, count FROM identifiers WHERE key = ?", (key,)).fetchone()
+            self._identifiers[key] = list(row) if row else None
+        return self._identifiers[key]
+
+    def find(self, value):
+        """Return the persona_id (root observation) of an observation, compressing the path to it."""
+        path = []
+        parent = self._parent(value)
+        while parent != value:
+            path.append(value)
+            value = parent
+            parent = self._parent(value)
+        for node in path:
+            self._parents[node] = value
+        return value
+
+    def _union(self, a, b, changes):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return
+        # The larger cluster keeps its persona_id so fewer observations are rewritten, on a tie
+        # the cluster that is already in the graph keeps it rather than a new observation's
+        size_a, size_b = self._size(root_a), self._size(root_b)
+        if size_a < size_b or (size_a == size_b and root_a in changes.new_observations):
+            root_a, root_b = root_b, root_a
+        self._parents[root_b] = root_a
+        self._sizes[root_a] = self._size(root_a) + self._size(root_b)
+        self._sizes.pop(root_b)
+        self._removed_personas.add(root_b)
+        changes.merged[root_b] = root_a
+
+    def _write_identifiers(self):
+        self.connection.executemany("INSERT OR REPLACE INTO identifiers (key, observation, count) VALUES (?, ?, ?)",
+                                    [(key, row[0], row[1]) for key, row in self._identifiers.items() if row is not None])
+
+    def _neighbours(self, observations):
+        """Observations sharing an identifier that isn't a hub with any of the given observations."""
+        for start in range(0, len(observations), SQLITE_CHUNK_SIZE):
+            chunk = observations[start:start + SQLITE_CHUNK_SIZE]
+            yield from (row[0] for row in self.connection.execute(f"""
+                SELECT DISTINCT b.observation FROM edges a
+                JOIN identifiers i ON i.key = a.key
+                JOIN edges b ON b.key = a.key
+                WHERE a.observation IN ({','.join('?' * len(chunk))}) AND i.count <= ?
+            """, (*chunk, self.hub_threshold)))
+
+    def _split(self, hub_keys, changes):
+        """
+        Recompute the clusters merged through identifiers that just became hubs.
+
+        Every piece of such a cluster is connected to one of the hub's observations, so the pieces
+        are found by walking the stored relationships from them, skipping hub identifiers. The
+        piece holding the old persona_id keeps it, every other piece gets the persona_id of one of
+        its observations.
+        """
+        # The queries read the identifier counts and relationships of the batch before it's committed
+        self._write_identifiers()
+        seeds = []
+        for start in range(0, len(hub_keys), SQLITE_CHUNK_SIZE):
+            chunk = hub_keys[start:start + SQLITE_CHUNK_SIZE]
+            seeds.extend(row[0] for row in self.connection.execute(
+                f"SELECT observation FROM edges WHERE key IN ({','.join('?' * len(chunk))})", chunk))
+
+        visited = set()
+        pieces = []
+        for seed in seeds:
+            if seed in visited:
+                continue
+            visited.add(seed)
+            piece, frontier = [seed], [seed]
+            while frontier:
+                next_frontier = []
+                for value in self._neighbours(frontier):
+                    if value not in visited:
+                        visited.add(value)
+                        next_frontier.append(value)
+                piece.extend(next_frontier)
+                frontier = next_frontier
+            pieces.append(piece)
+
+        old_roots = {value: self.find(value) for piece in pieces for value in piece}
+        for piece in pieces:
+            root = next((value for value in piece if old_roots[value] == value), piece[0])
+            for value in piece:
+                self._parents[value] = root
+                changes.reassigned[value] = root
+            self._sizes[root] = len(piece)
+            self._removed_personas.discard(root)
+        logger.debug(f"Split the clusters of {len(hub_keys)} new hub identifiers into {len(pieces)} clusters of {len(visited)} observations")
+
+    ################################################################################################
+    # Batches
+    ################################################################################################
+    def update(self, observation_identifiers):
+        """
+        Add a batch of observations and merge the clusters that now share identifiers.
+
+        Args:
+            observation_identifiers: dict of observation value -> list of (label, value) identifiers
+
+        Returns:
+            PersonaChanges: The persona_id and persona_size updates to write to the graph
+        """
+        changes = PersonaChanges()
+        edges = []
+        new_hubs = []
+        for observation, identifiers in observation_identifiers.items():
+            observation = str(observation)
+            if self._parent(observation) is None:
+                self._parents[observation] = observation
+                self._sizes[observation] = 1
+                changes.new_observations[observation] = observation
+
+            for label, value in identifiers:
+                if label in self.excluded_labels:
+                    continue
+                key = f'{label}\0{value}'
+                edges.append((key, observation))
+                identifier = self._identifier(key)
+                if identifier is None:
+                    self._identifiers[key] = [observation, 1]
+                    continue
+                identifier[1] += 1
+                # Identifiers shared by more than hub_threshold observations don't join clusters,
+                # the ones it already merged are split again once the batch is added
+                if self.hub_threshold and identifier[1] > self.hub_threshold:
+                    if identifier[1] == self.hub_threshold + 1:
+                        new_hubs.append(key)
+                    continue
+                self._union(observation, identifier[0], changes)
+
+        self.connection.executemany("INSERT OR IGNORE INTO edges (key, observation) VALUES (?, ?)", edges)
+        if new_hubs:
+            self._split(new_hubs, changes)
+
+        # Resolve chains of merges within the batch to the final persona_id
+        changes.new_observations = {observation: self.find(observation) for observation in changes.new_observations}
+        changes.merged = {old: self.find(old) for old in changes.merged if old not in changes.new_observations}
+        changes.sizes = {root: self._sizes[root] for root in
+                         set(changes.new_observations.values()) | set(changes.merged.values()) | set(changes.reassigned.values())}
+        return changes
+
+    def commit(self):
+        """Persist the cached parents, sizes and identifiers, and the relationships, of the current batch."""
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO observations (value, parent) VALUES (?, ?)",
+                                        [(value, parent) for value, parent in self._parents.items() if parent is not None])
+            self.connection.executemany("DELETE FROM personas WHERE root = ?", [(root,) for root in self._removed_personas])
+            self.connection.executemany("INSERT OR REPLACE INTO personas (root, size) VALUES (?, ?)", list(self._sizes.items()))
+            self._write_identifiers()
+        self._reset_cache()
+
+    def replace_all(self, observation_values, roots, sizes, identifiers, edges):
+        """
+        Replace the store with the result of a full build (see build_persona_clusters).
+
+        Args:
+            observation_values: List of observation values
+            roots: Persona root index of each observation
+            sizes: Persona size of each observation
+            identifiers: Iterable of (label, value, first observation value, observation count)
+            edges: Iterable of (label, value, observation value) for every observation -> identifier relationship
+        """
+        with self.connection:
+            self.connection.execute("DELETE FROM observations")
+            self.connection.execute("DELETE FROM personas")
+            self.connection.execute("DELETE FROM identifiers")
+            self.connection.execute("DELETE FROM edges")
+            self.connection.executemany("INSERT INTO observations (value, parent) VALUES (?, ?)",
+                                        ((str(value), str(observation_values[root])) for value, root in zip(observation_values, roots)))
+            self.connection.executemany("INSERT OR REPLACE INTO personas (root, size) VALUES (?, ?)",
+                                        ((str(observation_values[root]), int(size)) for root, size in zip(roots, sizes)))
+            self.connection.executemany("INSERT INTO identifiers (key, observation, count) VALUES (?, ?, ?)",
+                                        ((f'{label}\0{value}', str(observation), int(count)) for label, value, observation, count in identifiers))
+            self.connection.executemany("INSERT OR IGNORE INTO edges (key, observation) VALUES (?, ?)",
+                                        ((f'{label}\0{value}', str(observation)) for label, value, observation in edges))
+        self._reset_cache()
+        logger.info(f"Persona store {self.path} replaced with {len(observation_values)} observations")
+
+
+def write_persona_changes(driver, changes):
+    """Write the persona_id and persona_size updates of a batch to the graph, using the persona_id index."""
+    start_time = time.time()
+    with driver.session() as session:
+        if changes.new_observations:
+            session.run("""
+            UNWIND $rows AS row
+            MATCH (obs:observation_of_identity {value: row.value})
+            SET obs.persona_id = row.persona_id
+            """, rows=[{'value': value, 'persona_id': persona_id} for value, persona_id in changes.new_observations.items()])
+        # Only the observations of the smaller side of each merge are rewritten
+        if changes.merged:
+            session.run("""
+            UNWIND $rows AS row
+            MATCH (obs:observation_of_identity {persona_id: row.old})
+            SET obs.persona_id = row.new
+            """, rows=[{'old': old, 'new': new} for old, new in changes.merged.items()])
+        # Split clusters are rewritten observation by observation, after the merges they may undo
+        if changes.reassigned:
+            session.run("""
+            UNWIND $rows AS row
+            MATCH (obs:observation_of_identity {value: row.value})
+            SET obs.persona_id = row.persona_id
+            """, rows=[{'value': value, 'persona_id': persona_id} for value, persona_id in changes.reassigned.items()])
+        if changes.sizes:
+            session.run("""
+            UNWIND $rows AS row
+            MATCH (obs:observation_of_identity {persona_id: row.persona_id})
+            SET obs.persona_size = row.size
+            """, rows=[{'persona_id': persona_id, 'size': size} for persona_id, size in changes.sizes.items()])
+    logger.debug(f"Wrote {len(changes.new_observations)} new observations and {len(changes.merged)} persona merges in {time.time() - start_time:.2f}s")
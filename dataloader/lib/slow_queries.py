@@ -0,0 +1,147 @@
+#! /usr/bin/env python3
+'''
+Slow query log of the loader.
+
+SlowQueryDriver wraps the Neo4j driver of a load so every session.run is timed, from running the
+query until its result is consumed. Queries slower than --slow_query_threshold are appended to a
+rotating JSON lines log with their Cypher text, redacted parameters (identifier values are
+replaced by their type and size, UNWIND batches by their length), latency, rows and EXPLAIN plan.
+The loader's queries write, so they are never re-run with PROFILE; EXPLAIN only plans them.
+'''
+import sys
+import time
+
+from personatrace_common.slow_query_log import JsonLinesLog, simplify_plan, slow_query_entry
+
+from lib.constants import logger
+
+
+class SlowQueryLog:
+    """Rotating JSON lines log of the queries slower than threshold seconds."""
+
+    def __init__(self, path, threshold, max_bytes, backups):
+        self.path = path
+        self.threshold = threshold
+        self.num_slow_queries = 0
+        self._log = JsonLinesLog(path, max_bytes, backups)
+
+    def record(self, session, query, parameters, seconds, rows, caller):
+        """Record a finished query if it was slow, planning it with EXPLAIN on session (an unwrapped neo4j Session)."""
+        if self.threshold <= 0 or seconds < self.threshold:
+            return
+        self.num_slow_queries += 1
+        entry = slow_query_entry(query, parameters, seconds, rows, caller)
+        entry['plan_mode'] = 'EXPLAIN'
+        try:
+            entry['plan'] = simplify_plan(session.run(f"EXPLAIN {query}", parameters).consume().plan)
+        except Exception as e:
+            entry['plan_error'] = str(e)
+        self._log.write(entry)
+        logger.warning(f"Slow query in {caller} ({seconds:.2f}s, {rows} rows), see {self.path}")
+
+
+class _TimedResult:
+    """neo4j Result that reports its query to the slow query log once it is consumed."""
+
+    def __init__(self, result, session, query, parameters, caller, seconds):
+        self._result = result
+        self._session = session
+        self._query = query
+        self._parameters = parameters
+        self._caller = caller
+        self._seconds = seconds
+        self._rows = 0
+        self._finished = False
+
+    def __iter__(self):
+        iterator = iter(self._result)
+        while True:
+            start = time.perf_counter()
+            try:
+                record = next(iterator)
+            except StopIteration:
+                self._seconds += time.perf_counter() - start
+                break
+            self._seconds += time.perf_counter() - start
+            self._rows += 1
+            yield record
+        self.finish()
+
+    def single(self, *args, **kwargs):
+        start = time.perf_counter()
+        record = self._result.single(*args, **kwargs)
+        self._seconds += time.perf_counter() - start
+        self._rows += 1 if record is not None else 0
+        self.finish()
+        return record
+
+    def consume(self):
+        start = time.perf_counter()
+        summary = self._result.consume()
+        self._seconds += time.perf_counter() - start
+        self.finish()
+        return summary
+
+    def finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        start = time.perf_counter()
+        try:
+            self._result.consume()
+        except Exception:
+            pass
+        self._seconds += time.perf_counter() - start
+        self._session.slow_query_log.record(self._session.session, self._query, self._parameters, self._seconds, self._rows, self._caller)
+
+    def __getattr__(self, name):
+        return getattr(self._result, name)
+
+
+class _TimedSession:
+    def __init__(self, session, slow_query_log):
+        self.session = session
+        self.slow_query_log = slow_query_log
+        self._results = []
+
+    def run(self, query, parameters=None, **kwargs):
+        # The function that ran the query, e.g. process_batch or build_persona_clusters
+        caller = sys._getframe(1).f_code.co_name
+        start = time.perf_counter()
+        result = self.session.run(query, parameters, **kwargs)
+        timed = _TimedResult(result, self, query, {**(parameters or {}), **kwargs}, caller, time.perf_counter() - start)
+        self._results.append(timed)
+        return timed
+
+    def _finish_results(self):
+        results, self._results = self._results, []
+        for result in results:
+            result.finish()
+
+    def close(self):
+        self._finish_results()
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._finish_results()
+        return self.session.__exit__(exc_type, exc_value, traceback)
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+class SlowQueryDriver:
+    """Wraps a neo4j Driver so the queries of its sessions are checked against the slow query log."""
+
+    def __init__(self, driver, slow_query_log):
+        self._driver = driver
+        self.slow_query_log = slow_query_log
+
+    def session(self, **kwargs):
+        return _TimedSession(self._driver.session(**kwargs), self.slow_query_log)
+
+    def __getattr__(self, name):
+        return getattr(self._driver, name)
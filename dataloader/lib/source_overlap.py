@@ -0,0 +1,138 @@
+#! /usr/bin/env python3
+'''
+Source overlap matrix.
+
+Counts, for every pair of sources, how many identifiers appear in observations of both, broken
+down by identifier label. Every source -> observation -> identifier path is streamed out of the
+graph once into integer arrays, each label becomes a sparse identifier x source incidence matrix
+B and the counts are the source x source product B^T B (the diagonal being the number of
+identifiers of each source). The result is written back as source_overlap relationships between
+source nodes, which the app serves from /api/source-overlap-matrix.
+'''
+from array import array
+from datetime import datetime, timezone
+import time
+
+import numpy as np
+from scipy import sparse
+
+from lib.constants import logger, console, NON_IDENTIFIER_LABELS, SOURCE_OVERLAP
+
+
+def source_overlap_counts(identifiers, sources, num_sources):
+    """
+    Count the identifiers shared by every pair of sources.
+
+    Args:
+        identifiers: Integer array of identifier indexes, one per observation -> identifier relationship
+        sources: Integer array of the source index of the relationship's observation
+        num_sources: Number of sources, sources are the integers 0..num_sources-1
+
+    Returns:
+        np.ndarray: num_sources x num_sources matrix of shared identifier counts, the diagonal is
+        the number of distinct identifiers of each source
+    """
+    if len(identifiers) == 0:
+        return np.zeros((num_sources, num_sources), dtype=np.int64)
+    num_identifiers = int(identifiers.max()) + 1
+    incidence = sparse.csr_matrix((np.ones(len(identifiers), dtype=np.int64), (identifiers, sources)),
+                                  shape=(num_identifiers, num_sources))
+    # An identifier seen in several observations of the same source still counts once for it
+    incidence.data[:] = 1
+    return (incidence.T @ incidence).toarray()
+
+
+def _stream_source_identifiers(session, label, source_index):
+    """Stream the (identifier index, source index) of every observation -> identifier relationship of one label."""
+    identifiers, sources = array('q'), array('q')
+    identifier_index = {}
+    edge_query = f"""
+    MATCH (s:source)-[:has_observation]->(obs:observation_of_identity)-[]->(identifier:`{label}`)
+    RETURN s.value AS source, identifier.value AS identifier
+    """
+    for record in session.run(edge_query):
+        source = source_index.get(record['source'])
+        if source is None:
+            continue
+        identifier = identifier_index.setdefault(record['identifier'], len(identifier_index))
+        identifiers.append(identifier)
+        sources.append(source)
+    return np.frombuffer(identifiers, dtype=np.int64), np.frombuffer(sources, dtype=np.int64)
+
+
+def build_source_overlap_matrix(driver, excluded_labels=()):
+    """
+    Compute the source x source shared identifier counts and write them to the graph.
+
+    Each source gets identifier_count plus identifier_labels / identifier_label_counts (its distinct
+    identifiers per label), and each pair of sources sharing identifiers gets a source_overlap
+    relationship with shared_identifiers plus the same per label breakdown.
+
+    Args:
+        driver: Neo4j driver
+        excluded_labels: Identifier labels that aren't counted
+
+    Returns:
+        np.ndarray: The total source x source matrix, in the order of the sorted source values
+    """
+    start_time = time.time()
+    computed_at = datetime.now(timezone.utc).isoformat()
+    with driver.session() as session:
+        source_values = sorted(record['value'] for record in session.run("MATCH (s:source) RETURN s.value AS value") if record['value'] is not None)
+        source_index = {value: i for i, value in enumerate(source_values)}
+
+        labels = [record['label'] for record in session.run("CALL db.labels() YIELD label RETURN label")]
+        label_matrices = {}
+        for label in labels:
+            if label in NON_IDENTIFIER_LABELS or label in excluded_labels:
+                continue
+            label_start = time.time()
+            with console.status(f"[bold green]Reading {label} identifiers...", spinner="dots"):
+                identifiers, sources = _stream_source_identifiers(session, label, source_index)
+            matrix = source_overlap_counts(identifiers, sources, len(source_values))
+            if matrix.any():
+                label_matrices[label] = matrix
+            logger.info(f"Counted {label} overlaps from {len(identifiers)} relationships in {time.time() - label_start:.2f}s")
+
+        total = sum(label_matrices.values(), np.zeros((len(source_values), len(source_values)), dtype=np.int64))
+        label_names = sorted(label_matrices)
+
+        def breakdown(i, j):
+            counts = [(label, int(label_matrices[label][i, j])) for label in label_names]
+            counts = [(label, count) for label, count in counts if count]
+            return [label for label, _ in counts], [count for _, count in counts]
+
+        source_rows = []
+        for i, value in enumerate(source_values):
+            row_labels, row_counts = breakdown(i, i)
+            source_rows.append({'value': value, 'identifier_count': int(total[i, i]),
+                                'identifier_labels': row_labels, 'identifier_label_counts': row_counts})
+        overlap_rows = []
+        for i, j in zip(*np.nonzero(np.triu(total, k=1))):
+            row_labels, row_counts = breakdown(i, j)
+            overlap_rows.append({'from': source_values[i], 'to': source_values[j], 'shared_identifiers': int(total[i, j]),
+                                 'identifier_labels': row_labels, 'identifier_label_counts': row_counts})
+
+        with console.status("[bold green]Writing source overlap matrix...", spinner="dots"):
+            session.run(f"MATCH (:source)-[o:{SOURCE_OVERLAP}]->(:source) DELETE o")
+            session.run("""
+            UNWIND $rows AS row
+            MATCH (s:source {value: row.value})
+            SET s.identifier_count = row.identifier_count,
+                s.identifier_labels = row.identifier_labels,
+                s.identifier_label_counts = row.identifier_label_counts,
+                s.overlap_computed_at = $computed_at
+            """, rows=source_rows, computed_at=computed_at)
+            session.run(f"""
+            UNWIND $rows AS row
+            MATCH (a:source {{value: row.from}})
+            MATCH (b:source {{value: row.to}})
+            CREATE (a)-[o:{SOURCE_OVERLAP}]->(b)
+            SET o.shared_identifiers = row.shared_identifiers,
+                o.identifier_labels = row.identifier_labels,
+                o.identifier_label_counts = row.identifier_label_counts,
+                o.computed_at = $computed_at
+            """, rows=overlap_rows, computed_at=computed_at)
+
+    logger.info(f"Built the source overlap matrix of {len(source_values)} sources ({len(overlap_rows)} overlapping pairs) in {time.time() - start_time:.2f}s")
+    return total
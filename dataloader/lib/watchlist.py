@@ -0,0 +1,162 @@
+#! /usr/bin/env python3
+'''
+Ingest-time watchlist matching.
+
+A watchlist file has one rule per line, blank lines and lines starting with # are ignored:
+
+    darkhat1337             exact rule, matches an identifier with exactly this value
+    *darkhat*               substring rule, matches every identifier containing "darkhat"
+
+Matching is case-insensitive. When identifiers are normalized (--normalize_identifiers) they are
+checked by their canonical value, so exact rules are normalized too, per label, e.g. the rule
++1 503-555-1234 matches the phone number +15035551234. Exact rules are a dict lookup per identifier. Substring rules are
+compiled into one Aho-Corasick automaton (pyahocorasick, if installed) or otherwise into one
+regular expression shaped like a trie of the substrings, so every identifier is scanned once
+rather than once per rule. Every identifier loaded by process_batch is checked and each match is
+appended to the alerts NDJSON file as soon as its batch is loaded.
+'''
+from datetime import datetime, timezone
+import json
+import re
+
+from lib.constants import logger
+
+# pyahocorasick is optional - fall back to a trie-shaped regular expression when it isn't installed
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+
+def parse_watchlist(lines):
+    """Split watchlist lines into (exact values, substrings), both lowercased."""
+    exact, substrings = set(), set()
+    for line in lines:
+        rule = line.strip()
+        if not rule or rule.startswith('#'):
+            continue
+        if len(rule) > 2 and rule.startswith('*') and rule.endswith('*'):
+            substrings.add(rule[1:-1].lower())
+        else:
+            exact.add(rule.lower())
+    return exact, substrings
+
+
+def trie_pattern(substrings):
+    """
+    Compile substrings into a regular expression that finds whether any of them occurs in a value.
+
+    A plain alternation tries every substring at every position, this one branches on one character
+    at a time like a trie, e.g. abc, abd and xy become (?:ab[cd]|xy). A substring that is a prefix
+    of another ends the branch, since finding the shorter one is enough.
+    """
+    trie = {}
+    for substring in substrings:
+        node = trie
+        for character in substring:
+            node = node.setdefault(character, {})
+        node[''] = {}
+
+    def build(node):
+        if '' in node:
+            return ''
+        branches = [(re.escape(character), build(child)) for character, child in sorted(node.items())]
+        leaves = [character for character, rest in branches if not rest]
+        alternatives = [character + rest for character, rest in branches if rest]
+        if len(leaves) == 1:
+            alternatives.append(leaves[0])
+        elif leaves:
+            alternatives.append('[' + ''.join(leaves) + ']')
+        return alternatives[0] if len(alternatives) == 1 else '(?:' + '|'.join(alternatives) + ')'
+
+    return re.compile(build(trie))
+
+
+class Watchlist:
+    """Exact and substring watchlist rules, checked against every loaded identifier."""
+
+    def __init__(self, path, alerts_path, normalizer=None):
+        self.path = path
+        self.alerts_path = alerts_path
+        self.normalizer = normalizer
+        with open(path, 'r') as f:
+            self.exact, substrings = parse_watchlist(f)
+        self.substrings = sorted(substrings)
+        # Label -> {lowercased canonical value -> exact rule}, filled in as labels are seen
+        self._exact_by_label = {}
+        self._exact_as_written = {rule: rule for rule in self.exact}
+
+        self._automaton = None
+        self._pattern = None
+        if self.substrings and ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for substring in self.substrings:
+                self._automaton.add_word(substring, substring)
+            self._automaton.make_automaton()
+        elif self.substrings:
+            self._pattern = trie_pattern(self.substrings)
+
+        self.alerts_file = open(alerts_path, 'a')
+        self.num_alerts = 0
+        logger.info(f"Loaded watchlist {path} with {len(self.exact)} exact and {len(self.substrings)} substring rules, "
+                    f"writing alerts to {alerts_path}")
+
+    def close(self):
+        self.alerts_file.close()
+
+    def _exact_rules(self, label):
+        """Exact rules by the values an identifier of label matching them is loaded as."""
+        if self.normalizer is None:
+            return self._exact_as_written
+        if label not in self._exact_by_label:
+            self._exact_by_label[label] = {str(form).lower(): rule for rule in self.exact
+                                           for form in self.normalizer.candidates(label, rule)}
+        return self._exact_by_label[label]
+
+    def match(self, value, label=None):
+        """Return the rules matching a value of label (exact rules as written, substring rules as *substring*)."""
+        value = str(value).lower()
+        exact = self._exact_rules(label)
+        rules = [exact[value]] if value in exact else []
+        if self._automaton is not None:
+            rules.extend(sorted({f'*{substring}*' for _, substring in self._automaton.iter(value)}))
+        elif self._pattern is not None and self._pattern.search(value):
+            # The pattern only tells whether some substring occurs, so the rare hits are checked rule by rule
+            rules.extend(f'*{substring}*' for substring in self.substrings if substring in value)
+        return rules
+
+    def check_batch(self, batch, identifier_rels):
+        """
+        Check the identifiers of a loaded batch and append an alert for every match.
+
+        Args:
+            batch: Observations of the batch
+            identifier_rels: Observation -> identifier relationships of the batch (start_id, end_label, end_val)
+
+        Returns:
+            int: Number of alerts written
+        """
+        sources = {observation['id']: observation['source'] for observation in batch}
+        matched_at = None
+        alerts = 0
+        for r in identifier_rels:
+            rules = self.match(r['end_val'], r['end_label'])
+            if not rules:
+                continue
+            matched_at = matched_at or datetime.now(timezone.utc).isoformat()
+            for rule in rules:
+                alert = {
+                    'rule': rule,
+                    'label': r['end_label'],
+                    'value': r['end_val'],
+                    'observation': r['start_id'],
+                    'source': sources.get(r['start_id']),
+                    'matched_at': matched_at,
+                }
+                self.alerts_file.write(json.dumps(alert, default=str) + '\n')
+                alerts += 1
+        if alerts:
+            self.alerts_file.flush()
+            self.num_alerts += alerts
+            logger.warning(f"{alerts} watchlist matches in this batch, see {self.alerts_path}")
+        return alerts
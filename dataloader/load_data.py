@@ -35,11 +35,50 @@ from lib.constants import (
     # Batch configuration
     BATCH_SIZE,
     DELETION_BATCH_SIZE,
+    # Persona clusters
+    BUILD_PERSONA_CLUSTERS,
+    PERSONA_HUB_THRESHOLD,
+    PERSONA_EXCLUDED_LABELS,
+    PERSONA_STORE_FILE,
+    # Observation overlap projection
+    BUILD_OVERLAP_PROJECTION,
+    MAINTAIN_OVERLAP_PROJECTION,
+    OVERLAP_HUB_THRESHOLD,
+    OVERLAP_EXCLUDED_LABELS,
+    # Source overlap matrix
+    BUILD_SOURCE_OVERLAP_MATRIX,
+    SOURCE_OVERLAP_EXCLUDED_LABELS,
+    # Watchlist
+    WATCHLIST_FILE,
+    WATCHLIST_ALERTS_FILE,
+    # Identifier normalization
+    NORMALIZE_IDENTIFIERS,
+    DEFAULT_PHONE_COUNTRY_CODE,
+    # Ingest profiling
+    INGEST_REPORT_FILE,
+    PROFILER,
+    PROFILE_OUTPUT_FILE,
+    # Slow query log
+    SLOW_QUERY_THRESHOLD,
+    SLOW_QUERY_LOG_FILE,
+    SLOW_QUERY_LOG_MAX_BYTES,
+    SLOW_QUERY_LOG_BACKUPS,
+    # Load bookmarks
+    LOAD_BOOKMARKS_FILE,
 )
 from lib.graph_print import print_graph_summary
 from lib.json_operations import deep_flatten
-from lib.file_operations import get_all_files
+from lib.file_operations import get_all_files, open_observations_file
 from lib.graph_delete import delete_graph
+from lib.persona_clusters import build_persona_clusters, create_persona_index
+from lib.persona_store import PersonaStore, write_persona_changes
+from lib.overlap_projection import build_overlap_projection, update_overlap_projection
+from lib.source_overlap import build_source_overlap_matrix
+from lib.watchlist import Watchlist
+from personatrace_common.normalizers import IdentifierNormalizer, default_normalizers
+from lib.ingest_profile import IngestProfile, SamplingProfiler
+from lib.slow_queries import SlowQueryLog, SlowQueryDriver
+from lib.load_bookmarks import BookmarkingDriver, write_load_bookmarks
 
 from concurrent.futures import ThreadPoolExecutor
 from collections import defaultdict
@@ -55,16 +94,24 @@ import time, json
 created_end_label_indices = set()
 created_source_nodes = set()
 created_node_values_dict = defaultdict(set)
+# Stage timings and counters of this load, written to INGEST_REPORT_FILE at the end
+ingest_profile = IngestProfile()
 
-def process_batch(driver, batch):
+def process_batch(driver, batch, persona_store=None, watchlist=None, normalizer=None):
     """Process a batch of observations, creating nodes and relationships in bulk
-       with explicit USING INDEX hints for faster relationship insertion."""
+       with explicit USING INDEX hints for faster relationship insertion.
+       With a persona_store the persona clusters are updated for the new observations,
+       with a watchlist every identifier of the batch is checked against it and with a
+       normalizer identifiers are merged on their canonical value."""
     start_time = time.time()
     try:
         with driver.session() as session:
             all_nodes = []
             all_relationships = []
             batch_end_labels = set()  # Track end_labels for this batch
+            flatten_seconds = 0.0
+            normalize_seconds = 0.0
+            build_start = time.perf_counter()
 
             # ────────────────────────── build node / rel lists ──────────────────────────
             for observation in batch:
@@ -81,6 +128,7 @@ def process_batch(driver, batch):
                     'source': observation['source'],
                     'observation_date': observation['observation_date'],
                 }
+                flatten_start = time.perf_counter()
                 for k, v in observation.items():
                     if isinstance(v, (str, int, float, bool)):
                         obs_props[k] = v
@@ -90,6 +138,7 @@ def process_batch(driver, batch):
                         obs_props[k] = json.dumps(v)
                 if 'metadata' in observation:
                     obs_props.update(deep_flatten(observation['metadata'], parent_key='metadata'))
+                flatten_seconds += time.perf_counter() - flatten_start
 
                 # The observation will always need
                 all_nodes.append({'labels': [observation['node_type']], 'properties': obs_props})
@@ -119,17 +168,28 @@ def process_batch(driver, batch):
                         else:
                             label, rel_type = cfg['node_type'], cfg['relationship_type']
 
+                        # Merge on the canonical value, the observed one is kept on the relationship
+                        rel_props = {}
+                        if normalizer is not None:
+                            normalize_start = time.perf_counter()
+                            raw_value = value
+                            value = normalizer.normalize(node_type, label, raw_value)
+                            if value != raw_value:
+                                rel_props['raw_value'] = raw_value
+                            normalize_seconds += time.perf_counter() - normalize_start
+
                         # Only create the node if it doesn't already exist
                         if value not in created_node_values_dict[label]:
                             created_node_values_dict[label].add(value)
                             all_nodes.append({'labels': [label],
-                                              'properties': {cfg['value_field']: value, **node_props}})
+                                              'properties': {**node_props, cfg['value_field']: value}})
 
                         # Still need to create the relationship
                         all_relationships.append({
                             'start_node': {'labels': [observation['node_type']], 'properties': {'id': observation['id']}},
                             'end_node':   {'labels': [label], 'properties': {cfg['value_field']: value}},
-                            'type':       rel_type
+                            'type':       rel_type,
+                            'properties': rel_props
                         })
 
             # ───────────────────── split relationships by type ────────────────────────
@@ -150,38 +210,50 @@ def process_batch(driver, batch):
                         'end_val':   end_val,
                         'properties': r.get('properties', {})
                     })
+            # The flattening and normalization are part of the build, they are also reported on their own
+            ingest_profile.add_time('build_batch', time.perf_counter() - build_start)
+            ingest_profile.add_time('build_batch.deep_flatten', flatten_seconds)
+            if normalizer is not None:
+                ingest_profile.add_time('build_batch.normalize', normalize_seconds)
 
             # ─── create indices for new end_labels ───
             new_end_labels = batch_end_labels - created_end_label_indices
             if new_end_labels:
-                for end_label in new_end_labels:
-                    if end_label not in created_end_label_indices:
-                        create_indexes(driver, [end_label])
-                        created_end_label_indices.add(end_label)
+                with ingest_profile.stage('create_indexes'):
+                    for end_label in new_end_labels:
+                        if end_label not in created_end_label_indices:
+                            create_indexes(driver, [end_label])
+                            created_end_label_indices.add(end_label)
 
             # ──────────────────────────── bulk node merge ─────────────────────────────
             nodes_by_label = defaultdict(list)
             for n in all_nodes:
                 nodes_by_label[n['labels'][0]].append(n['properties'])
 
-            for label, nodes in nodes_by_label.items():
-                query = f"""
-                    UNWIND $rows AS props
-                    MERGE (n:`{label}` {{ value: props.value }})
-                    SET n += props
-                    RETURN count(n)
-                """
-                session.run(query, rows=nodes)
+            with ingest_profile.stage('merge_nodes'):
+                for label, nodes in nodes_by_label.items():
+                    query = f"""
+                        UNWIND $rows AS props
+                        MERGE (n:`{label}` {{ value: props.value }})
+                        SET n += props
+                        RETURN count(n)
+                    """
+                    # Consumed here so the time of the query isn't charged to the next one
+                    with ingest_profile.stage(f'merge_nodes.{label}'):
+                        session.run(query, rows=nodes).consume()
+                    ingest_profile.rows_per_label[label] += len(nodes)
 
             # ── fast has_observation edges (with index hints) ──
             if has_obs:
-                session.run("""
-                    UNWIND $rels AS rel
-                    MATCH (start:source {value: rel.start_val})
-                    MATCH (end:observation_of_identity {value: rel.end_id})
-                    CREATE (start)-[:has_observation]->(end)
-                    RETURN count(*)
-                """, rels=has_obs)
+                with ingest_profile.stage('create_has_observation'):
+                    session.run("""
+                        UNWIND $rels AS rel
+                        MATCH (start:source {value: rel.start_val})
+                        MATCH (end:observation_of_identity {value: rel.end_id})
+                        CREATE (start)-[:has_observation]->(end)
+                        RETURN count(*)
+                    """, rels=has_obs).consume()
+                ingest_profile.rows_per_relationship_type['has_observation'] += len(has_obs)
 
             # ─── group remaining rels and insert in series ───
             grouped = defaultdict(list)
@@ -199,15 +271,42 @@ def process_batch(driver, batch):
                         RETURN count(*)
                     """
                     with driver.session() as s:
-                        s.run(cypher, rels=rels)
+                        s.run(cypher, rels=rels).consume()
                 except Exception as e:
                     logger.error(f"Error creating {rel_type} rels: {e}")
 
             # Process each label group in series
-            for (rel_type, end_label, end_key), rels in grouped.items():
-                create_rel_block(rel_type, end_label, end_key, rels)
-
-        return len(batch), time.time() - start_time
+            with ingest_profile.stage('create_relationships'):
+                for (rel_type, end_label, end_key), rels in grouped.items():
+                    with ingest_profile.stage(f'create_relationships.{rel_type}'):
+                        create_rel_block(rel_type, end_label, end_key, rels)
+                    ingest_profile.rows_per_relationship_type[rel_type] += len(rels)
+
+            # ─── incremental persona clusters ───
+            if persona_store is not None:
+                with ingest_profile.stage('persona_store'):
+                    observation_identifiers = {observation['id']: [] for observation in batch}
+                    for r in other_rels:
+                        observation_identifiers[r['start_id']].append((r['end_label'], r['end_val']))
+                    write_persona_changes(driver, persona_store.update(observation_identifiers))
+                    persona_store.commit()
+
+            # ─── watchlist alerts ───
+            if watchlist is not None:
+                with ingest_profile.stage('watchlist'):
+                    watchlist.check_batch(batch, other_rels)
+
+            # ─── observation overlap projection ───
+            if MAINTAIN_OVERLAP_PROJECTION:
+                with ingest_profile.stage('overlap_projection'):
+                    update_overlap_projection(session, [observation['id'] for observation in batch],
+                                              OVERLAP_HUB_THRESHOLD, OVERLAP_EXCLUDED_LABELS)
+
+        processing_time = time.time() - start_time
+        ingest_profile.batch_seconds.append(round(processing_time, 4))
+        ingest_profile.count('batches')
+        ingest_profile.count('observations', len(batch))
+        return len(batch), processing_time
 
     except Exception as e:
         logger.error(f"Error processing batch: {e}")
@@ -221,6 +320,13 @@ def create_indexes(driver, node_types):
         for node_type in node_types:
             session.run(f"CREATE INDEX IF NOT EXISTS FOR (n:{node_type}) ON (n.value)")
     logger.info(f"Indexes created for {node_types}")
+
+
+def create_observation_date_index(driver):
+    # Range index so date-windowed searches seek the observations of the window instead of scanning them all
+    with driver.session() as session:
+        session.run("CREATE RANGE INDEX IF NOT EXISTS FOR (n:observation_of_identity) ON (n.observation_date)")
+    logger.info("Index created for observation_of_identity.observation_date")
     
 
 def create_constraints(driver, node_types):
@@ -233,11 +339,23 @@ def create_constraints(driver, node_types):
 
 
 def main():
+    # Optionally profile the whole load, the stage timings are always collected
+    profiler = SamplingProfiler(PROFILER, PROFILE_OUTPUT_FILE) if PROFILER else None
+    if profiler is not None:
+        profiler.start()
+
     ################################################################################################
     # Connect to Neo4j
     ################################################################################################
     try:
-        driver = GraphDatabase.driver(NEO4J_ENDPOINT, auth=(NEO4J_USERNAME, NEO4J_PASSWORD))
+        # Every session shares one bookmark manager, so the bookmarks of the whole load can be handed to the app
+        bookmarking_driver = BookmarkingDriver(GraphDatabase.driver(NEO4J_ENDPOINT, auth=(NEO4J_USERNAME, NEO4J_PASSWORD)))
+        driver = bookmarking_driver
+        # Every query is timed and the slow ones are logged with their plan
+        slow_query_log = None
+        if SLOW_QUERY_THRESHOLD > 0:
+            slow_query_log = SlowQueryLog(SLOW_QUERY_LOG_FILE, SLOW_QUERY_THRESHOLD, SLOW_QUERY_LOG_MAX_BYTES, SLOW_QUERY_LOG_BACKUPS)
+            driver = SlowQueryDriver(driver, slow_query_log)
         # Test the connection
         with driver.session() as session:
             session.run("RETURN 1")
@@ -256,11 +374,14 @@ def main():
     elif args.live_data:
         logger.info(f"Loading live data from {LIVE_DATA_FOLDER}")
         files = get_all_files(LIVE_DATA_FOLDER)
+    elif BUILD_PERSONA_CLUSTERS or BUILD_OVERLAP_PROJECTION or BUILD_SOURCE_OVERLAP_MATRIX:
+        logger.info("No data source specified, only building derived data")
+        files = []
     else:
         logger.error("No data source specified")
         return
     logger.info(f"Found {len(files)} file(s) to process")
-    if not files:
+    if not files and not (BUILD_PERSONA_CLUSTERS or BUILD_OVERLAP_PROJECTION or BUILD_SOURCE_OVERLAP_MATRIX):
         logger.error("No files found to process")
         return
 
@@ -281,8 +402,22 @@ def main():
     ################################################################################################
     # Create indexes
     ################################################################################################
-    create_constraints(driver, ['observation_of_identity', 'source'])
-    create_indexes(driver, NODE_SCHEMAS.keys())
+    with ingest_profile.stage('create_indexes'):
+        create_constraints(driver, ['observation_of_identity', 'source'])
+        create_indexes(driver, NODE_SCHEMAS.keys())
+        create_observation_date_index(driver)
+
+    # Persona clusters are updated while loading if a persona store is given
+    persona_store = None
+    if PERSONA_STORE_FILE:
+        logger.info(f"Updating persona clusters incrementally using {PERSONA_STORE_FILE}")
+        persona_store = PersonaStore(PERSONA_STORE_FILE, PERSONA_HUB_THRESHOLD, PERSONA_EXCLUDED_LABELS)
+        create_persona_index(driver)
+
+    # Identifiers are merged on their canonical value if normalizing
+    normalizer = IdentifierNormalizer(default_normalizers(DEFAULT_PHONE_COUNTRY_CODE)) if NORMALIZE_IDENTIFIERS else None
+    # Every loaded identifier is checked against the watchlist if one is given, by its canonical value if normalizing
+    watchlist = Watchlist(WATCHLIST_FILE, WATCHLIST_ALERTS_FILE, normalizer) if WATCHLIST_FILE else None
 
 
     ################################################################################################
@@ -298,19 +433,30 @@ def main():
             total_start_time = time.time()
             total_processed = 0
             
-            with open(observations_file, 'r') as f:
+            ingest_profile.count('files')
+            ingest_profile.count('bytes_read', Path(observations_file).stat().st_size)
+            with open_observations_file(observations_file) as f:
                 # Count the number of lines in the file
-                num_lines = sum(1 for _ in f)
+                with ingest_profile.stage('count_lines'):
+                    num_lines = sum(1 for _ in f)
                 f.seek(0)  # Reset file pointer to the beginning
                 # Calculate total number of batches (ceiling division)
                 total_batches = (num_lines + BATCH_SIZE - 1) // BATCH_SIZE
 
+                # Reading and parsing are timed line by line but reported once per batch
+                read_seconds = 0.0
+                parse_seconds = 0.0
+                read_start = time.perf_counter()
                 for line_num, line in enumerate(f, 1):
+                    read_seconds += time.perf_counter() - read_start
                     if not line.strip():
+                        read_start = time.perf_counter()
                         continue
                     
                     try:
+                        parse_start = time.perf_counter()
                         observation = json.loads(line.strip())
+                        parse_seconds += time.perf_counter() - parse_start
                         current_batch.append(observation)
                         
                         if len(current_batch) >= BATCH_SIZE:
@@ -322,8 +468,13 @@ def main():
                             if batch_counter == 1:
                                 logger.info(f"Starting to process batch {batch_counter} of {total_batches}...")
 
+                            # Time spent filling the batch, i.e. the writer waiting on the reader
+                            ingest_profile.add_time('read_lines', read_seconds)
+                            ingest_profile.add_time('json_parse', parse_seconds)
+                            read_seconds = parse_seconds = 0.0
+
                             # Process the batch
-                            num_nodes, processing_time = process_batch(driver, current_batch)
+                            num_nodes, processing_time = process_batch(driver, current_batch, persona_store, watchlist, normalizer)
                             total_processed += num_nodes
                             
                             # Calculate ETA
@@ -354,6 +505,9 @@ def main():
                     except Exception as e:
                         logger.error(f"Error processing line {line_num}: {str(e)}")
                         raise
+                    read_start = time.perf_counter()
+                ingest_profile.add_time('read_lines', read_seconds)
+                ingest_profile.add_time('json_parse', parse_seconds)
                 
                 # Process any remaining observations
                 if current_batch:
@@ -362,7 +516,7 @@ def main():
                     end_obs = num_lines
                     
                     # Process the final batch
-                    num_nodes, processing_time = process_batch(driver, current_batch)
+                    num_nodes, processing_time = process_batch(driver, current_batch, persona_store, watchlist, normalizer)
                     total_processed += num_nodes
                     
                     # Calculate final stats
@@ -375,7 +529,8 @@ def main():
             
             # Print summary
             logger.info("Final Graph State:")
-            print_graph_summary(driver)
+            with ingest_profile.stage('graph_summary'):
+                print_graph_summary(driver)
             
             # Print total processing time
             total_processing_time = time.time() - total_start_time
@@ -388,6 +543,40 @@ def main():
             import traceback
             logger.error(traceback.format_exc())
 
+    ################################################################################################
+    # Build persona clusters
+    ################################################################################################
+    if BUILD_PERSONA_CLUSTERS:
+        with ingest_profile.stage('build_persona_clusters'):
+            build_persona_clusters(driver, PERSONA_HUB_THRESHOLD, PERSONA_EXCLUDED_LABELS, persona_store)
+    if persona_store is not None:
+        persona_store.close()
+    if watchlist is not None:
+        logger.info(f"{watchlist.num_alerts} watchlist matches written to {WATCHLIST_ALERTS_FILE}")
+        watchlist.close()
+    if normalizer is not None:
+        logger.info(f"Normalized {normalizer.num_changed} identifier values")
+        logger.debug(f"Normalizer cache statistics: {normalizer.cache_info()}")
+
+    ################################################################################################
+    # Build the observation overlap projection
+    ################################################################################################
+    if BUILD_OVERLAP_PROJECTION:
+        with ingest_profile.stage('build_overlap_projection'):
+            build_overlap_projection(driver, OVERLAP_HUB_THRESHOLD, OVERLAP_EXCLUDED_LABELS)
+
+    ################################################################################################
+    # Build the source overlap matrix
+    ################################################################################################
+    if BUILD_SOURCE_OVERLAP_MATRIX:
+        with ingest_profile.stage('build_source_overlap_matrix'):
+            build_source_overlap_matrix(driver, SOURCE_OVERLAP_EXCLUDED_LABELS)
+
+    ################################################################################################
+    # Hand the bookmarks of the load to the app
+    ################################################################################################
+    write_load_bookmarks(LOAD_BOOKMARKS_FILE, bookmarking_driver.bookmarks())
+
     ################################################################################################
     # Close the connection to Neo4j
     ################################################################################################
@@ -395,6 +584,19 @@ def main():
         driver.close()
         logger.info("Disconnected from Neo4j successfully!")
 
+    ################################################################################################
+    # Write the ingest report
+    ################################################################################################
+    if profiler is not None:
+        profiler.stop()
+    if normalizer is not None:
+        ingest_profile.count('normalized_values', normalizer.num_changed)
+    if watchlist is not None:
+        ingest_profile.count('watchlist_alerts', watchlist.num_alerts)
+    if slow_query_log is not None:
+        ingest_profile.count('slow_queries', slow_query_log.num_slow_queries)
+    ingest_profile.write(INGEST_REPORT_FILE, {k: v for k, v in vars(args).items() if k != 'neo4j_password'})
+
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file